@@ -44,6 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.TimingMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.deadline.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -129,11 +133,162 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 LOGIN_URL = '/api-auth/login'
 
+# Number of seconds during which the local order projection
+# may be used to answer conditional GETs without asking the ledger.
+# Set PROJECTION_MAX_AGE to an empty value to trust it indefinitely,
+# e.g. when this app is the only one writing orders to the ledger.
+PROJECTION_MAX_AGE = os.getenv('PROJECTION_MAX_AGE', '300')
+PROJECTION_MAX_AGE = int(PROJECTION_MAX_AGE) if PROJECTION_MAX_AGE else None
+
+# Waiting for changes to orders (in seconds):
+# maximum duration of a long-polling call,
+# interval for checking the change log for changes made by other processes,
+# and maximum duration of a server-sent event stream.
+CHANGES_LONG_POLL_TIMEOUT = int(os.getenv('CHANGES_LONG_POLL_TIMEOUT', 25))
+CHANGES_POLL_INTERVAL = int(os.getenv('CHANGES_POLL_INTERVAL', 5))
+CHANGES_STREAM_DURATION = int(os.getenv('CHANGES_STREAM_DURATION', 300))
+# Maximum number of long-polling and streaming requests per process; each
+# holds a thread while it waits, see api/views/ChangeViews.py
+CHANGES_MAX_WAITING = int(os.getenv('CHANGES_MAX_WAITING', 16))
+
+# Webhook deliveries, see api/webhooks.py
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 50))
+WEBHOOK_BATCH_INTERVAL = float(os.getenv('WEBHOOK_BATCH_INTERVAL', 1))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))
+WEBHOOK_BACKOFF = float(os.getenv('WEBHOOK_BACKOFF', 1))
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 5))
+# Upper bound of the max_concurrency a subscription may ask for
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', 4))
+# Allow webhooks to loopback and private addresses, e.g. for local development
+WEBHOOK_ALLOW_PRIVATE = os.getenv('WEBHOOK_ALLOW_PRIVATE', 'False').lower() in ('true', '1', 'yes')
+
+# Seconds for which a user's active SLP IDs are cached, see api/identity.py
+SLP_ID_CACHE_TTL = int(os.getenv('SLP_ID_CACHE_TTL', 60))
+
+# Number of threads making ledger calls concurrently for a request or
+# command, see api/slp_helpers.py and the reconcile and audit_shapes commands
+SLP_MAX_WORKERS = int(os.getenv('SLP_MAX_WORKERS', 8))
+
+# Seconds a request may spend, after which its ledger calls fail with
+# HTTP 504 (0 for no deadline), see api/deadline.py. Views can set their
+# own with a `deadline` attribute.
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 30)) or None
+# Timeouts of a single ledger call, in seconds
+SLP_TIMEOUT = float(os.getenv('SLP_TIMEOUT', 10))
+SLP_CONNECT_TIMEOUT = float(os.getenv('SLP_CONNECT_TIMEOUT', 3))
+# Fail ledger calls at once for SLP_BREAKER_RESET seconds after
+# SLP_BREAKER_FAILURES consecutive failures (0 to never), see api/circuit_breaker.py
+SLP_BREAKER_FAILURES = int(os.getenv('SLP_BREAKER_FAILURES', 5))
+SLP_BREAKER_RESET = float(os.getenv('SLP_BREAKER_RESET', 10))
+
+# Adapt the number of concurrent ledger calls per process to the ledger's
+# latency, separately for reads and writes, see api/concurrency_limiter.py
+SLP_CONCURRENCY_LIMIT = os.getenv('SLP_CONCURRENCY_LIMIT', 'True').lower() in ('true', '1', 'yes')
+SLP_LIMIT_INITIAL = int(os.getenv('SLP_LIMIT_INITIAL', 8))
+SLP_LIMIT_MIN = int(os.getenv('SLP_LIMIT_MIN', 1))
+SLP_LIMIT_MAX = int(os.getenv('SLP_LIMIT_MAX', 64))
+# Calls slower than this many times the usual latency count as overload
+SLP_LIMIT_TOLERANCE = float(os.getenv('SLP_LIMIT_TOLERANCE', 2))
+# Factor the limit is multiplied by on overload
+SLP_LIMIT_BACKOFF = float(os.getenv('SLP_LIMIT_BACKOFF', 0.8))
+# Seconds a call waits for a slot, and number of calls that may wait, before calls are shed
+SLP_LIMIT_QUEUE_TIMEOUT = float(os.getenv('SLP_LIMIT_QUEUE_TIMEOUT', 5))
+SLP_LIMIT_MAX_QUEUE = int(os.getenv('SLP_LIMIT_MAX_QUEUE', 100))
+
+# Cache shared by the worker processes, used to invalidate in-process caches.
+# Defaults to a per-process memory cache; point CACHE_BACKEND / CACHE_LOCATION
+# at e.g. memcached when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Maximum number of seconds between checks for changed settings,
+# see api/settings_registry.py
+SETTINGS_VERSION_CHECK_INTERVAL = float(os.getenv('SETTINGS_VERSION_CHECK_INTERVAL', 1))
+# Seconds between checks whether other processes invalidated the
+# token or SLP ID caches, see api/shared_version.py
+CACHE_VERSION_CHECK_INTERVAL = float(os.getenv('CACHE_VERSION_CHECK_INTERVAL', 1))
+
+# Seconds for which authentication tokens are cached, and the maximum
+# number of cached tokens, see api/authentication.py
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 30))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+
+# Pool of ledger identities created in advance for new users,
+# see api/identity_pool.py. A size of 0 disables the pool.
+IDENTITY_POOL_SIZE = int(os.getenv('IDENTITY_POOL_SIZE', 0))
+IDENTITY_POOL_LOW_WATERMARK = int(os.getenv('IDENTITY_POOL_LOW_WATERMARK', IDENTITY_POOL_SIZE // 2))
+IDENTITY_POOL_WORKERS = int(os.getenv('IDENTITY_POOL_WORKERS', 4))
+
+# Validate orders and events against their SHACL shapes
+# before publishing them, see api/shacl.py
+SHACL_LOCAL_VALIDATION = os.getenv('SHACL_LOCAL_VALIDATION', 'True').lower() in ('true', '1', 'yes')
+# Maximum number of graphs per bulk validation call
+SHACL_BULK_MAX = int(os.getenv('SHACL_BULK_MAX', 1000))
+
+# Ontology whose subclass relations are used in type checks, see api/ontology.py
+ONTOLOGY_FILE = os.getenv('ONTOLOGY_FILE', os.path.join(BASE_DIR, 'api', 'semantics', 'ftl_onto.owl'))
+
+# Break the time of every request down into ledger calls, RDF processing
+# and database queries, reported in a Server-Timing header and logged
+# by the api.timing logger, see api/timing.py
+REQUEST_TIMING = os.getenv('REQUEST_TIMING', 'False').lower() in ('true', '1', 'yes')
+# Log requests taking longer than this many seconds (off when 0), with every
+# ledger call they made, to the rotating file SLOW_REQUEST_LOG, with the
+# pid of the process inserted before the extension, see api/timing.py
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 0))
+SLOW_REQUEST_LOG = os.getenv('SLOW_REQUEST_LOG', os.path.join(BASE_DIR, 'slow_requests.log'))
+SLOW_REQUEST_LOG_MAX_BYTES = int(os.getenv('SLOW_REQUEST_LOG_MAX_BYTES', 10 * 1024 * 1024))
+SLOW_REQUEST_LOG_BACKUPS = int(os.getenv('SLOW_REQUEST_LOG_BACKUPS', 5))
+
+# Metrics served at /metrics, see api/metrics.py. With several worker
+# processes, set METRICS_DIR to a directory (emptied on every deployment)
+# where each process writes its metrics every METRICS_FLUSH_INTERVAL seconds
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# Serve /metrics without authentication, e.g. when only reachable internally
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', 'False').lower() in ('true', '1', 'yes')
+
+# Profile requests that carry an X-Profile header equal to PROFILING_SECRET,
+# and a PROFILING_SAMPLE_RATE fraction of all requests, storing the profiles
+# in PROFILING_DIR (off when unset), see api/profiling.py
+PROFILING_DIR = os.getenv('PROFILING_DIR') or None
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+# 'pstats' (cProfile) or 'collapsed' (sampled stacks, for flame graphs)
+PROFILING_FORMAT = os.getenv('PROFILING_FORMAT', 'pstats')
+# Seconds between stack samples of the 'collapsed' format
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', 0.005))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        # A file per process, opened on its first slow request only
+        'slow_requests': {
+            'class': 'api.timing.ProcessRotatingFileHandler',
+            'filename': SLOW_REQUEST_LOG,
+            'maxBytes': SLOW_REQUEST_LOG_MAX_BYTES,
+            'backupCount': SLOW_REQUEST_LOG_BACKUPS,
+        },
+    },
+    'loggers': {
+        'api.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'api.slow_requests': {'handlers': ['slow_requests'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # REST config
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     )
 }
@@ -18,9 +18,12 @@ from django.urls import path
 from django.conf.urls import include
 from django.views.generic.base import RedirectView
 
+from api.views.MetricsViews import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/', include('api.urls'), name='api'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('', RedirectView.as_view(url='api/docs/', permanent=True), name='index')
 ]
@@ -9,6 +9,7 @@ import api.semantics as semantics
 from rest_framework.response import Response
 from rest_framework import status as http_status
 
+from api.deadline import LedgerUnavailable
 from api.status.status import Status
 
 def checkLogic(listOfChecks):
@@ -45,6 +46,8 @@ def asset_exists(asset_id):
     """
     try:
         slp_helpers.get_asset(asset_id)
+    except LedgerUnavailable:
+        raise
     except Exception as e:
         return Response(str(e), status=http_status.HTTP_400_BAD_REQUEST)
 
@@ -58,6 +61,37 @@ def asset_has_type(asset_id, semantic_type):
         asset = slp_helpers.get_asset(asset_id)
         if not semantics.has_type(semantic_type, asset):
             return Response('Asset is not of type {}'.format(str(semantic_type)), status=http_status.HTTP_400_BAD_REQUEST)
+    except LedgerUnavailable:
+        raise
+    except Exception as e:
+        return Response(str(e), status=http_status.HTTP_400_BAD_REQUEST)
+
+def asset_fetched(asset_future):
+    """
+    Given a Future for an asset retrieval (see slp_helpers.submit),
+    confirm that the asset exists on the ledger.
+
+    Counterpart of asset_exists for assets that were already requested.
+    """
+    try:
+        asset_future.result()
+    except LedgerUnavailable:
+        raise
+    except Exception as e:
+        return Response(str(e), status=http_status.HTTP_400_BAD_REQUEST)
+
+def fetched_asset_has_type(asset_future, semantic_type):
+    """
+    Given a Future for an asset retrieval and a semantic type, confirm
+    that the asset's rdf contains a subject of the given type.
+
+    Counterpart of asset_has_type for assets that were already requested.
+    """
+    try:
+        if not semantics.has_type(semantic_type, asset_future.result()):
+            return Response('Asset is not of type {}'.format(str(semantic_type)), status=http_status.HTTP_400_BAD_REQUEST)
+    except LedgerUnavailable:
+        raise
     except Exception as e:
         return Response(str(e), status=http_status.HTTP_400_BAD_REQUEST)
 
@@ -75,6 +109,8 @@ def asset_status_equals(asset_id, target_status, status_class):
     """
     try:
         actual_status = status_class.get_status(asset_id)
+    except LedgerUnavailable:
+        raise
     except Exception as e:
         return Response('Cannot ascertain asset status',
             status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -95,6 +131,8 @@ def asset_status_not_equals(asset_id, avoid_statuses, status_class):
     # get status in the context of a status class
     try:
         actual_status = status_class.get_status(asset_id)
+    except LedgerUnavailable:
+        raise
     except Exception as e:
         return Response('Cannot ascertain asset status: {}'.format(str(e)),
             status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,137 @@
+"""
+Authentication classes for the API views.
+
+CachedTokenAuthentication is a drop-in replacement for DRF's
+TokenAuthentication. Clients such as event producers make many calls
+with the same few tokens, so resolving a token to its user is cached
+in process for TOKEN_CACHE_TTL seconds (at most TOKEN_CACHE_SIZE tokens,
+least recently used first out), instead of querying Token and User
+on every request.
+
+Entries are dropped when their token is deleted, e.g. when it is rotated
+by CreateTokenViews.put, and when their user is saved or deleted
+(see api/signals/handlers.py). Since those signals only reach the current
+process, they also bump a version in the shared cache, upon which other
+processes drop all their entries within CACHE_VERSION_CHECK_INTERVAL
+seconds (see api/shared_version.py). Lookups that started before an
+invalidation are not cached.
+"""
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+from api.shared_version import SharedVersion
+
+VERSION_KEY = 'token_cache:version'
+
+
+class TokenCache(object):
+    """
+    A thread-safe, size-bounded map from token keys to (user, token)
+    pairs with a time-to-live, that counts hits and misses.
+    """
+
+    def __init__(self, ttl=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = SharedVersion(VERSION_KEY)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented on every invalidation, see set()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if self.version.changed():
+            # Another process invalidated some entries
+            self.clear()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, user, token, generation):
+        """
+        Cache @user and @token, looked up when the cache was at @generation.
+        If entries were invalidated since, the lookup may be stale and is dropped.
+        """
+        ttl = self.ttl if self.ttl is not None else settings.TOKEN_CACHE_TTL
+        max_size = self.max_size or settings.TOKEN_CACHE_SIZE
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, user, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_key(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+        self.version.bump()
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1].pk == user_id]:
+                del self._entries[key]
+            self.generation += 1
+        self.version.bump()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """
+        Return the cache metrics as a dict.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Cache shared by all threads in this process
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that caches the token lookup in process.
+    """
+    cache = token_cache
+
+    def authenticate_credentials(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            generation = self.cache.generation
+            # Raises AuthenticationFailed for unknown tokens and inactive users,
+            # which are therefore never cached
+            user, token = super().authenticate_credentials(key)
+            self.cache.set(key, user, token, generation)
+            cached = (user, token)
+        # Hand every request its own copy,
+        # so that changes made while handling one request cannot leak into others
+        user, token = cached
+        return copy.copy(user), token
@@ -0,0 +1,166 @@
+"""
+A module with the measurements behind `manage.py benchmark` and `manage.py loadgen`.
+
+Every benchmarked endpoint yields one summary: latency percentiles,
+throughput, ledger calls and database queries per request, and the
+peak memory allocated while handling a request. Summaries of two runs
+can be compared with compare(), which lists the metrics that got worse
+by more than a threshold.
+
+Under sustained load, latencies are collected in a Histogram instead,
+which takes constant memory however many requests are recorded.
+"""
+import bisect
+import math
+import threading
+
+
+# Metrics compared between runs: (name, higher is better, smallest change that counts).
+# The minimum changes keep timer noise on fast endpoints from being flagged.
+METRICS = (
+    ('p50', False, 0.001),
+    ('p95', False, 0.002),
+    ('p99', False, 0.005),
+    ('throughput', True, 1.0),
+    ('ledger_calls', False, 0.5),
+    ('db_queries', False, 0.5),
+    ('peak_memory', False, 64 * 1024),
+)
+
+
+def percentile(values, p):
+    """
+    Return the @p-th percentile (0-100) of the sorted list @values,
+    by the nearest-rank method, or None for an empty list.
+    """
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0, ledger_calls=0, db_queries=0, peak_memory=None):
+    """
+    Summarize the request @latencies (seconds), measured over @elapsed
+    seconds of wall time. The ledger calls and database queries are
+    totals over all requests; @peak_memory is in bytes.
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        'requests': count,
+        'errors': errors,
+        'mean': sum(values) / count if count else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else None,
+        'throughput': count / elapsed if elapsed > 0 else None,
+        'ledger_calls': ledger_calls / count if count else None,
+        'db_queries': db_queries / count if count else None,
+        'peak_memory': peak_memory,
+    }
+
+
+class QueryCounter(object):
+    """
+    Counts database queries, for use with connection.execute_wrapper().
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def compare(baseline, results, threshold=0.2):
+    """
+    Compare the endpoint summaries in @results with those in @baseline.
+    Returns a list of regressions: metrics that are worse than in the
+    baseline by more than the fraction @threshold.
+    Endpoints or metrics missing from either run are skipped.
+    """
+    regressions = []
+    for endpoint, summary in sorted(results.get('endpoints', {}).items()):
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if not before:
+            continue
+        for metric, higher_is_better, min_change in METRICS:
+            old, new = before.get(metric), summary.get(metric)
+            if old is None or new is None:
+                continue
+            change = old - new if higher_is_better else new - old
+            if change > min_change and change > threshold * abs(old):
+                regressions.append({
+                    'endpoint': endpoint,
+                    'metric': metric,
+                    'baseline': old,
+                    'current': new,
+                    'change': (new - old) / old if old else None,
+                })
+    return regressions
+
+
+class Histogram(object):
+    """
+    A thread-safe latency histogram with logarithmic buckets.
+
+    Bucket bounds grow by a factor @growth from @lowest seconds up to
+    @highest seconds, so percentiles are accurate to within that factor
+    at any scale. Larger values are counted in the last bucket.
+    """
+
+    def __init__(self, lowest=0.0005, highest=120, growth=1.1):
+        self.bounds = []
+        bound = lowest
+        while bound < highest:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(highest)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        index = min(bisect.bisect_left(self.bounds, value), len(self.bounds) - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket holding the @p-th percentile,
+        or None if nothing was recorded.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+            seen = 0
+            for bound, count in zip(self.bounds, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Return the percentiles and the non-empty buckets, as (upper bound, count) pairs.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max if self.count else None,
+            'buckets': [(round(bound, 6), count) for bound, count in zip(self.bounds, self.counts) if count],
+        }
@@ -0,0 +1,84 @@
+"""
+A module that stops calling the ledger while it is failing.
+
+When the ledger is down or overloaded, every request would still wait
+for its calls to time out, tying up workers and adding load to a node
+that is trying to recover. The CircuitBreaker counts consecutive failed
+ledger calls (connection errors, timeouts and HTTP 5xx answers). After
+SLP_BREAKER_FAILURES of them it opens: for SLP_BREAKER_RESET seconds,
+ledger calls fail at once with CircuitOpen (HTTP 503). After that a
+single call is let through as a probe; if it succeeds the breaker
+closes, otherwise it opens again.
+
+The breaker is per process; see SlpInterface._request for its use.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from api.deadline import LedgerUnavailable
+
+
+class CircuitOpen(LedgerUnavailable):
+    default_detail = "The ledger is failing, try again later"
+    default_code = 'circuit_open'
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failures=None, reset=None):
+        # Read from the settings on use unless given
+        self._failures = failures
+        self._reset = reset
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def failures(self):
+        return self._failures if self._failures is not None else settings.SLP_BREAKER_FAILURES
+
+    @property
+    def reset(self):
+        return self._reset if self._reset is not None else settings.SLP_BREAKER_RESET
+
+    def before_call(self):
+        """
+        Raise CircuitOpen if the ledger should not be called now.
+        """
+        if self.state == self.CLOSED or not self.failures:
+            return
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset:
+                # Let this call through as the probe
+                self.state = self.HALF_OPEN
+                return
+        raise CircuitOpen()
+
+    def succeeded(self):
+        if self.state == self.CLOSED and not self.consecutive_failures:
+            return
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def abandoned(self):
+        """
+        A call ended without telling whether the ledger works; if it was
+        the probe, the next call is let through as the probe instead.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def failed(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.failures and self.consecutive_failures >= self.failures):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
@@ -0,0 +1,160 @@
+"""
+A module that adapts the number of concurrent ledger calls to the ledger's latency.
+
+When bursts of events slowed the SLP node down, workers kept adding
+concurrent requests, which slowed it down further. SlpInterface._request
+now takes a slot from a ConcurrencyLimiter before every call, with
+separate lanes for writes (publish, transfer, create_id) and reads, so
+that a backlog of one does not starve the other.
+
+Each lane adjusts its limit AIMD-style:
+- every call that completes without a sign of overload raises the limit
+  by 1 / limit, i.e. by about one per limit's worth of calls, as long as
+  the lane is actually using at least half of it;
+- a call that fails (timeout, connection error, HTTP 5xx), or that took
+  longer than SLP_LIMIT_TOLERANCE times the usual latency of its
+  operation, multiplies the limit by SLP_LIMIT_BACKOFF. Calls that
+  started before the last decrease do not decrease it again, so that one
+  slow spell shrinks the limit once rather than once per call in flight.
+The usual latency is the lowest one seen per operation, so that slow
+operations such as history queries are not taken for overload and no
+absolute latency target needs to be configured. It creeps up over
+minutes, however many calls are made, so that sustained overload is not
+taken for the usual latency. Calls that are slow while no more than
+SLP_LIMIT_MIN calls are in flight from start to end are not slowed down
+by our own load, so their latency becomes the usual one.
+
+Calls over the limit wait for a slot, for up to SLP_LIMIT_QUEUE_TIMEOUT
+seconds or until the request's deadline (see api/deadline.py). Calls that
+would wait longer, or would join a queue of SLP_LIMIT_MAX_QUEUE waiting
+calls, are shed with LedgerOverloaded (HTTP 503).
+Limits are per process; with several worker processes, the ledger sees
+their sum.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from api.deadline import LedgerUnavailable
+import api.deadline as deadline
+
+WRITE_OPERATIONS = frozenset(('publish', 'transfer', 'create_id'))
+
+# Fraction per second by which the usual latency of an operation may grow
+BASELINE_GROWTH = 0.001
+# Seconds within which latencies never count as overload,
+# so that the jitter of fast calls is ignored
+MIN_SLOWDOWN = 0.05
+
+
+class LedgerOverloaded(LedgerUnavailable):
+    default_detail = "The ledger is overloaded, try again later"
+    default_code = 'ledger_overloaded'
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limits the concurrent calls of one lane, see the module documentation.
+    """
+
+    def __init__(self, lane, initial=None, minimum=None, maximum=None):
+        self.lane = lane
+        self.minimum = minimum if minimum is not None else settings.SLP_LIMIT_MIN
+        self.maximum = maximum if maximum is not None else settings.SLP_LIMIT_MAX
+        self.limit = float(initial if initial is not None else settings.SLP_LIMIT_INITIAL)
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        # operation: (usual latency in seconds, time.monotonic() it was set)
+        self.baselines = {}
+        self._decreased = float('-inf')
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a slot, and raise LedgerOverloaded when there is none in time.
+        Returns the number of calls in flight, including this one.
+        """
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return self.in_flight
+            if self.waiting >= settings.SLP_LIMIT_MAX_QUEUE:
+                self.shed += 1
+                raise LedgerOverloaded()
+
+            wait = settings.SLP_LIMIT_QUEUE_TIMEOUT
+            left = deadline.remaining()
+            if left is not None:
+                wait = min(wait, left)
+            end = time.monotonic() + wait
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    wait = end - time.monotonic()
+                    if wait <= 0:
+                        self.shed += 1
+                        raise LedgerOverloaded()
+                    self._condition.wait(wait)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            return self.in_flight
+
+    def release(self, operation, latency, failed=False, started_with=None):
+        """
+        Free the slot of a call of @operation that took @latency seconds,
+        and adjust the limit. @failed tells whether the call failed in a
+        way that indicates overload; None if it did not tell at all, e.g.
+        when it was cut short by the request's deadline. @started_with is
+        what acquire() returned for the call.
+        """
+        with self._condition:
+            # Usage before this call ends
+            busy = self.in_flight
+            alone = max(busy, started_with or busy) <= self.minimum
+            self.in_flight -= 1
+            if failed is not None:
+                now = time.monotonic()
+                baseline, updated = self.baselines.get(operation, (latency, now))
+                baseline = min(latency, baseline * (1 + BASELINE_GROWTH * (now - updated)))
+                self.baselines[operation] = (baseline, now)
+                slow = latency > baseline * settings.SLP_LIMIT_TOLERANCE and latency - baseline > MIN_SLOWDOWN
+                if slow and not failed and alone:
+                    # The ledger is slow by itself
+                    self.baselines[operation] = (latency, now)
+                    slow = False
+                if failed or slow:
+                    if now - latency >= self._decreased:
+                        self.limit = max(self.minimum, self.limit * settings.SLP_LIMIT_BACKOFF)
+                        self._decreased = now
+                elif busy * 2 >= self.limit:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify(max(0, int(self.limit) - self.in_flight))
+
+
+# Shared by all threads of this process
+lanes = {
+    'read': None,
+    'write': None,
+}
+_lanes_lock = threading.Lock()
+
+
+def lane(operation):
+    """
+    Return the ConcurrencyLimiter for calls of @operation,
+    or None if concurrency limiting is off.
+    """
+    if not settings.SLP_CONCURRENCY_LIMIT:
+        return None
+    name = 'write' if operation in WRITE_OPERATIONS else 'read'
+    limiter = lanes[name]
+    if limiter is None:
+        # Created on first use, once the settings are loaded
+        with _lanes_lock:
+            limiter = lanes[name]
+            if limiter is None:
+                limiter = lanes[name] = ConcurrencyLimiter(name)
+    return limiter
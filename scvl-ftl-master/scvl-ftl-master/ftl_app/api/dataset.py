@@ -0,0 +1,326 @@
+"""
+A module that generates synthetic ledger datasets for scale tests.
+
+Seeding a dataset of production size through the API takes hours, as
+every order, confirmation and event costs several ledger calls. Instead,
+a Dataset builds the ledger rows itself, in the form the fake ledger
+stores them (see api/fake_ledger.py), and LedgerStore.load() inserts
+them in bulk. Orders and events carry the same RDF as those made by
+Semantics.create_order and create_event; the JSON-LD is made once by
+those functions and then filled in per order, which is much faster
+than building an rdflib graph every time.
+
+A dataset is a pure function of its parameters: identity keys, orders,
+their lifecycles and transaction IDs all come from random generators
+seeded with the seed and the position in the dataset. The orders are
+split in chunks that can be generated in any order, by any process,
+and loading skips the chunks that are already in the store, so an
+interrupted run can simply be started again.
+
+Datasets are skewed like real ones:
+- customers and providers are drawn from a Zipf distribution with
+  exponent @skew, so a few identities own most orders (0 is uniform)
+- the number of events per confirmed order follows @event_distribution
+  ('fixed', 'poisson' or the heavy-tailed 'pareto'), with mean @events
+"""
+from datetime import datetime, timedelta, timezone
+import bisect
+import hashlib
+import itertools
+import json
+import math
+import random
+
+from api.semantics import Semantics
+from api.status.event_milestones import EventMilestones
+from api.status.order_status import OrderStatus
+import api.fake_ledger as fake_ledger
+
+DISTRIBUTIONS = ('fixed', 'poisson', 'pareto')
+
+PLACES = ('Soesterberg', 'Den Haag', 'Rotterdam', 'Utrecht', 'Amsterdam',
+          'Eindhoven', 'Venlo', 'Zwolle', 'Groningen', 'Tilburg')
+CARGO = (('General', 'Pallets'), ('General', 'Boxes'), ('Bulk', 'Containers'))
+
+# Stand-ins for the values of an order or event, replaced in the JSON-LD templates
+_TIMES = [datetime(1900, 1, 1, 0, 0, i, tzinfo=timezone.utc) for i in range(3)]
+_ORDER_INPUT = {
+    'cargo': {'cargo_type': '$cargo_type', 'package_type': '$package_type', 'package_count': 999999937},
+    'time_of_acceptance': _TIMES[0],
+    'place_of_acceptance': '$place_of_acceptance',
+    'time_of_delivery': _TIMES[1],
+    'place_of_delivery': '$place_of_delivery',
+    'reference_id': '$reference_id',
+}
+_EVENT_INPUT = {
+    'order_asset_id': '$order_asset_id',
+    'event': {'time': _TIMES[2], 'place': '$place', 'milestone': 999999929},
+}
+
+# Milestones of a completed trip; trips in progress stop early
+TRIP_START = (EventMilestones.LOAD, EventMilestones.DEPART)
+TRIP_END = (EventMilestones.ARRIVE, EventMilestones.DISCHARGE)
+
+
+def template(rdf):
+    """
+    Turn the JSON-LD @rdf into a template: blank node labels, which
+    rdflib picks at random, are replaced by fixed ones, so that
+    filling in the template is reproducible.
+    """
+    labels = {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            return {key: walk(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [walk(value) for value in node]
+        if isinstance(node, str) and node.startswith('_:'):
+            return labels.setdefault(node, '_:b{}'.format(len(labels)))
+        return node
+    return walk(rdf)
+
+
+def fill(rdf, values):
+    """
+    Return a copy of the template @rdf in which every value that is a
+    key of @values is replaced by the corresponding value.
+    """
+    if isinstance(rdf, dict):
+        return {key: fill(value, values) for key, value in rdf.items()}
+    if isinstance(rdf, list):
+        return [fill(value, values) for value in rdf]
+    return values.get(rdf, rdf)
+
+
+def poisson(rng, mean):
+    # Knuth's method; fine for the small means of events per order
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class Dataset(object):
+    """
+    A synthetic dataset of @orders orders between @identities ledger
+    identities, generated from @seed in chunks of @chunk_size orders.
+
+    Of the orders, a fraction @pending_ratio is never confirmed and a
+    fraction @reject_ratio is rejected; the rest are confirmed and get
+    events, of which a fraction @completed_ratio completes its trip.
+    Orders are accepted at random moments in the @days days from
+    @start. The CREATE transactions of orders name the shape asset
+    @order_shape and events name @event_shape, if given.
+    """
+
+    def __init__(self, seed=0, identities=100, orders=1000, events=5, event_distribution='poisson',
+                 skew=1.0, pending_ratio=0.1, reject_ratio=0.1, completed_ratio=0.5, chunk_size=1000,
+                 prefix='dataset', start=datetime(2019, 1, 1, tzinfo=timezone.utc), days=365,
+                 order_shape=None, event_shape=None):
+        if identities < 2:
+            raise ValueError("A dataset needs at least 2 identities")
+        if event_distribution not in DISTRIBUTIONS:
+            raise ValueError("Unknown distribution {}".format(event_distribution))
+        self.seed = seed
+        self.identities = identities
+        self.orders = orders
+        self.events = events
+        self.event_distribution = event_distribution
+        self.skew = skew
+        self.pending_ratio = pending_ratio
+        self.reject_ratio = reject_ratio
+        self.completed_ratio = completed_ratio
+        self.chunk_size = max(1, chunk_size)
+        self.prefix = prefix
+        self.start = start
+        self.days = days
+        self.order_shape = order_shape
+        self.event_shape = event_shape
+
+        semantics = Semantics()
+        self.order_template = template(semantics.create_order(_ORDER_INPUT, returns='dict'))
+        self.event_template = template(semantics.create_event(_EVENT_INPUT, returns='dict'))
+
+        # Names under which the loaded chunks are kept track of. Datasets
+        # with the same identities share them; the orders of datasets that
+        # differ in any way are drawn differently, so their rows never clash.
+        self.identities_name = self._name(seed, identities)
+        self.name = self._name(seed, identities, orders, events, event_distribution, skew,
+                               pending_ratio, reject_ratio, completed_ratio, self.chunk_size,
+                               start.isoformat(), days, order_shape, event_shape)
+        self._caches()
+
+    def _caches(self):
+        self._keys = {}
+        self._cum_weights = None
+
+    def __getstate__(self):
+        # Caches are rebuilt by each process, rather than pickled
+        state = dict(self.__dict__)
+        del state['_keys'], state['_cum_weights']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._caches()
+
+    def _name(self, *params):
+        return '{}-{}'.format(self.prefix, hashlib.sha256(json.dumps(params).encode()).hexdigest()[:16])
+
+    @property
+    def chunks(self):
+        return (self.orders + self.chunk_size - 1) // self.chunk_size
+
+    def random(self, *position):
+        return random.Random(':'.join(str(part) for part in (self.seed,) + position))
+
+    '''
+    Identities
+    '''
+    def username(self, index):
+        return '{}{}'.format(self.prefix, index)
+
+    def identity(self, index):
+        """
+        Return the fields of identity @index, as in SlpId.
+        """
+        if index not in self._keys:
+            rng = self.random('identity', index)
+            self._keys[index] = {
+                'slp_id': '{}_{}'.format(self.username(index), self.seed),
+                'public_key': fake_ledger.new_key(rng),
+                'private_key': fake_ledger.new_key(rng),
+                'received_public_key': fake_ledger.new_key(rng),
+                'received_private_key': fake_ledger.new_key(rng),
+            }
+        return self._keys[index]
+
+    def identity_rows(self):
+        """
+        Return the rows of all identities, for LedgerStore.load().
+        """
+        rows = []
+        for index in range(self.identities):
+            identity = self.identity(index)
+            rows.append((identity['slp_id'], identity['public_key'], identity['private_key'],
+                         identity['received_public_key'], identity['received_private_key']))
+        return rows
+
+    def pick(self, rng):
+        """
+        Draw an identity index from the Zipf distribution.
+        """
+        if self._cum_weights is None:
+            self._cum_weights = list(itertools.accumulate(
+                1.0 / (rank + 1) ** self.skew for rank in range(self.identities)))
+        return bisect.bisect_left(self._cum_weights, rng.random() * self._cum_weights[-1])
+
+    '''
+    Orders
+    '''
+    def event_count(self, rng):
+        if self.event_distribution == 'fixed':
+            return self.events
+        if self.event_distribution == 'poisson':
+            return poisson(rng, self.events)
+        # Pareto with shape 1.5 has mean 3; scale it to the requested mean
+        return int(round(rng.paretovariate(1.5) * self.events / 3.0))
+
+    def milestones(self, rng):
+        count = self.event_count(rng)
+        if count >= len(TRIP_START) + len(TRIP_END) and rng.random() < self.completed_ratio:
+            positions = count - len(TRIP_START) - len(TRIP_END)
+            return TRIP_START + (EventMilestones.POSITION,) * positions + TRIP_END
+        return (TRIP_START + (EventMilestones.POSITION,) * count)[:count]
+
+    def order(self, number):
+        """
+        Return the transactions of order @number, in chronological order.
+        """
+        rng = self.random(self.name, number)
+        customer_index = self.pick(rng)
+        # Providers are ranked in a different order than customers,
+        # so the busiest customers are not also the busiest providers
+        provider_index = (self.pick(rng) * 7919 + 1) % self.identities
+        if provider_index == customer_index:
+            provider_index = (provider_index + 1) % self.identities
+        customer, provider = self.identity(customer_index), self.identity(provider_index)
+
+        accepted = self.start + timedelta(seconds=int(rng.uniform(0, self.days * 86400)))
+        cargo_type, package_type = rng.choice(CARGO)
+        place_of_acceptance, place_of_delivery = rng.sample(PLACES, 2)
+        rdf = fill(self.order_template, {
+            '$cargo_type': cargo_type,
+            '$package_type': package_type,
+            '999999937': str(rng.randint(1, 40)),
+            _TIMES[0].isoformat(): accepted.isoformat(),
+            '$place_of_acceptance': place_of_acceptance,
+            _TIMES[1].isoformat(): (accepted + timedelta(days=1)).isoformat(),
+            '$place_of_delivery': place_of_delivery,
+            '$reference_id': 'DS{}-{}'.format(self.seed, number),
+        })
+        shapes = ['bdb://{}/'.format(self.order_shape)] if self.order_shape else []
+        create = fake_ledger.create_tx(customer['public_key'], {'rdf': rdf}, recipient=provider['public_key'])
+        create['id'] = fake_ledger.tx_id(create)
+        asset_id = create['id']
+        txs = [create]
+
+        def transfer(recipient, metadata):
+            tx = fake_ledger.transfer_tx(asset_id, provider['public_key'], (txs[-1]['id'], 0),
+                                         recipient, metadata=metadata)
+            tx['id'] = fake_ledger.tx_id(tx)
+            txs.append(tx)
+
+        outcome = rng.random()
+        if outcome < self.pending_ratio:
+            pass
+        elif outcome < self.pending_ratio + self.reject_ratio:
+            # Rejected orders go back to the customer
+            transfer(customer['public_key'], {'metadata': {'status': OrderStatus.REJECTED}})
+        else:
+            transfer(provider['public_key'], {'metadata': {'status': OrderStatus.CONFIRMED}})
+            moment = accepted
+            for milestone in self.milestones(rng):
+                moment += timedelta(minutes=rng.randint(5, 120))
+                event_rdf = fill(self.event_template, {
+                    '$order_asset_id': asset_id,
+                    _TIMES[2].isoformat(): moment.isoformat(),
+                    '$place': place_of_delivery if milestone in TRIP_END else place_of_acceptance,
+                    999999929: milestone,
+                })
+                metadata = {}
+                old_status, new_status = EventMilestones.transitions[milestone]
+                if new_status != old_status:
+                    metadata['status'] = new_status
+                transfer(provider['public_key'], {
+                    'data': {'rdf': event_rdf, 'constraints': self.event_shape},
+                    'metadata': metadata,
+                })
+        return create, shapes, txs
+
+    def generate(self, chunk):
+        """
+        Return the rows of the orders in chunk @chunk, as keyword
+        arguments for LedgerStore.load().
+        """
+        assets, transactions, outputs = [], [], []
+        first = chunk * self.chunk_size
+        for number in range(first, min(first + self.chunk_size, self.orders)):
+            create, shapes, txs = self.order(number)
+            asset_id = create['id']
+            assets.append((asset_id, json.dumps(create['asset']['data']),
+                           create['inputs'][0]['owners_before'][0], json.dumps(shapes)))
+            for tx, spent_by in zip(txs, txs[1:] + [None]):
+                transactions.append((tx['id'], asset_id, json.dumps(tx)))
+                outputs.append((tx['id'], 0, asset_id, tx['outputs'][0]['public_keys'][0],
+                                spent_by['id'] if spent_by else None))
+        return {'assets': assets, 'transactions': transactions, 'outputs': outputs}
+
+
+def generate(dataset, chunk):
+    """
+    Dataset.generate, as a function that can be sent to worker processes.
+    """
+    return chunk, dataset.generate(chunk)
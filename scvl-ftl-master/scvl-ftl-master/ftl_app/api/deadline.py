@@ -0,0 +1,129 @@
+"""
+A module that gives every request a time budget for its ledger calls.
+
+Without timeouts, a stuck SLP node kept WSGI workers waiting forever, until
+none were left to serve requests. DeadlineMiddleware now starts a deadline
+of REQUEST_DEADLINE seconds for every request, or of the `deadline`
+attribute of the view class when it has one (None for no deadline).
+SlpInterface._request derives the timeout of every ledger call from the
+time that is left, capped at SLP_TIMEOUT, and raises DeadlineExceeded
+(HTTP 504) instead of calling the ledger once the budget is spent.
+
+The deadline is kept per thread, so it reaches Logic, Status and
+slp_helpers without being passed around. Work that a request hands to a
+worker thread keeps its deadline when the function is wrapped with bind();
+slp_helpers.submit and bounded_map do so. Ledger calls outside requests,
+e.g. from management commands and the webhook dispatcher, have no deadline
+and time out after SLP_TIMEOUT seconds.
+"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+from rest_framework import status as http_status
+from rest_framework.exceptions import APIException
+
+_local = threading.local()
+
+
+class LedgerUnavailable(APIException):
+    """
+    The ledger could not be used to handle the request.
+    Views let this propagate, so it is answered with its status code.
+    """
+    status_code = http_status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The ledger is unavailable, try again later"
+    default_code = 'ledger_unavailable'
+
+
+class DeadlineExceeded(LedgerUnavailable):
+    status_code = http_status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = "The ledger did not answer in time"
+    default_code = 'deadline_exceeded'
+
+
+def current():
+    """
+    Return the deadline of this thread as a time.monotonic() value, or None.
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def remaining():
+    """
+    Return the seconds left until the deadline of this thread, or None.
+    """
+    deadline = current()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class _Activate(object):
+    # Context manager that makes @deadline current in this thread
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __enter__(self):
+        self.previous = current()
+        _local.deadline = self.deadline
+        return self.deadline
+
+    def __exit__(self, *exc_info):
+        _local.deadline = self.previous
+
+
+def activate(deadline):
+    return _Activate(deadline)
+
+
+def bind(fn):
+    """
+    Return @fn such that, when called in another thread,
+    it has the deadline of the calling thread.
+    """
+    deadline = current()
+    if deadline is None:
+        return fn
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        with activate(deadline):
+            return fn(*args, **kwargs)
+    return bound
+
+
+def timeout():
+    """
+    Return the timeout for a ledger call made now: SLP_TIMEOUT,
+    or the time left until the deadline if that is shorter.
+    Raises DeadlineExceeded if the deadline has passed.
+    """
+    left = remaining()
+    if left is None:
+        return settings.SLP_TIMEOUT
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(settings.SLP_TIMEOUT, left)
+
+
+class DeadlineMiddleware(object):
+    """
+    Gives every request a deadline, see the module documentation.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Reset in case an earlier request left its deadline behind
+        _local.deadline = None
+        try:
+            return self.get_response(request)
+        finally:
+            _local.deadline = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        seconds = getattr(getattr(view_func, 'view_class', None), 'deadline', settings.REQUEST_DEADLINE)
+        _local.deadline = None if seconds is None else time.monotonic() + seconds
@@ -0,0 +1,658 @@
+"""
+A local stand-in for the SLP HTTP API, for tests and benchmarks.
+
+The fake ledger serves the endpoints that SlpInterface uses, from an
+HTTP server running in this process, and keeps its state in SQLite.
+Publications become BigchainDB-style CREATE transactions and transfers
+spend the asset's unspent output (UTXO-style ownership), so only the
+current owner of an asset can transfer it. Every transaction is put in
+a block as soon as it is committed.
+
+It is switched on through the ledger URL:
+
+    SLP_URL=fake://                       in-memory ledger
+    SLP_URL=fake:///tmp/ledger.sqlite3    ledger kept in a file
+
+The URL accepts these options as query parameters:
+    latency     seconds added to every request (default 0)
+    jitter      up to this many seconds are added on top, at random
+    error_rate  fraction of requests answered with HTTP 503
+    block_size  number of transactions per block (default 1)
+For example: SLP_URL='fake://?latency=0.05&jitter=0.02'
+
+SlpInterface starts the server on first use and sends its requests there;
+any SLP_TOKEN is accepted. The ledger is shared by everything in the
+process that uses the same URL, see get().
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import rdflib
+
+logger = logging.getLogger(__name__)
+
+SCHEME = 'fake:'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS identities (
+    alias TEXT PRIMARY KEY,
+    public_key TEXT NOT NULL UNIQUE,
+    private_key TEXT NOT NULL,
+    received_public_key TEXT NOT NULL UNIQUE,
+    received_private_key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    creator TEXT NOT NULL,
+    shapes TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    asset_id TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_asset ON transactions (asset_id, seq);
+CREATE TABLE IF NOT EXISTS outputs (
+    tx_id TEXT NOT NULL,
+    output_index INTEGER NOT NULL,
+    asset_id TEXT NOT NULL,
+    public_key TEXT NOT NULL,
+    spent_by TEXT,
+    PRIMARY KEY (tx_id, output_index)
+);
+CREATE INDEX IF NOT EXISTS outputs_owner ON outputs (public_key, spent_by);
+CREATE INDEX IF NOT EXISTS outputs_asset ON outputs (asset_id, spent_by);
+CREATE TABLE IF NOT EXISTS loaded_chunks (
+    dataset TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    PRIMARY KEY (dataset, chunk)
+);
+"""
+
+
+class LedgerError(Exception):
+    """
+    A request the ledger refuses, answered with HTTP @status.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+def new_key(rng=None):
+    """
+    Return a random key, shaped like a base58-encoded ed25519 key.
+    Pass a random.Random as @rng for reproducible keys.
+    """
+    number = rng.getrandbits(256) if rng is not None else int.from_bytes(os.urandom(32), 'big')
+    key = ''
+    while number:
+        number, digit = divmod(number, 58)
+        key = BASE58[digit] + key
+    return key
+
+
+def to_json_ld(publication, data_format):
+    """
+    Return @publication as JSON-LD, the form in which the ledger stores
+    RDF. Raises LedgerError if it is not valid RDF in @data_format.
+    """
+    if data_format == 'json-ld':
+        try:
+            return json.loads(publication)
+        except ValueError as e:
+            raise LedgerError("Publication is not valid JSON-LD: {}".format(e))
+    g = rdflib.Graph()
+    try:
+        g.parse(data=publication, format=data_format)
+    except Exception as e:
+        raise LedgerError("Publication is not valid {}: {}".format(data_format, e))
+    serialized = g.serialize(format='json-ld')
+    if isinstance(serialized, bytes):
+        serialized = serialized.decode()
+    return json.loads(serialized)
+
+
+def create_tx(public_key, data, recipient=None, metadata=None):
+    """
+    Return a CREATE transaction of an asset with @data, signed by
+    @public_key and owned by @recipient (or the signer), without ID.
+    """
+    return {
+        'version': '2.0',
+        'operation': 'CREATE',
+        'asset': {'data': data},
+        'metadata': metadata,
+        'inputs': [{'owners_before': [public_key], 'fulfills': None, 'fulfillment': None}],
+        'outputs': [{'public_keys': [recipient or public_key], 'amount': '1'}],
+    }
+
+
+def transfer_tx(asset_id, public_key, spends, recipient, metadata=None):
+    """
+    Return a TRANSFER transaction of @asset_id from @public_key to
+    @recipient, spending the output @spends ((tx_id, output_index)), without ID.
+    """
+    tx_id, output_index = spends
+    return {
+        'version': '2.0',
+        'operation': 'TRANSFER',
+        'asset': {'id': asset_id},
+        'metadata': metadata,
+        'inputs': [{
+            'owners_before': [public_key],
+            'fulfills': {'transaction_id': tx_id, 'output_index': output_index},
+            'fulfillment': None
+        }],
+        'outputs': [{'public_keys': [recipient], 'amount': '1'}],
+    }
+
+
+def tx_id(tx, nonce=''):
+    """
+    Return the ID of @tx: a hash of its content, like in BigchainDB,
+    and of @nonce, which keeps identical transactions apart.
+    """
+    return hashlib.sha256((json.dumps(tx, sort_keys=True) + nonce).encode()).hexdigest()
+
+
+class LedgerStore(object):
+    """
+    The state of a fake ledger, in the SQLite database at @path.
+    All access goes through one connection, serialized by a lock.
+    """
+
+    def __init__(self, path=':memory:', block_size=1):
+        self.path = path
+        self.block_size = max(1, int(block_size))
+        self._lock = threading.RLock()
+        # Compiled shapes by reference; shape assets never change
+        self._validators = {}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    '''
+    Identities
+    '''
+    def create_identity(self, alias):
+        """
+        Create the identity @alias, with a key pair for signing and
+        one for receiving assets. Returns both pairs.
+        """
+        keys = {
+            'keypair': {'public_key': new_key(), 'private_key': new_key()},
+            'received': {'public_key': new_key(), 'private_key': new_key()},
+        }
+        with self._lock:
+            try:
+                self._db.execute(
+                    'INSERT INTO identities VALUES (?, ?, ?, ?, ?)',
+                    (alias, keys['keypair']['public_key'], keys['keypair']['private_key'],
+                     keys['received']['public_key'], keys['received']['private_key'])
+                )
+            except sqlite3.IntegrityError:
+                raise LedgerError("Identity {} already exists".format(alias))
+        return keys
+
+    def owner_keys(self, alias):
+        """
+        Return the public keys of the identity @alias.
+        """
+        rows = self._query('SELECT public_key, received_public_key FROM identities WHERE alias = ?', (alias,))
+        if not rows:
+            raise LedgerError("Unknown identity {}".format(alias), status=404)
+        return rows[0]
+
+    def signer(self, alias, private_key):
+        """
+        Return the public key that belongs to @private_key of the identity @alias.
+        """
+        rows = self._query('SELECT public_key, private_key, received_public_key, received_private_key '
+                           'FROM identities WHERE alias = ?', (alias,))
+        if not rows:
+            raise LedgerError("Unknown identity {}".format(alias), status=404)
+        public_key, key, received_public_key, received_key = rows[0]
+        if private_key == key:
+            return public_key
+        if private_key == received_key:
+            return received_public_key
+        raise LedgerError("Private key does not belong to {}".format(alias), status=403)
+
+    '''
+    Writing
+    '''
+    def _commit(self, tx, asset_id, spends=None, asset=None):
+        tx['id'] = tx_id(tx, uuid.uuid4().hex)
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                if spends is not None:
+                    cursor = self._db.execute(
+                        'UPDATE outputs SET spent_by = ? WHERE tx_id = ? AND output_index = ? AND spent_by IS NULL',
+                        (tx['id'],) + spends
+                    )
+                    if cursor.rowcount != 1:
+                        raise LedgerError("Output was already spent")
+                if asset_id is None:
+                    asset_id = tx['id']
+                self._db.execute('INSERT INTO transactions (id, asset_id, body) VALUES (?, ?, ?)',
+                                 (tx['id'], asset_id, json.dumps(tx)))
+                for index, output in enumerate(tx['outputs']):
+                    self._db.execute('INSERT INTO outputs VALUES (?, ?, ?, ?, NULL)',
+                                     (tx['id'], index, asset_id, output['public_keys'][0]))
+                if asset is not None:
+                    self._db.execute('INSERT INTO assets VALUES (?, ?, ?, ?)', (asset_id,) + asset)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return tx
+
+    def create(self, public_key, data, recipient=None, metadata=None, shapes=()):
+        """
+        Create an asset with @data, signed by @public_key and owned by
+        @recipient (or the signer). Returns the CREATE transaction.
+        """
+        tx = create_tx(public_key, data, recipient=recipient, metadata=metadata)
+        return self._commit(tx, None, asset=(json.dumps(data), public_key, json.dumps(list(shapes))))
+
+    def transfer(self, asset_id, public_key, recipient, metadata=None):
+        """
+        Transfer the asset @asset_id, which @public_key must own,
+        to @recipient. Returns the TRANSFER transaction.
+        """
+        with self._lock:
+            if not self._query('SELECT 1 FROM assets WHERE asset_id = ?', (asset_id,)):
+                raise LedgerError("Asset {} does not exist".format(asset_id), status=404)
+            unspent = self._query('SELECT tx_id, output_index FROM outputs '
+                                  'WHERE asset_id = ? AND public_key = ? AND spent_by IS NULL',
+                                  (asset_id, public_key))
+            if not unspent:
+                raise LedgerError("Asset {} is not owned by the signer".format(asset_id))
+            tx = transfer_tx(asset_id, public_key, unspent[0], recipient, metadata=metadata)
+            return self._commit(tx, asset_id, spends=unspent[0])
+
+    def load(self, dataset, chunk, identities=(), assets=(), transactions=(), outputs=()):
+        """
+        Insert rows that were built elsewhere, such as a generated
+        dataset, as chunk @chunk of @dataset. Rows are tuples in the
+        column order of their table. All rows of a chunk are inserted in
+        one database transaction, together with the mark that the chunk
+        was loaded; a chunk that was loaded before is skipped.
+        Returns whether the chunk was inserted.
+        """
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                if self._db.execute('SELECT 1 FROM loaded_chunks WHERE dataset = ? AND chunk = ?',
+                                    (dataset, chunk)).fetchall():
+                    self._db.execute('ROLLBACK')
+                    return False
+                self._db.executemany('INSERT INTO identities VALUES (?, ?, ?, ?, ?)', identities)
+                self._db.executemany('INSERT INTO assets VALUES (?, ?, ?, ?)', assets)
+                self._db.executemany('INSERT INTO transactions (id, asset_id, body) VALUES (?, ?, ?)', transactions)
+                self._db.executemany('INSERT INTO outputs VALUES (?, ?, ?, ?, ?)', outputs)
+                self._db.execute('INSERT INTO loaded_chunks VALUES (?, ?)', (dataset, chunk))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return True
+
+    def loaded_chunks(self, dataset):
+        """
+        Return the set of chunks of @dataset that were loaded.
+        """
+        return {chunk for chunk, in self._query('SELECT chunk FROM loaded_chunks WHERE dataset = ?', (dataset,))}
+
+    '''
+    Reading
+    '''
+    def asset(self, asset_id):
+        rows = self._query('SELECT data FROM assets WHERE asset_id = ?', (asset_id,))
+        if not rows:
+            raise LedgerError("Asset {} does not exist".format(asset_id), status=404)
+        return json.loads(rows[0][0])
+
+    def shapes(self, asset_id):
+        rows = self._query('SELECT shapes FROM assets WHERE asset_id = ?', (asset_id,))
+        if not rows:
+            raise LedgerError("Asset {} does not exist".format(asset_id), status=404)
+        return json.loads(rows[0][0])
+
+    def transactions(self, asset_id, sort=False):
+        """
+        Return the transactions of @asset_id; chronologically if @sort,
+        in no particular order otherwise.
+        """
+        order = 'seq' if sort else 'id'
+        return [json.loads(body) for body, in self._query(
+            'SELECT body FROM transactions WHERE asset_id = ? ORDER BY {}'.format(order), (asset_id,)
+        )]
+
+    def transaction(self, tx_id):
+        """
+        Return the transaction @tx_id and the height of its block.
+        """
+        rows = self._query('SELECT body, seq FROM transactions WHERE id = ?', (tx_id,))
+        if not rows:
+            raise LedgerError("Transaction {} does not exist".format(tx_id), status=404)
+        body, seq = rows[0]
+        return json.loads(body), (seq - 1) // self.block_size + 1
+
+    def owned(self, public_keys):
+        """
+        Return the IDs of the assets currently owned by any of @public_keys.
+        """
+        marks = ','.join('?' * len(public_keys))
+        return [asset_id for asset_id, in self._query(
+            'SELECT DISTINCT asset_id FROM outputs WHERE spent_by IS NULL AND public_key IN ({}) '
+            'ORDER BY asset_id'.format(marks), tuple(public_keys)
+        )]
+
+    def history(self, public_keys, created=False, asset_ids=None):
+        """
+        Group the transactions in which any of @public_keys became owner
+        (or created the asset) by asset:
+        {asset_id: {'asset': {'data': data}, 'transactions': [tx, ...]}}
+        With @created, only assets created by @public_keys are included.
+        Limit the result to @asset_ids if given.
+        """
+        keys = set(public_keys)
+        marks = ','.join('?' * len(keys))
+        if asset_ids is None:
+            if created:
+                asset_ids = [a for a, in self._query(
+                    'SELECT asset_id FROM assets WHERE creator IN ({}) ORDER BY asset_id'.format(marks),
+                    tuple(keys))]
+            else:
+                asset_ids = [a for a, in self._query(
+                    'SELECT DISTINCT asset_id FROM outputs WHERE public_key IN ({}) '
+                    'UNION SELECT asset_id FROM assets WHERE creator IN ({}) '
+                    'ORDER BY asset_id'.format(marks, marks), tuple(keys) * 2)]
+
+        history = {}
+        for asset_id in asset_ids:
+            txs = [tx for tx in self.transactions(asset_id, sort=True)
+                   if keys.intersection(tx['outputs'][0]['public_keys'])
+                   or (tx['operation'] == 'CREATE' and keys.intersection(tx['inputs'][0]['owners_before']))]
+            history[asset_id] = {
+                'asset': {'data': self.asset(asset_id)},
+                'transactions': txs,
+            }
+        return history
+
+    def violations(self, data, shape):
+        """
+        Return the violations of the shape @shape (a bdb:// reference)
+        by the asset data @data.
+        """
+        # Imported here, as it needs Django
+        import api.shacl as shacl
+
+        if shape not in self._validators:
+            shape_id = re.sub(r'^bdb://|/$', '', shape)
+            shapes_graph = shacl.parse_rdf(self.asset(shape_id)['rdf'])
+            self._validators[shape] = shacl.compile_shapes(shapes_graph) if shapes_graph is not None else None
+        validator = self._validators[shape]
+        data_graph = shacl.parse_rdf(data['rdf'])
+        if data_graph is None:
+            return ["Data is not valid RDF"]
+        return validator.validate(data_graph) if validator is not None else []
+
+    def validate(self, asset_id):
+        """
+        Validate @asset_id against the shapes it was published with.
+        Returns a report per shape.
+        """
+        data = self.asset(asset_id)
+        reports = []
+        for shape in self.shapes(asset_id):
+            violations = self.violations(data, shape)
+            reports.append({
+                'shape': shape,
+                'conforms': not violations,
+                'simple': '\n'.join(violations),
+            })
+        return reports
+
+
+class FakeLedger(object):
+    """
+    An HTTP server for @store, answering after @latency (+ up to @jitter)
+    seconds, and with HTTP 503 to a fraction @error_rate of requests.
+    """
+
+    def __init__(self, store=None, latency=0, jitter=0, error_rate=0):
+        self.store = store if store is not None else LedgerStore()
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.error_rate = float(error_rate)
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self.url = 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    '''
+    Endpoints; each returns the JSON response body
+    '''
+    def post_id(self, body, query):
+        if not body.get('alias'):
+            raise LedgerError("An alias is required")
+        return self.store.create_identity(body['alias'])
+
+    def post_publish(self, body, query):
+        public_key = self.store.signer(body.get('crypto_id'), body.get('private_key'))
+        data = {'rdf': to_json_ld(body.get('publication', ''), body.get('format', 'json-ld'))}
+        recipient = None
+        for recipients in body.get('recipients') or ():
+            recipient = recipients['recipients'][0]
+        shapes = [shape['shape'] for shape in body.get('shapes') or ()]
+        for shape in shapes:
+            violations = self.store.violations(data, shape)
+            if violations:
+                raise LedgerError("Publication does not conform to {}: {}".format(shape, '; '.join(violations)))
+        return self.store.create(public_key, data, recipient=recipient, shapes=shapes)['id']
+
+    def post_transfer(self, body, query):
+        public_key = self.store.signer(body.get('crypto_id'), body.get('private_key'))
+        try:
+            recipient = body['recipients'][0]['recipients'][0]
+        except (KeyError, IndexError, TypeError):
+            raise LedgerError("A recipient is required")
+        return self.store.transfer(body.get('asset_id'), public_key, recipient,
+                                   metadata=body.get('metadata'))['id']
+
+    def get_asset(self, query, asset_id):
+        return self.store.asset(asset_id)
+
+    def get_asset_transactions(self, query, asset_id):
+        self.store.asset(asset_id)
+        return self.store.transactions(asset_id, sort=_flag(query, 'sort'))
+
+    def get_assets(self, query, alias):
+        keys = self.store.owner_keys(alias)
+        owned = self.store.owned(keys)
+        if _flag(query, 'asData'):
+            return self.store.history(keys, asset_ids=owned)
+        return [{'asset_id': asset_id} for asset_id in owned]
+
+    def get_history(self, query, alias):
+        return self.store.history(self.store.owner_keys(alias), created=_flag(query, 'created'))
+
+    def get_inputs(self, query, tx_id):
+        return self.store.transaction(tx_id)[0]['inputs']
+
+    def get_transaction(self, query, tx_id):
+        tx, block_height = self.store.transaction(tx_id)
+        if _flag(query, 'block'):
+            return {'transaction': tx, 'block_height': block_height}
+        return tx
+
+    def get_validate_asset(self, query, asset_id):
+        return self.store.validate(asset_id)
+
+
+# (method, path pattern, endpoint); paths may carry a prefix such as /api
+ROUTES = [
+    ('POST', r'/id/?', FakeLedger.post_id),
+    ('POST', r'/publish/?', FakeLedger.post_publish),
+    ('POST', r'/transfer/?', FakeLedger.post_transfer),
+    ('GET', r'/asset/([^/]+)/transactions/?', FakeLedger.get_asset_transactions),
+    ('GET', r'/asset/([^/]+)/?', FakeLedger.get_asset),
+    ('GET', r'/assets/([^/]+)/?', FakeLedger.get_assets),
+    ('GET', r'/history/([^/]+)/?', FakeLedger.get_history),
+    ('GET', r'/transaction/inputs/([^/]+)/?', FakeLedger.get_inputs),
+    ('GET', r'/transaction/([^/]+)/?', FakeLedger.get_transaction),
+    ('GET', r'/validate_asset/([^/]+)/?', FakeLedger.get_validate_asset),
+]
+ROUTES = [(method, re.compile(r'(?:.*?)' + pattern + '$'), endpoint) for method, pattern, endpoint in ROUTES]
+
+
+def _flag(query, name):
+    return query.get(name, [''])[0].lower() in ('true', '1', 'yes')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _handler(ledger):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def handle_request(self, method):
+            with ledger._requests_lock:
+                ledger.requests += 1
+            ledger.delay()
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            try:
+                if ledger.error_rate and random.random() < ledger.error_rate:
+                    raise LedgerError("Injected failure", status=503)
+                for route_method, pattern, endpoint in ROUTES:
+                    match = pattern.match(url.path)
+                    if route_method == method and match:
+                        break
+                else:
+                    raise LedgerError("Not found", status=404)
+                if method == 'POST':
+                    result = endpoint(ledger, self.read_body(), query)
+                else:
+                    result = endpoint(ledger, query, *match.groups())
+                status, body = 200, json.dumps(result)
+            except LedgerError as e:
+                status, body = e.status, json.dumps(str(e))
+            except Exception as e:
+                logger.exception("Fake ledger failed on %s %s", method, self.path)
+                status, body = 500, json.dumps(str(e))
+            body = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                try:
+                    return json.loads(raw)
+                except ValueError:
+                    raise LedgerError("Malformed JSON body")
+            return {key: values[0] for key, values in parse_qs(raw).items()}
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+'''
+Process-wide ledgers, by URL
+'''
+_ledgers = {}
+_lock = threading.Lock()
+
+def is_fake(url):
+    return bool(url) and url.startswith(SCHEME)
+
+def parse_url(url):
+    """
+    Split a fake:// @url into the store path and the server options.
+    """
+    parts = urlsplit(url)
+    options = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    return parts.path or ':memory:', options
+
+def get(url):
+    """
+    Return the running fake ledger for @url, starting it if needed,
+    or None if @url is not a fake:// URL.
+    """
+    if not is_fake(url):
+        return None
+    with _lock:
+        if url not in _ledgers:
+            path, options = parse_url(url)
+            store = LedgerStore(path, block_size=options.pop('block_size', 1))
+            _ledgers[url] = FakeLedger(store, **options).start()
+            logger.info("Started fake ledger at %s, stored in %s", _ledgers[url].url, path)
+        return _ledgers[url]
+
+def resolve(url):
+    """
+    Return the HTTP URL to use for the ledger @url.
+    """
+    ledger = get(url)
+    return ledger.url if ledger is not None else url
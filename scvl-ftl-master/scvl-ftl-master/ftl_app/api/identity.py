@@ -0,0 +1,99 @@
+"""
+A module that resolves which SLP IDs a user acts with.
+
+Nearly every call that touches the ledger needs the user's active SLP IDs,
+so these are cached in process, per user, ordered from newest to oldest.
+The cache entry of a user is dropped whenever one of their SlpId rows is
+saved or deleted (see api/signals/handlers.py). Since those signals only
+reach the current process, they also bump a version in the shared cache,
+upon which other processes drop all their entries within
+CACHE_VERSION_CHECK_INTERVAL seconds (see api/shared_version.py).
+Entries also expire after SLP_ID_CACHE_TTL seconds.
+Lookups that started before an invalidation are not cached.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from api.models import SlpId
+from api.shared_version import SharedVersion
+import api.metrics as metrics
+
+VERSION_KEY = 'identity:version'
+
+_cache = {}
+_lock = threading.Lock()
+# Incremented on every invalidation, so that lookups can tell they raced with one
+_generation = 0
+version = SharedVersion(VERSION_KEY)
+
+
+def active_ids(user):
+    """
+    Return the active SlpId objects of @user, most recent first.
+    The list is shared between threads and must not be modified.
+    """
+    if version.changed():
+        # Another process invalidated some entries
+        _drop(None)
+    now = time.monotonic()
+    entry = _cache.get(user.pk)
+    if entry is not None and entry[0] > now:
+        metrics.cache_lookups.inc('identity', 'hit')
+        return entry[1]
+
+    metrics.cache_lookups.inc('identity', 'miss')
+    generation = _generation
+    slp_ids = tuple(SlpId.objects.filter(user=user, active=True).order_by('-timestamp'))
+    with _lock:
+        if generation == _generation:
+            _cache[user.pk] = (now + settings.SLP_ID_CACHE_TTL, slp_ids)
+    return slp_ids
+
+def default_id(user):
+    """
+    Return the SlpId that @user signs with by default:
+    the most recent, active one.
+    Raises SlpId.DoesNotExist if the user has no active SLP ID.
+    """
+    slp_ids = active_ids(user)
+    if not slp_ids:
+        raise SlpId.DoesNotExist("User has no active SLP ID")
+    return slp_ids[0]
+
+def get_id(user, slp_id):
+    """
+    Return the active SlpId of @user with the alias @slp_id.
+    Raises SlpId.DoesNotExist if there is no such active SLP ID.
+    """
+    for candidate in active_ids(user):
+        if candidate.slp_id == slp_id:
+            return candidate
+    raise SlpId.DoesNotExist("Provided SLP ID does not exist or is not active")
+
+def resolve(user, slp_id=None):
+    """
+    Return the SlpId of @user with alias @slp_id if given,
+    or the default SlpId otherwise.
+    """
+    if slp_id:
+        return get_id(user, slp_id)
+    return default_id(user)
+
+def invalidate(user_id=None):
+    """
+    Drop the cached SLP IDs of the user with @user_id, or of all users,
+    in every process.
+    """
+    _drop(user_id)
+    version.bump()
+
+def _drop(user_id):
+    global _generation
+    with _lock:
+        _generation += 1
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
@@ -0,0 +1,147 @@
+"""
+A module that keeps a pool of ledger identities created in advance.
+
+Creating a ledger identity takes a call to the SLP, which made user
+creation as slow as the ledger (and failed it when the ledger was down).
+Instead, new users claim an identity from the PooledSlpId table, which is
+topped up to IDENTITY_POOL_SIZE in a background thread whenever it falls
+to IDENTITY_POOL_LOW_WATERMARK or below. Only when the pool is empty,
+the identity is created synchronously, as before.
+
+The pool is disabled with IDENTITY_POOL_SIZE = 0.
+It can also be filled by running `manage.py fill_identity_pool`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from api.models import PooledSlpId, SlpId
+from api.slp_interface import SlpInterface
+
+logger = logging.getLogger(__name__)
+
+_refill_lock = threading.Lock()
+_refill_thread = None
+
+
+def create_identity(username, alias=None):
+    """
+    Create a ledger identity for @username, with @alias if given.
+    Returns the fields shared by SlpId and PooledSlpId as a dict.
+    Raises ValueError if the ledger refuses.
+    """
+    slp_interface = SlpInterface(
+        os.getenv('SLP_URL'),
+        os.getenv('SLP_TOKEN')
+    )
+    slp_id = slp_interface.create_id(username, alias=alias)
+    return {
+        'slp_id': slp_id['id'],
+        'public_key': slp_id['keys']['keypair']['public_key'],
+        'private_key': slp_id['keys']['keypair']['private_key'],
+        'received_public_key': slp_id['keys']['received']['public_key'],
+        'received_private_key': slp_id['keys']['received']['private_key'],
+    }
+
+def new_alias():
+    # Identities are created before their user is known,
+    # so their alias cannot contain the username
+    return 'pool_{}'.format(uuid.uuid4().hex)
+
+def size():
+    return PooledSlpId.objects.count()
+
+def claim():
+    """
+    Take an identity out of the pool.
+    Returns its fields as a dict, or None if the pool is empty.
+
+    Deleting the row is the claim: of several processes trying to
+    claim the same identity, only one deletes it, the others move on.
+    """
+    while True:
+        candidates = list(PooledSlpId.objects.order_by('pk')[:5])
+        if not candidates:
+            return None
+        for candidate in candidates:
+            deleted, _ = PooledSlpId.objects.filter(pk=candidate.pk).delete()
+            if deleted:
+                return {
+                    'slp_id': candidate.slp_id,
+                    'public_key': candidate.public_key,
+                    'private_key': candidate.private_key,
+                    'received_public_key': candidate.received_public_key,
+                    'received_private_key': candidate.received_private_key,
+                }
+
+def assign(user):
+    """
+    Give @user an active SlpId, preferably from the pool.
+    Raises ValueError if the pool is empty and the ledger refuses.
+    """
+    fields = None
+    if settings.IDENTITY_POOL_SIZE > 0:
+        with transaction.atomic():
+            fields = claim()
+            if fields is not None:
+                slp_id = SlpId.objects.create(user=user, active=True, **fields)
+        refill_async()
+    if fields is None:
+        # Pool disabled or empty: ask the ledger right away
+        fields = create_identity(user.username)
+        slp_id = SlpId.objects.create(user=user, active=True, **fields)
+    return slp_id
+
+def fill(target=None, workers=None):
+    """
+    Create identities until the pool holds @target of them
+    (IDENTITY_POOL_SIZE by default), with @workers concurrent ledger calls.
+    Returns the number of identities added.
+    """
+    target = settings.IDENTITY_POOL_SIZE if target is None else target
+    workers = workers or settings.IDENTITY_POOL_WORKERS
+    missing = target - size()
+    if missing <= 0:
+        return 0
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(create_identity, 'pool', new_alias()) for _ in range(missing)]
+        for future in futures:
+            try:
+                PooledSlpId.objects.create(**future.result())
+                added += 1
+            except ValueError as e:
+                logger.warning("Unable to create pooled semantic-ledger ID: %s", e)
+    return added
+
+def refill_async():
+    """
+    Start filling the pool in the background if it runs low,
+    unless that is already happening in this process.
+    """
+    global _refill_thread
+    if settings.IDENTITY_POOL_SIZE <= 0:
+        return
+    with _refill_lock:
+        if _refill_thread is not None and _refill_thread.is_alive():
+            return
+        if size() > settings.IDENTITY_POOL_LOW_WATERMARK:
+            return
+        _refill_thread = threading.Thread(target=_refill, name='identity-pool-refill', daemon=True)
+        _refill_thread.start()
+
+def _refill():
+    try:
+        added = fill()
+        logger.info("Added %d identities to the pool", added)
+    except Exception:
+        logger.exception("Unable to fill the identity pool")
+    finally:
+        # This thread opened its own database connection
+        connection.close()
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.models import OrderProjection
+import api.validation_reports as validation_reports
+
+
+class Command(BaseCommand):
+    help = "Check that assets conform to their SHACL shapes, using cached validation reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('asset_ids', nargs='*',
+                            help="Assets to check (default: all orders in the projection)")
+        parser.add_argument('--workers', type=int,
+                            help="Number of concurrent ledger calls (default: SLP_MAX_WORKERS)")
+        parser.add_argument('--refresh', action='store_true',
+                            help="Validate again, ignoring cached reports")
+
+    def handle(self, *args, **options):
+        """
+        Validates the given assets, or every known order, against the
+        shapes they were published with, and writes
+        one JSON line per non-conforming asset or failed validation.
+        Only assets without a cached report cost a ledger call.
+        """
+        if options['asset_ids']:
+            asset_ids = options['asset_ids']
+        else:
+            asset_ids = OrderProjection.objects.order_by('pk').values_list('asset_id', flat=True).iterator()
+
+        counts = {'conforming': 0, 'non-conforming': 0, 'failed': 0}
+        for asset_id, result in validation_reports.validate_many(
+                asset_ids, workers=options['workers'], refresh=options['refresh']):
+            if result is True:
+                counts['conforming'] += 1
+                continue
+            if isinstance(result, Exception):
+                counts['failed'] += 1
+                line = {'asset_id': asset_id, 'error': str(result)}
+            else:
+                counts['non-conforming'] += 1
+                line = {'asset_id': asset_id, 'violations': result}
+            self.stdout.write(json.dumps(line))
+
+        self.stderr.write(', '.join('{} {}'.format(count, kind) for kind, count in counts.items()))
@@ -0,0 +1,313 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.models import AddressBook
+from api.slp_interface import SlpInterface
+from api.status.event_milestones import EventMilestones
+import api.benchmark as benchmark
+import api.fake_ledger as fake_ledger
+import api.identity as identity
+
+ORDER = {
+    'cargo': {
+        'cargo_type': 'General',
+        'package_type': 'Pallets',
+        'package_count': 6
+    },
+    'time_of_acceptance': '2019-10-18 16:19:25',
+    'place_of_acceptance': 'Soesterberg',
+    'time_of_delivery': '2019-10-19 08:00:01',
+    'place_of_delivery': 'Den Haag',
+    'reference_id': 'ABCD1234/5-6'
+}
+
+# Events of a running order: loading at the place of acceptance,
+# followed by position updates along the way
+LOAD_EVENT = {'time': '2019-10-18 16:19:26', 'place': 'Soesterberg', 'milestone': EventMilestones.LOAD}
+POSITION_EVENT = {'time': '2019-10-18 18:00:00', 'place': 'Utrecht', 'milestone': EventMilestones.POSITION}
+
+ENDPOINTS = (
+    'OrderView.post',
+    'OrderView.get',
+    'OrderDetailView.get',
+    'OrderDetailView.put',
+    'OrderDetailView.delete',
+    'EventView.post',
+    'TransferAsset.post',
+    'MyAssets.get',
+)
+
+
+class Command(BaseCommand):
+    help = "Measure the cost of the main API endpoints against a fake ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                            help="Only benchmark this endpoint (can be repeated; default: all)")
+        parser.add_argument('--users', type=int, default=4,
+                            help="Number of users in the seeded dataset")
+        parser.add_argument('--orders', type=int, default=10,
+                            help="Number of orders per user in the seeded dataset")
+        parser.add_argument('--events', type=int, default=3,
+                            help="Number of events per seeded order")
+        parser.add_argument('--requests', type=int, default=50,
+                            help="Number of measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=3,
+                            help="Number of unmeasured requests per endpoint, made first")
+        parser.add_argument('--memory-samples', type=int, default=5,
+                            help="Number of requests per endpoint made with memory tracing")
+        parser.add_argument('--latency', type=float, default=0,
+                            help="Seconds the fake ledger takes to answer a call")
+        parser.add_argument('--output',
+                            help="Write the results to this JSON file (default: standard output)")
+        parser.add_argument('--baseline',
+                            help="JSON file with earlier results to compare with")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Fraction by which a metric may get worse before it counts as a regression")
+
+    def handle(self, *args, **options):
+        """
+        Seeds a fresh test database and fake ledger with a dataset of
+        --users users, each with --orders orders as customer, which are
+        confirmed and have --events events each. Then each endpoint is
+        called --requests times in a row, and summarized by:
+        - latency percentiles (p50, p95, p99) and throughput
+        - ledger calls and database queries per request
+          (queries made by the request thread)
+        - peak memory allocated during a request, measured in a separate
+          run of --memory-samples requests, since tracing slows requests down
+
+        With --baseline, the results are compared with an earlier run,
+        and the command fails if any metric got worse by more than --threshold.
+        """
+        if options['users'] < 2:
+            raise CommandError("--users must be at least 2")
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        self.options = options
+        self.client = APIClient()
+        ledger_url = 'fake://?latency={}'.format(options['latency'])
+        old_env = {key: os.environ.get(key) for key in ('SLP_URL', 'SLP_TOKEN')}
+        os.environ['SLP_URL'] = ledger_url
+        os.environ['SLP_TOKEN'] = 'fake'
+        self.ledger = fake_ledger.get(ledger_url)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            self.seed()
+            self.stderr.write("Seeded {} users and {} orders in {:.1f}s".format(
+                len(self.users), len(self.orders), time.perf_counter() - started))
+
+            endpoints = {}
+            for endpoint in options['endpoint'] or ENDPOINTS:
+                endpoints[endpoint] = self.measure(endpoint)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            for key, value in old_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+        results = {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'config': {key: options[key] for key in
+                       ('users', 'orders', 'events', 'requests', 'warmup', 'memory_samples', 'latency')},
+            'endpoints': endpoints,
+        }
+        self.report(endpoints)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
+
+        if baseline is not None:
+            regressions = benchmark.compare(baseline, results, options['threshold'])
+            for regression in regressions:
+                self.stderr.write("Regression in {endpoint} {metric}: {baseline:.4g} -> {current:.4g}".format(**regression))
+            if regressions:
+                raise CommandError("{} metrics regressed by more than {:.0%}".format(
+                    len(regressions), options['threshold']))
+            self.stderr.write("No regressions against {}".format(options['baseline']))
+
+    '''
+    Dataset
+    '''
+    def as_user(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.tokens[user.username])
+
+    def call(self, method, url, user, data=None):
+        self.as_user(user)
+        return getattr(self.client, method)(url, data=data, format='json')
+
+    def expect_ok(self, response, what):
+        if response.status_code != 200:
+            raise CommandError("Could not {}: {}".format(what, response.data))
+        return response.data
+
+    def post_order(self, customer, provider):
+        response = self.call('post', reverse('order'), customer,
+                             {'order': ORDER, 'service_provider': provider.username})
+        return self.expect_ok(response, "post order")
+
+    def post_event(self, provider, asset_id, event):
+        response = self.call('post', reverse('event'), provider,
+                             {'order_asset_id': asset_id, 'event': event})
+        return self.expect_ok(response, "post event")
+
+    def confirm_order(self, provider, asset_id):
+        response = self.call('put', reverse('order_detail', kwargs={'asset_id': asset_id}), provider)
+        return self.expect_ok(response, "confirm order")
+
+    def seed(self):
+        """
+        Create the users, their address books and their orders.
+        Every user orders from the next user in line.
+        """
+        admin = User.objects.create_superuser('benchmark_admin', '', 'benchmark')
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('set_shacl', admin_username=admin.username)
+
+        self.users = [User.objects.create_user('benchmark{}'.format(i), password='benchmark')
+                      for i in range(self.options['users'])]
+        self.tokens = dict(Token.objects.filter(user__in=self.users).values_list('user__username', 'key'))
+        for user in self.users:
+            for other in self.users:
+                if other != user:
+                    AddressBook.objects.create(user=user, alias=other.username,
+                                               public_key=identity.default_id(other).public_key)
+
+        # (customer, provider, asset_id) of the confirmed orders
+        self.orders = []
+        for customer, provider in self.pairs():
+            for _ in range(self.options['orders']):
+                asset_id = self.post_order(customer, provider)
+                self.confirm_order(provider, asset_id)
+                for i in range(self.options['events']):
+                    self.post_event(provider, asset_id, LOAD_EVENT if i == 0 else POSITION_EVENT)
+                self.orders.append((customer, provider, asset_id))
+
+    def pairs(self):
+        return [(user, self.users[(i + 1) % len(self.users)]) for i, user in enumerate(self.users)]
+
+    def publish_asset(self, user):
+        slp_id = identity.default_id(user)
+        return SlpInterface().publish(
+            slp_id=slp_id.slp_id,
+            private_key=slp_id.private_key,
+            payload=json.dumps({'@id': 'bdb://[id]/', '@type': 'http://schema.org/Thing'})
+        )
+
+    '''
+    Measurements
+    '''
+    def requests_for(self, endpoint, count):
+        """
+        Return @count functions that each make one request to @endpoint.
+        Requests that change an order get a fresh order each.
+        """
+        pairs = itertools.cycle(self.pairs())
+        orders = itertools.cycle(self.orders)
+        requests = []
+        for _ in range(count):
+            customer, provider = next(pairs)
+            if endpoint == 'OrderView.post':
+                request = lambda c=customer, p=provider: self.call(
+                    'post', reverse('order'), c, {'order': ORDER, 'service_provider': p.username})
+            elif endpoint == 'OrderView.get':
+                request = lambda c=customer: self.call('get', reverse('order'), c)
+            elif endpoint == 'OrderDetailView.get':
+                c, _, asset_id = next(orders)
+                request = lambda c=c, a=asset_id: self.call(
+                    'get', reverse('order_detail', kwargs={'asset_id': a}), c)
+            elif endpoint in ('OrderDetailView.put', 'OrderDetailView.delete'):
+                method = 'put' if endpoint.endswith('put') else 'delete'
+                asset_id = self.post_order(customer, provider)
+                request = lambda p=provider, a=asset_id, m=method: self.call(
+                    m, reverse('order_detail', kwargs={'asset_id': a}), p)
+            elif endpoint == 'EventView.post':
+                _, p, asset_id = next(orders)
+                request = lambda p=p, a=asset_id: self.call(
+                    'post', reverse('event'), p, {'order_asset_id': a, 'event': POSITION_EVENT})
+            elif endpoint == 'TransferAsset.post':
+                asset_id = self.publish_asset(customer)
+                request = lambda c=customer, p=provider, a=asset_id: self.call(
+                    'post', reverse('transfer'), c, {'asset_id': a, 'recipient': p.username})
+            elif endpoint == 'MyAssets.get':
+                request = lambda c=customer: self.call('get', reverse('my_assets'), c)
+            requests.append(request)
+        return requests
+
+    def measure(self, endpoint):
+        warmup, count, samples = self.options['warmup'], self.options['requests'], self.options['memory_samples']
+        requests = self.requests_for(endpoint, warmup + count + samples)
+
+        for request in requests[:warmup]:
+            request()
+
+        latencies = []
+        errors = 0
+        queries = benchmark.QueryCounter()
+        ledger_calls = self.ledger.requests
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            for request in requests[warmup:warmup + count]:
+                start = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+        elapsed = time.perf_counter() - started
+        ledger_calls = self.ledger.requests - ledger_calls
+
+        peak_memory = None
+        if samples > 0:
+            tracemalloc.start()
+            try:
+                for request in requests[warmup + count:]:
+                    tracemalloc.clear_traces()
+                    request()
+                    peak_memory = max(peak_memory or 0, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+
+        if errors:
+            self.stderr.write("{}: {} of {} requests failed".format(endpoint, errors, count))
+        return benchmark.summarize(latencies, elapsed, errors=errors, ledger_calls=ledger_calls,
+                                   db_queries=queries.count, peak_memory=peak_memory)
+
+    def report(self, endpoints):
+        self.stderr.write("{:<24} {:>8} {:>8} {:>8} {:>8} {:>7} {:>8} {:>9}".format(
+            'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'ledger', 'queries', 'peak KiB'))
+        for endpoint, s in endpoints.items():
+            self.stderr.write("{:<24} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.1f} {:>8.1f} {:>9}".format(
+                endpoint, s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000, s['throughput'],
+                s['ledger_calls'], s['db_queries'],
+                '-' if s['peak_memory'] is None else s['peak_memory'] // 1024))
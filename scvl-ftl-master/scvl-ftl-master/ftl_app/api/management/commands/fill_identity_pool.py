@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import api.identity_pool as identity_pool
+
+
+class Command(BaseCommand):
+    help = "Create ledger identities in advance, for new users to claim"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int,
+                            help="Number of identities the pool should hold (default: IDENTITY_POOL_SIZE)")
+        parser.add_argument('--workers', type=int,
+                            help="Number of concurrent ledger calls (default: IDENTITY_POOL_WORKERS)")
+
+    def handle(self, *args, **options):
+        """
+        Tops up the pool of ledger identities to the requested size.
+        """
+        if options['size'] is not None and options['size'] < 0:
+            raise CommandError("--size must not be negative")
+
+        added = identity_pool.fill(target=options['size'], workers=options['workers'])
+        self.stdout.write("Added {} identities, the pool now holds {}".format(added, identity_pool.size()))
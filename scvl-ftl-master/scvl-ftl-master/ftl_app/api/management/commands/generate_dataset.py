@@ -0,0 +1,187 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from rest_framework.authtoken.models import Token
+
+from api.models import SlpId
+import api.dataset as dataset
+import api.fake_ledger as fake_ledger
+import api.settings_registry as settings_registry
+
+
+class Command(BaseCommand):
+    help = "Write a large synthetic dataset of orders and events directly into a fake ledger store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', default=os.getenv('SLP_URL'),
+                            help="fake:// URL of the ledger store, with a file path (default: SLP_URL)")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed of the dataset; the same seed and parameters give the same dataset")
+        parser.add_argument('--identities', type=int, default=100,
+                            help="Number of ledger identities, each with a user")
+        parser.add_argument('--orders', type=int, default=1000,
+                            help="Number of orders")
+        parser.add_argument('--events', type=float, default=5,
+                            help="Mean number of events per confirmed order")
+        parser.add_argument('--event-distribution', choices=dataset.DISTRIBUTIONS, default='poisson',
+                            help="Distribution of the number of events per order")
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="Zipf exponent of the orders per identity (0: uniform)")
+        parser.add_argument('--pending-ratio', type=float, default=0.1,
+                            help="Fraction of orders that are never confirmed")
+        parser.add_argument('--reject-ratio', type=float, default=0.1,
+                            help="Fraction of orders that are rejected")
+        parser.add_argument('--completed-ratio', type=float, default=0.5,
+                            help="Fraction of confirmed orders that complete their trip")
+        parser.add_argument('--prefix', default='dataset',
+                            help="Username prefix of the identities")
+        parser.add_argument('--password', default='dataset',
+                            help="Password of the users")
+        parser.add_argument('--no-users', action='store_true',
+                            help="Only write to the ledger, without creating users")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of orders generated and stored at once")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of processes generating chunks")
+        parser.add_argument('--output',
+                            help="Write username, token, SLP ID and public key of "
+                                 "every user to this CSV file, as onboard_users does")
+
+    def handle(self, *args, **options):
+        """
+        Generates a dataset with api/dataset.py and loads it into the
+        fake ledger store of --ledger, which must be kept in a file.
+
+        Chunks of --chunk-size orders are generated by --workers processes
+        and stored one at a time, each in a single database transaction.
+        Chunks that are already in the store are skipped, so an interrupted
+        run is resumed by running the same command again.
+
+        Unless --no-users is given, every identity also gets a user
+        (named --prefix followed by its number), a token and an SLP ID,
+        so the dataset can be listed through the API. Existing users are
+        left alone. Orders carry the current order_shape and event_shape
+        settings, if any.
+        """
+        if not fake_ledger.is_fake(options['ledger']):
+            raise CommandError("Datasets are written into a fake ledger store; pass a fake:/// URL")
+        path, _ = fake_ledger.parse_url(options['ledger'])
+        if path == ':memory:':
+            raise CommandError("The ledger store must be kept in a file, e.g. fake:///tmp/ledger.sqlite3")
+
+        try:
+            data = dataset.Dataset(
+                seed=options['seed'],
+                identities=options['identities'],
+                orders=options['orders'],
+                events=options['events'],
+                event_distribution=options['event_distribution'],
+                skew=options['skew'],
+                pending_ratio=options['pending_ratio'],
+                reject_ratio=options['reject_ratio'],
+                completed_ratio=options['completed_ratio'],
+                chunk_size=options['chunk_size'],
+                prefix=options['prefix'],
+                order_shape=settings_registry.get('order_shape', '') or None,
+                event_shape=settings_registry.get('event_shape', '') or None,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        if data.order_shape is None:
+            self.stderr.write("order_shape is not set; orders are stored without shape")
+
+        store = fake_ledger.LedgerStore(path)
+        try:
+            if store.load(data.identities_name, 0, identities=data.identity_rows()):
+                self.stderr.write("Stored {} identities".format(data.identities))
+            self.load_orders(store, data, max(1, options['workers'] or 1))
+        finally:
+            store.close()
+
+        if not options['no_users']:
+            users = self.create_users(data, options['password'])
+            if options['output']:
+                with open(options['output'], 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['username', 'token', 'slp_id', 'public_key'])
+                    writer.writerows(users)
+
+    def load_orders(self, store, data, workers):
+        loaded = store.loaded_chunks(data.name)
+        chunks = [chunk for chunk in range(data.chunks) if chunk not in loaded]
+        if loaded:
+            self.stderr.write("Resuming: {} of {} chunks were stored before".format(len(loaded), data.chunks))
+
+        started = time.perf_counter()
+        orders = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a few chunks per worker in flight, so that generating
+            # never waits for storing, without piling up chunks in memory
+            pending = deque()
+            chunks = iter(chunks)
+            while True:
+                for chunk in chunks:
+                    pending.append(executor.submit(dataset.generate, data, chunk))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                chunk, rows = pending.popleft().result()
+                store.load(data.name, chunk, **rows)
+                orders += len(rows['assets'])
+                self.stderr.write("Stored chunk {} of {} ({} transactions), {:.0f} orders/s".format(
+                    chunk + 1, data.chunks, len(rows['transactions']), orders / (time.perf_counter() - started)))
+        self.stderr.write("Dataset {} complete: {} orders in {} chunks".format(data.name, data.orders, data.chunks))
+
+    def create_users(self, data, password):
+        """
+        Create a user, token and SLP ID for every identity of @data that
+        has no user yet. Returns (username, token, SLP ID, public key)
+        of all identities' users.
+        """
+        usernames = [data.username(index) for index in range(data.identities)]
+        existing = set()
+        for start in range(0, len(usernames), 1000):
+            existing.update(User.objects.filter(username__in=usernames[start:start + 1000])
+                            .values_list('username', flat=True))
+
+        # All users share the password, so it is hashed once
+        hashed = make_password(password)
+        new = [index for index, username in enumerate(usernames) if username not in existing]
+        try:
+            for start in range(0, len(new), 1000):
+                batch = new[start:start + 1000]
+                with transaction.atomic():
+                    # Bulk inserts skip the post_save handlers,
+                    # so tokens and SLP IDs are created here
+                    User.objects.bulk_create([User(username=usernames[index], password=hashed)
+                                              for index in batch])
+                    by_username = dict(User.objects.filter(username__in=[usernames[index] for index in batch])
+                                       .values_list('username', 'pk'))
+                    tokens = []
+                    for index in batch:
+                        token = Token(user_id=by_username[usernames[index]])
+                        token.key = token.generate_key()
+                        tokens.append(token)
+                    Token.objects.bulk_create(tokens)
+                    SlpId.objects.bulk_create([
+                        SlpId(user_id=by_username[usernames[index]], active=True, **data.identity(index))
+                        for index in batch
+                    ])
+        except DatabaseError as e:
+            raise CommandError("Unable to save users: {}".format(e))
+        self.stderr.write("Created {} users, {} existed".format(len(new), len(existing)))
+
+        tokens = {}
+        for start in range(0, len(usernames), 1000):
+            tokens.update(Token.objects.filter(user__username__in=usernames[start:start + 1000])
+                          .values_list('user__username', 'key'))
+        return [(username, tokens.get(username, ''), data.identity(index)['slp_id'],
+                 data.identity(index)['public_key']) for index, username in enumerate(usernames)]
@@ -0,0 +1,376 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import csv
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+import requests
+
+from api.status.event_milestones import EventMilestones
+import api.benchmark as benchmark
+
+ORDER = {
+    'cargo': {
+        'cargo_type': 'General',
+        'package_type': 'Pallets',
+        'package_count': 26
+    },
+    'time_of_acceptance': '2019-10-18 16:19:25',
+    'place_of_acceptance': 'Soesterberg',
+    'time_of_delivery': '2019-10-19 08:00:01',
+    'place_of_delivery': 'Den Haag',
+    'reference_id': 'LOADGEN'
+}
+
+# Where each milestone of a trip happens; positions are reported on the way
+PLACES = {
+    EventMilestones.LOAD: ORDER['place_of_acceptance'],
+    EventMilestones.DEPART: ORDER['place_of_acceptance'],
+    EventMilestones.POSITION: 'Utrecht',
+    EventMilestones.ARRIVE: ORDER['place_of_delivery'],
+    EventMilestones.DISCHARGE: ORDER['place_of_delivery'],
+}
+NAMES = {
+    EventMilestones.LOAD: 'LOAD',
+    EventMilestones.DEPART: 'DEPART',
+    EventMilestones.POSITION: 'POSITION',
+    EventMilestones.ARRIVE: 'ARRIVE',
+    EventMilestones.DISCHARGE: 'DISCHARGE',
+}
+
+
+class Command(BaseCommand):
+    help = "Simulate a fleet of shippers, providers and trucks against a running deployment"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api',
+                            help="Base URL of the API")
+        parser.add_argument('--users',
+                            help="CSV file with username and token columns, as written by onboard_users "
+                                 "(default: create users with the admin account)")
+        parser.add_argument('--admin-username', default='root',
+                            help="Admin account used to create users")
+        parser.add_argument('--admin-password',
+                            help="Password of the admin account")
+        parser.add_argument('--shippers', type=int, default=10,
+                            help="Number of shippers, who create orders")
+        parser.add_argument('--providers', type=int, default=5,
+                            help="Number of providers, who confirm or reject orders and drive the trucks")
+        parser.add_argument('--order-rate', default='1',
+                            help="New orders per second; a comma-separated list runs one phase per rate")
+        parser.add_argument('--duration', type=float, default=60,
+                            help="Seconds per phase")
+        parser.add_argument('--reject-ratio', type=float, default=0.1,
+                            help="Fraction of orders that providers reject")
+        parser.add_argument('--decision-delay', type=float, default=2,
+                            help="Mean seconds before a provider confirms or rejects an order")
+        parser.add_argument('--event-interval', type=float, default=5,
+                            help="Mean seconds between the events of a truck")
+        parser.add_argument('--positions', type=int, default=3,
+                            help="Number of POSITION events per trip")
+        parser.add_argument('--workers', type=int, default=64,
+                            help="Maximum number of concurrent requests")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Request timeout in seconds")
+        parser.add_argument('--seed', type=int,
+                            help="Seed for the random arrivals")
+        parser.add_argument('--output',
+                            help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        """
+        Drives the HTTP API like a fleet would:
+        - shippers create orders, arriving as a Poisson process at --order-rate
+        - a provider confirms or rejects each order after --decision-delay
+        - the truck of every confirmed order reports LOAD, DEPART,
+          --positions POSITION events, ARRIVE and DISCHARGE,
+          --event-interval apart
+
+        The load is open-loop: requests are sent when they are due,
+        whether or not earlier requests have been answered, so a slow
+        deployment builds up a backlog instead of slowing the simulation
+        down. Latencies are measured from the moment a request was due,
+        and recorded per phase and operation in histograms.
+
+        Run several phases with increasing rates (e.g. --order-rate 1,2,4,8)
+        to find the rate at which throughput stops following the offered
+        load and latencies take off: the saturation point.
+        """
+        try:
+            self.rates = [float(rate) for rate in options['order_rate'].split(',')]
+        except ValueError:
+            raise CommandError("--order-rate must be a comma-separated list of numbers")
+        if not self.rates or min(self.rates) <= 0:
+            raise CommandError("Order rates must be positive")
+        if options['shippers'] < 1 or options['providers'] < 1:
+            raise CommandError("There must be at least one shipper and one provider")
+
+        self.options = options
+        self.url = options['url'].rstrip('/')
+        self.random = random.Random(options['seed'])
+        self.local = threading.local()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            self.executor = executor
+            self.setup_fleet()
+            self.run()
+
+        results = {
+            'timestamp': datetime.now().isoformat(),
+            'config': {key: options[key] for key in (
+                'url', 'shippers', 'providers', 'duration', 'reject_ratio', 'decision_delay',
+                'event_interval', 'positions', 'workers', 'seed')},
+            'phases': [self.phase_results(phase) for phase in range(len(self.rates))],
+        }
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    '''
+    HTTP
+    '''
+    def session(self):
+        # One session per thread, to reuse connections
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, method, path, token=None, auth=None, **kwargs):
+        headers = {'Authorization': 'Token {}'.format(token)} if token else {}
+        return self.session().request(method, self.url + path, headers=headers, auth=auth,
+                                      timeout=self.options['timeout'], **kwargs)
+
+    def expect_ok(self, response, what):
+        if response.status_code != 200:
+            raise CommandError("Could not {}: {} {}".format(what, response.status_code, response.text[:200]))
+        return response.json()
+
+    '''
+    Fleet
+    '''
+    def setup_fleet(self):
+        """
+        Load or create the shippers and providers, and put all
+        providers in the address book of every shipper.
+        """
+        needed = self.options['shippers'] + self.options['providers']
+        if self.options['users']:
+            with open(self.options['users'], newline='') as f:
+                users = [(row['username'], row['token']) for row in csv.DictReader(f)]
+            if len(users) < needed:
+                raise CommandError("{} users needed, {} found".format(needed, len(users)))
+            users = users[:needed]
+        else:
+            if not self.options['admin_password']:
+                raise CommandError("Provide --users or --admin-password")
+            run = int(time.time())
+            names = ['lg{}s{}'.format(run, i) for i in range(self.options['shippers'])]
+            names += ['lg{}p{}'.format(run, i) for i in range(self.options['providers'])]
+            users = list(self.executor.map(self.create_user, names))
+
+        public_keys = list(self.executor.map(self.public_key, [token for _, token in users]))
+        self.shippers = users[:self.options['shippers']]
+        self.providers = [(username, token, public_key) for (username, token), public_key
+                          in zip(users[self.options['shippers']:], public_keys[self.options['shippers']:])]
+
+        jobs = [(shipper_token, provider) for _, shipper_token in self.shippers for provider in self.providers]
+        list(self.executor.map(lambda job: self.add_address(*job), jobs))
+        self.stderr.write("Fleet ready: {} shippers, {} providers".format(len(self.shippers), len(self.providers)))
+
+    def create_user(self, username):
+        password = 'loadgen'
+        auth = (self.options['admin_username'], self.options['admin_password'])
+        self.expect_ok(self.request('post', '/user/', auth=auth, data={
+            'username': username, 'password': password, 'is_active': True
+        }), "create user {}".format(username))
+        token = self.expect_ok(self.request('get', '/auth_token/{}/{}'.format(username, password)),
+                               "get token of {}".format(username))['token']
+        return username, token
+
+    def public_key(self, token):
+        slp_ids = self.expect_ok(self.request('get', '/slp_id/', token=token), "get SLP IDs")
+        if not slp_ids:
+            raise CommandError("User has no SLP ID")
+        return slp_ids[0]['public_key']
+
+    def add_address(self, token, provider):
+        username, _, public_key = provider
+        response = self.request('post', '/address/', token=token, data={'alias': username, 'public_key': public_key})
+        # Entries of earlier runs with the same users are fine
+        if response.status_code not in (200, 400):
+            self.expect_ok(response, "add {} to address book".format(username))
+
+    '''
+    Simulation
+    '''
+    def run(self):
+        """
+        Send every request when it is due, until the last phase ends.
+        Follow-up requests are scheduled when their predecessor succeeds.
+        """
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.offered = [0] * len(self.rates)
+        self.dropped = 0
+        self.schedule = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.in_flight = 0
+
+        self.start = time.monotonic()
+        self.end = self.start + self.options['duration'] * len(self.rates)
+        self.due(self.start, self.arrive_order)
+
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now >= self.end:
+                    break
+                if self.schedule and self.schedule[0][0] <= now:
+                    due, _, task, args = heapq.heappop(self.schedule)
+                    self.in_flight += 1
+                    self.executor.submit(self.perform, due, task, args)
+                    continue
+                wakeup = self.schedule[0][0] if self.schedule else self.end
+                self.condition.wait(min(wakeup, self.end) - now)
+            self.dropped = len(self.schedule)
+            self.schedule = []
+            # Let requests that were sent finish
+            while self.in_flight:
+                self.condition.wait()
+
+    def phase(self, moment):
+        return min(int((moment - self.start) // self.options['duration']), len(self.rates) - 1)
+
+    def due(self, moment, task, *args):
+        with self.condition:
+            heapq.heappush(self.schedule, (moment, next(self.sequence), task, args))
+            self.condition.notify()
+
+    def after(self, mean_delay, task, *args):
+        self.due(time.monotonic() + self.random.expovariate(1.0 / mean_delay) if mean_delay > 0
+                 else time.monotonic(), task, *args)
+
+    def perform(self, due, task, args):
+        try:
+            task(due, *args)
+        except Exception as e:
+            self.stderr.write("Task {} failed: {}".format(task.__name__, e))
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def timed(self, due, operation, method, path, token, **kwargs):
+        """
+        Make a request that was due at @due and record it under @operation.
+        Returns the response, or None if the request failed.
+        """
+        started = time.monotonic()
+        try:
+            response = self.request(method, path, token=token, **kwargs)
+            status = response.status_code
+        except requests.RequestException as e:
+            response, status = None, type(e).__name__
+        finished = time.monotonic()
+
+        with self.stats_lock:
+            key = (self.phase(due), operation)
+            if key not in self.stats:
+                self.stats[key] = {'latency': benchmark.Histogram(), 'service': benchmark.Histogram(),
+                                   'statuses': {}}
+            stats = self.stats[key]
+            stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+        # Latency includes waiting for a free worker; service time does not
+        stats['latency'].record(finished - due)
+        stats['service'].record(finished - started)
+        if response is not None and response.status_code != 200:
+            return None
+        return response
+
+    '''
+    Lifecycle of an order
+    '''
+    def arrive_order(self, due):
+        # Schedule the next arrival first, so the arrival rate does not
+        # depend on how fast this order is created
+        rate = self.rates[self.phase(due)]
+        self.due(due + self.random.expovariate(rate), self.arrive_order)
+        self.offered[self.phase(due)] += 1
+
+        _, token = self.random.choice(self.shippers)
+        provider = self.random.choice(self.providers)
+        response = self.timed(due, 'create_order', 'post', '/orders/', token,
+                              json={'order': ORDER, 'service_provider': provider[0]})
+        if response is not None:
+            self.after(self.options['decision_delay'], self.decide, response.json(), provider)
+
+    def decide(self, due, asset_id, provider):
+        _, token, _ = provider
+        path = '/orders/{}/'.format(asset_id)
+        if self.random.random() < self.options['reject_ratio']:
+            self.timed(due, 'reject_order', 'delete', path, token)
+            return
+        if self.timed(due, 'confirm_order', 'put', path, token) is not None:
+            trip = ([EventMilestones.LOAD, EventMilestones.DEPART]
+                    + [EventMilestones.POSITION] * self.options['positions']
+                    + [EventMilestones.ARRIVE, EventMilestones.DISCHARGE])
+            self.after(self.options['event_interval'], self.drive, asset_id, provider, trip)
+
+    def drive(self, due, asset_id, provider, trip):
+        milestone, rest = trip[0], trip[1:]
+        event = {
+            'order_asset_id': asset_id,
+            'event': {
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'place': PLACES[milestone],
+                'milestone': milestone,
+            }
+        }
+        response = self.timed(due, 'event_{}'.format(NAMES[milestone]), 'post', '/events/', provider[1], json=event)
+        if response is not None and rest:
+            self.after(self.options['event_interval'], self.drive, asset_id, provider, rest)
+
+    '''
+    Results
+    '''
+    def phase_results(self, phase):
+        operations = {}
+        for (stats_phase, operation), stats in sorted(self.stats.items()):
+            if stats_phase != phase:
+                continue
+            operations[operation] = {
+                'statuses': stats['statuses'],
+                'errors': sum(count for status, count in stats['statuses'].items() if status != '200'),
+                'latency': stats['latency'].summary(),
+                'service': stats['service'].summary(),
+            }
+        completed = sum(operation['latency']['count'] for operation in operations.values())
+        return {
+            'order_rate': self.rates[phase],
+            'duration': self.options['duration'],
+            'orders_offered': self.offered[phase],
+            'requests': completed,
+            'throughput': completed / self.options['duration'],
+            'operations': operations,
+        }
+
+    def report(self, results):
+        for phase in results['phases']:
+            self.stderr.write("Phase at {order_rate} orders/s: {orders_offered} orders, "
+                              "{requests} requests, {throughput:.1f} req/s".format(**phase))
+            self.stderr.write("  {:<18} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+                'operation', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+            for operation, stats in phase['operations'].items():
+                latency = stats['latency']
+                self.stderr.write("  {:<18} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                    operation, latency['count'], stats['errors'], latency['p50'] * 1000,
+                    latency['p95'] * 1000, latency['p99'] * 1000, latency['max'] * 1000))
+        if self.dropped:
+            self.stderr.write("{} scheduled requests were not sent before the end".format(self.dropped))
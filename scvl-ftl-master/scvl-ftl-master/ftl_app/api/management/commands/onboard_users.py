@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import sys
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from rest_framework.authtoken.models import Token
+
+from api.deadline import LedgerUnavailable
+from api.models import PooledSlpId, SlpId
+import api.identity_pool as identity_pool
+
+
+class Command(BaseCommand):
+    help = "Create many users at once, each with a token and a ledger identity"
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='?',
+                            help="CSV file with a username and password column (and optionally email), "
+                                 "or '-' to read from standard input")
+        parser.add_argument('--count', type=int,
+                            help="Generate this many users instead of reading them from a file")
+        parser.add_argument('--prefix', default='user',
+                            help="Username prefix for generated users")
+        parser.add_argument('--workers', type=int,
+                            help="Number of concurrent ledger calls (default: IDENTITY_POOL_WORKERS)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of users stored per database transaction")
+        parser.add_argument('--output',
+                            help="Write username, token, SLP ID and public key of "
+                                 "every new user to this CSV file (default: standard output)")
+
+    def handle(self, *args, **options):
+        """
+        Onboards users in bulk.
+
+        Ledger identities are taken from the identity pool
+        (see api/identity_pool.py) as long as it has any, and created
+        concurrently for the remaining users. Users, tokens and SLP IDs
+        are then stored with one bulk insert per table and batch.
+        A user whose identity cannot be created is skipped and reported.
+        """
+        rows = self.read_rows(options)
+        workers = options['workers'] or settings.IDENTITY_POOL_WORKERS
+        batch_size = max(1, options['batch_size'])
+
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        writer = csv.writer(output)
+        writer.writerow(['username', 'token', 'slp_id', 'public_key'])
+
+        created = failed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for start in range(0, len(rows), batch_size):
+                    batch = rows[start:start + batch_size]
+                    new, errors = self.onboard_batch(batch, executor)
+                    for username, token, slp_id in new:
+                        writer.writerow([username, token, slp_id['slp_id'], slp_id['public_key']])
+                    for username, error in errors:
+                        self.stderr.write("Skipped {}: {}".format(username, error))
+                    created += len(new)
+                    failed += len(errors)
+                    self.stderr.write("{}/{} users processed".format(start + len(batch), len(rows)))
+        finally:
+            if options['output']:
+                output.close()
+
+        # Replace the identities that were taken from the pool
+        identity_pool.refill_async()
+        self.stderr.write("Created {} users, skipped {}".format(created, failed))
+
+    def read_rows(self, options):
+        """
+        Return the (username, password, email) of the users to create,
+        leaving out existing usernames.
+        """
+        if options['count']:
+            rows = [('{}{}'.format(options['prefix'], i), None, '') for i in range(options['count'])]
+        elif options['users']:
+            f = sys.stdin if options['users'] == '-' else open(options['users'], newline='')
+            try:
+                rows = [(row['username'], row.get('password') or None, row.get('email') or '')
+                        for row in csv.DictReader(f)]
+            except KeyError:
+                raise CommandError("The CSV file needs a 'username' column")
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        else:
+            raise CommandError("Provide a CSV file or --count")
+
+        usernames = [row[0] for row in rows]
+        if len(set(usernames)) != len(usernames):
+            raise CommandError("Usernames must be unique")
+        existing = set()
+        for start in range(0, len(usernames), 1000):
+            existing.update(User.objects.filter(username__in=usernames[start:start + 1000])
+                            .values_list('username', flat=True))
+        for username in sorted(existing):
+            self.stderr.write("Skipped {}: user already exists".format(username))
+        return [row for row in rows if row[0] not in existing]
+
+    def onboard_batch(self, batch, executor):
+        """
+        Create the users in @batch, using @executor for ledger calls
+        and password hashing. Returns the created (username, token, identity)
+        tuples and the (username, error) tuples of skipped users.
+        """
+        # Start hashing all passwords, then get an identity per user:
+        # from the pool while it lasts, from the ledger otherwise
+        passwords = [executor.submit(make_password, password) for _, password, _ in batch]
+        identities = []
+        for username, _, _ in batch:
+            fields = identity_pool.claim()
+            if fields is not None:
+                identities.append(fields)
+            else:
+                identities.append(executor.submit(identity_pool.create_identity, username))
+
+        # The identities are claimed and created outside the transaction below,
+        # which would otherwise lock the database during the ledger calls,
+        # so pool them if the batch fails rather than lose their keys
+        try:
+            return self.save_batch(batch, passwords, identities)
+        except BaseException:
+            PooledSlpId.objects.bulk_create([PooledSlpId(**fields) for fields in self.obtained(identities)])
+            raise
+
+    def obtained(self, identities):
+        """
+        Return the fields of the @identities (dicts, or futures of ledger calls)
+        that were claimed or created successfully.
+        """
+        obtained = []
+        for identity in identities:
+            if not isinstance(identity, dict):
+                try:
+                    identity = identity.result()
+                except Exception:
+                    continue
+            obtained.append(identity)
+        return obtained
+
+    def save_batch(self, batch, passwords, identities):
+        """
+        Store the users in @batch with their hashed @passwords and
+        @identities (dicts, or futures of ledger calls), as for onboard_batch.
+        """
+        users = []
+        new_identities = []
+        errors = []
+        for (username, _, email), password, identity in zip(batch, passwords, identities):
+            if not isinstance(identity, dict):
+                try:
+                    identity = identity.result()
+                except (ValueError, LedgerUnavailable) as e:
+                    errors.append((username, e))
+                    continue
+            users.append(User(username=username, email=email, password=password.result()))
+            new_identities.append(identity)
+
+        try:
+            with transaction.atomic():
+                # Bulk inserts skip the post_save handlers,
+                # so tokens and SLP IDs are created here
+                User.objects.bulk_create(users)
+                by_username = dict(User.objects.filter(username__in=[u.username for u in users])
+                                   .values_list('username', 'pk'))
+                tokens = []
+                for user in users:
+                    token = Token(user_id=by_username[user.username])
+                    token.key = token.generate_key()
+                    tokens.append(token)
+                Token.objects.bulk_create(tokens)
+                SlpId.objects.bulk_create([
+                    SlpId(user_id=by_username[user.username], active=True, **identity)
+                    for user, identity in zip(users, new_identities)
+                ])
+        except DatabaseError as e:
+            raise CommandError("Unable to save users: {}".format(e))
+
+        return [(user.username, token.key, identity)
+                for user, token, identity in zip(users, tokens, new_identities)], errors
@@ -0,0 +1,274 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import OrderProjection, Publication, SlpId
+import api.projection as projection
+from api.semantics import Semantics, has_type
+from api.slp_interface import SlpInterface
+import api.slp_helpers as slp_helpers
+from api.status.order_status import OrderStatus
+
+CHECKS = ('publications', 'slp_ids', 'projection')
+
+
+def iter_by_pk(queryset, page_size=1000):
+    """
+    Yield the rows of @queryset in order of primary key, one page at a time.
+
+    Unlike .iterator(), no cursor stays open between pages, so the
+    rows may be updated while they are being walked. SQLite does not
+    isolate an open cursor from writes on the same connection.
+    """
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        page = list(page[:page_size])
+        if not page:
+            return
+        yield from page
+        last_pk = page[-1].pk
+
+
+def order_summary(transactions):
+    """
+    Condense the sorted @transactions of an order to the
+    fields of its projection, so the full list need not be kept.
+    """
+    customer = provider = None
+    try:
+        customer = transactions[0]['inputs'][0]['owners_before'][0]
+        provider = transactions[0]['outputs'][0]['public_keys'][0]
+    except (KeyError, IndexError, TypeError):
+        pass
+    return {
+        'latest_tx_id': transactions[-1]['id'],
+        'status': OrderStatus.status_from_transactions(transactions),
+        'customer': customer,
+        'provider': provider,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare local records with the ledger and report (or repair) differences"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='append', choices=CHECKS,
+                            help="Only run this check (can be repeated; default: all)")
+        parser.add_argument('--repair', action='store_true',
+                            help="Bring local state in line with the ledger where possible")
+        parser.add_argument('--workers', type=int, default=settings.SLP_MAX_WORKERS,
+                            help="Number of concurrent ledger calls")
+        parser.add_argument('--window', type=int,
+                            help="Maximum number of rows being checked at once (default: 4 x workers)")
+        parser.add_argument('--output',
+                            help="Write the report to this file (default: standard output)")
+
+    def handle(self, *args, **options):
+        """
+        Walks the Publication, SlpId and OrderProjection tables and
+        compares every row with the ledger. Differences are written as
+        one JSON object per line, as soon as they are found:
+        {"check": ..., "kind": ..., "id": ..., "local": ..., "ledger": ..., "repaired": ...}
+
+        Kinds of differences:
+        - missing: a local record has no counterpart on the ledger
+        - extra: the ledger has an asset that is not recorded locally
+        - status_mismatch / stale: the projection of an order is outdated
+        - error: the ledger could not be queried for this row
+
+        With --repair, extra assets are recorded as publications,
+        untracked orders are added to the projection and outdated
+        projections are updated. Missing records are only reported,
+        since the ledger cannot be written from here.
+
+        Rows are read with .iterator() (the projection, which repairs
+        write to, in pages by primary key) and ledger calls are made
+        on a bounded pool, with at most --window rows in flight,
+        so memory use does not grow with the number of rows.
+        """
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        self.repair = options['repair']
+        self.window = options['window'] or 4 * options['workers']
+        self.counts = {}
+        self.output = open(options['output'], 'w') if options['output'] else self.stdout
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                self.executor = executor
+                for check in options['check'] or CHECKS:
+                    getattr(self, 'check_{}'.format(check))()
+        finally:
+            if options['output']:
+                self.output.close()
+
+        summary = ', '.join('{} {}'.format(count, kind) for kind, count in sorted(self.counts.items()))
+        self.stderr.write("Reconciliation done: {}".format(summary or "no differences"))
+
+    def report(self, check, kind, id, local=None, ledger=None, repaired=False):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.output.write(json.dumps({
+            'check': check,
+            'kind': kind,
+            'id': id,
+            'local': local,
+            'ledger': ledger,
+            'repaired': repaired,
+        }) + '\n')
+
+    def check_publications(self):
+        """
+        Every publication should exist on the ledger, with a transaction
+        signed by the publishing SLP ID: its CREATE, or a TRANSFER.
+        """
+        publications = (Publication.objects.select_related('slp_id')
+                        .only('pk', 'ledger_asset', 'tx_type', 'slp_id__public_key')
+                        .order_by('pk').iterator())
+
+        def fetch(publication):
+            try:
+                return slp_helpers.get_transactions(publication.ledger_asset)
+            except ValueError:
+                # The ledger answered, but does not know the asset
+                return []
+
+        for publication, future in slp_helpers.bounded_map(fetch, publications, self.executor, self.window):
+            try:
+                txs = future.result()
+            except Exception as e:
+                self.report('publications', 'error', publication.ledger_asset, ledger=str(e))
+                continue
+            signer = publication.slp_id.public_key
+            found = any(
+                tx['operation'] == publication.tx_type
+                and any(signer in tx_input['owners_before'] for tx_input in tx['inputs'])
+                for tx in txs
+            )
+            if not found:
+                self.report('publications', 'missing', publication.ledger_asset,
+                            local={'publication': publication.pk, 'tx_type': publication.tx_type})
+
+    def check_slp_ids(self):
+        """
+        Every asset created by one of our SLP IDs should be recorded
+        as a publication, or, for orders, in the projection.
+        """
+        slp_ids = SlpId.objects.order_by('pk').iterator()
+
+        def fetch(slp_id):
+            # Keep only what is compared, not the assets themselves
+            created = []
+            for asset_id, asset_dict in SlpInterface().iter_history_of_user(slp_id.slp_id, created=True):
+                try:
+                    recipient = asset_dict['transactions'][0]['outputs'][0]['public_keys'][0]
+                except (KeyError, IndexError, TypeError):
+                    recipient = None
+                try:
+                    is_order = has_type(Semantics.SCVL.Order, asset_dict['asset'])
+                except (KeyError, TypeError, ValueError):
+                    is_order = False
+                created.append((asset_id, recipient, is_order))
+            return created
+
+        for slp_id, future in slp_helpers.bounded_map(fetch, slp_ids, self.executor, self.window):
+            try:
+                created = future.result()
+            except Exception as e:
+                self.report('slp_ids', 'error', slp_id.slp_id, ledger=str(e))
+                continue
+
+            for start in range(0, len(created), 1000):
+                chunk = created[start:start + 1000]
+                asset_ids = [asset_id for asset_id, _, _ in chunk]
+                published = set(Publication.objects.filter(
+                    slp_id=slp_id, tx_type="CREATE", ledger_asset__in=asset_ids
+                ).values_list('ledger_asset', flat=True))
+                projected = set(OrderProjection.objects.filter(
+                    asset_id__in=asset_ids
+                ).values_list('asset_id', flat=True))
+
+                for asset_id, recipient, is_order in chunk:
+                    # Orders are not recorded as publications, but projected
+                    if is_order:
+                        if asset_id not in projected:
+                            self.report('projection', 'extra', asset_id,
+                                        local={'slp_id': slp_id.slp_id},
+                                        repaired=self.repair_untracked_order(asset_id))
+                    elif asset_id not in published:
+                        self.report('slp_ids', 'extra', asset_id,
+                                    local={'slp_id': slp_id.slp_id},
+                                    repaired=self.repair_publication(slp_id, asset_id, recipient))
+
+    def check_projection(self):
+        """
+        Every projected order should exist on the ledger,
+        with the projected status and latest transaction.
+        """
+        # Repairs write to the projection, so it is paged rather than streamed
+        orders = iter_by_pk(OrderProjection.objects.all())
+
+        def fetch(order):
+            try:
+                txs = slp_helpers.get_transactions(order.asset_id, sort=True)
+            except ValueError:
+                # The ledger answered, but does not know the asset
+                return None
+            return order_summary(txs) if txs else None
+
+        for order, future in slp_helpers.bounded_map(fetch, orders, self.executor, self.window):
+            try:
+                summary = future.result()
+            except Exception as e:
+                self.report('projection', 'error', order.asset_id, ledger=str(e))
+                continue
+            if summary is None:
+                self.report('projection', 'missing', order.asset_id,
+                            local={'latest_tx_id': order.latest_tx_id})
+                continue
+
+            if summary['status'] != order.status:
+                kind = 'status_mismatch'
+            elif summary['latest_tx_id'] != order.latest_tx_id:
+                kind = 'stale'
+            else:
+                continue
+            repaired = False
+            if self.repair:
+                projection.record(order.asset_id, summary['latest_tx_id'], status=summary['status'],
+                                  customer=summary['customer'], provider=summary['provider'])
+                repaired = True
+            self.report('projection', kind, order.asset_id,
+                        local={'latest_tx_id': order.latest_tx_id, 'status': order.status},
+                        ledger={'latest_tx_id': summary['latest_tx_id'], 'status': summary['status']},
+                        repaired=repaired)
+
+    def repair_publication(self, slp_id, asset_id, recipient):
+        if not self.repair:
+            return False
+        Publication.objects.create(
+            slp_id=slp_id,
+            description="reconciled.{}".format(asset_id),
+            ledger_asset=asset_id,
+            recipient=recipient if recipient and recipient != slp_id.public_key else "self",
+            tx_type="CREATE"
+        )
+        return True
+
+    def repair_untracked_order(self, asset_id):
+        if not self.repair:
+            return False
+        try:
+            txs = slp_helpers.get_transactions(asset_id, sort=True)
+        except Exception:
+            return False
+        if not txs:
+            return False
+        summary = order_summary(txs)
+        projection.record(asset_id, summary['latest_tx_id'], status=summary['status'],
+                          customer=summary['customer'], provider=summary['provider'])
+        return True
@@ -1,17 +1,18 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from django.db import DatabaseError
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
-from rest_framework.authtoken.models import Token
-from api.models import Setting, SlpId
+from api.models import PublishedShape, Publication, Setting, SlpId
 from django.core.exceptions import ObjectDoesNotExist
 from datetime import datetime # For time stamping
 
-from rest_framework.test import APIClient
-from django.urls import reverse
-from rest_framework import status as http_status
-
+import rdflib
 
+from api.deadline import LedgerUnavailable
+import api.identity as identity
+import api.shacl as shacl
+from api.slp_interface import SlpInterface
 
 
 # SHACL Shape file locations
@@ -26,43 +27,55 @@ shapes = {
     },
 }
 
+# Shapes published by this process, by (ledger URL, content hash).
+# Survives the database being rolled back between test cases,
+# while the ledger keeps the published shapes.
+published = {}
+
+
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--admin-username',
                             help="The name of the account holding admin permissions")
+        parser.add_argument('--force', action='store_true',
+                            help="Publish all shapes, even if they were published before")
 
     def handle(self, *args, **options):
         """
         This command posts all relevant SHACL shapes to the ledger
         and sets the Setting key-value pairs accordingly.
 
+        Shapes are identified by a hash of their canonical form, so that
+        formatting changes do not count as changes. Shapes that were
+        published before are not published again; the others are
+        published concurrently.
+
         The command requires the use of a User account with admin permissions.
         @admin_username: A username for a user with admin permissions.
         """
-        
+
         if 'admin_username' in options and options['admin_username']:
             admin_username = options['admin_username']
         else:
             admin_username = 'root'
-        
-        print('Posting SHACL with username', admin_username)
 
-        # Create client for POST calls
-        client = APIClient()
+        print('Posting SHACL with username', admin_username)
 
         # Get admin info
         try:
-            admin_token = Token.objects.get(user__username=admin_username)
+            admin = User.objects.get(username=admin_username)
             # get most recent, active, slp-id
-            admin_slp_id = SlpId.objects.filter(user__username=admin_username, active=True).order_by('-timestamp')[0].slp_id
+            admin_slp_id = identity.default_id(admin)
         except ObjectDoesNotExist as e:
             raise CommandError("Unable to retrieve admin user info: {}".format(e))
 
+        slp_interface = SlpInterface(
+            os.getenv('SLP_URL'),
+            os.getenv('SLP_TOKEN')
+        )
 
-        # Authenticate as admin
-        client.credentials(HTTP_AUTHORIZATION='Token ' + admin_token.key)
-
-        # TODO move code below to a helper method?
+        # Read and hash all shapes, and look up the ones published before
+        to_publish = []
         for shape_name, shape in shapes.items():
             # Get shape file contents
             shape_path = shape['relative_filepath']
@@ -70,33 +83,70 @@ class Command(BaseCommand):
 
             # read shape file
             with open(full_shape_path) as f:
-                shape_content = f.read()
-
-            # publish shape
-            url = reverse('raw_publication')
-            postdata = {
-                "publication": shape_content,
-                "format": "n3",
-                "description": shape_name + str(datetime.now),
-                "slp_id": admin_slp_id
-            }
-            response = client.post(url, data=postdata)
-
-            if response.status_code != http_status.HTTP_200_OK:
-                raise CommandError("Failed to publish shape: " + response.data)
-            
-            shape['asset_id'] = response.data
-            print(shape_name, 'asset ID:', shape['asset_id'])
+                shape['content'] = f.read()
+            shape['hash'] = shacl.canonical_hash(rdflib.Graph().parse(data=shape['content'], format='turtle'))
+
+            if not options['force']:
+                key = (slp_interface.slp_url, shape['hash'])
+                if key not in published:
+                    known = PublishedShape.objects.filter(
+                        ledger_url=slp_interface.slp_url, content_hash=shape['hash']).first()
+                    if known is not None:
+                        published[key] = known.asset_id
+                if key in published:
+                    shape['asset_id'] = published[key]
+                    print(shape_name, 'unchanged, asset ID:', shape['asset_id'])
+                    continue
+            to_publish.append(shape_name)
+
+        # Publish new and changed shapes
+        def publish(shape_name):
+            return slp_interface.publish(
+                slp_id=admin_slp_id.slp_id,
+                private_key=admin_slp_id.private_key,
+                payload=shapes[shape_name]['content'],
+                format="n3"
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, len(to_publish))) as executor:
+            futures = [(shape_name, executor.submit(publish, shape_name)) for shape_name in to_publish]
+            for shape_name, future in futures:
+                shape = shapes[shape_name]
+                try:
+                    shape['asset_id'] = future.result()
+                except (ValueError, LedgerUnavailable) as e:
+                    raise CommandError("Failed to publish shape: {}".format(e))
+                print(shape_name, 'asset ID:', shape['asset_id'])
 
+                try:
+                    # Record the publication, as the raw_publication endpoint would
+                    Publication.objects.create(
+                        slp_id=admin_slp_id,
+                        description="{}.{}".format(shape_name, datetime.now().isoformat()),
+                        ledger_asset=shape['asset_id'],
+                        recipient="self",
+                        tx_type="CREATE"
+                    )
+                    PublishedShape.objects.update_or_create(
+                        ledger_url=slp_interface.slp_url,
+                        content_hash=shape['hash'],
+                        defaults={'name': shape_name, 'asset_id': shape['asset_id']}
+                    )
+                except DatabaseError as e:
+                    raise CommandError("Unable to register shape: {}".format(e))
+                published[(slp_interface.slp_url, shape['hash'])] = shape['asset_id']
+
+        for shape_name, shape in shapes.items():
             # Save setting
             # If the setting already exists, update it
             try:
                 s = Setting.objects.get(setting=shape_name)
-                s.value = shape['asset_id']
-                s.save()
+                if s.value != shape['asset_id']:
+                    s.value = shape['asset_id']
+                    s.save()
             # If the setting does not exist, create it
             except ObjectDoesNotExist:
-                s = Setting(user=User.objects.get(username=admin_username), setting=shape_name, value=shape['asset_id'])
+                s = Setting(user=admin, setting=shape_name, value=shape['asset_id'])
                 try:
                     s.save()
                 except DatabaseError as e:
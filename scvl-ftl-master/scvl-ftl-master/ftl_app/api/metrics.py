@@ -0,0 +1,347 @@
+"""
+A module that collects operational metrics and exposes them to Prometheus.
+
+The registry holds counters, gauges and histograms with labels, and
+renders them in the Prometheus text exposition format for the /metrics
+endpoint. The app records:
+- ledger calls, by operation and HTTP status (ftl_slp_request_duration_seconds)
+- the wait for a worker of slp_helpers.submit, and its queue depth
+- the concurrency limit, in-flight, waiting and shed ledger calls per lane
+- order status lookups (Status.get_status)
+- cache lookups by cache and result, from which hit rates follow
+- the webhook queue depth, deliveries and retries
+- request latency per view
+
+Under gunicorn every worker process has its own registry. With
+METRICS_DIR set, each process writes a snapshot of its registry to
+a file of its own in that directory, at most METRICS_FLUSH_INTERVAL
+seconds old, and /metrics merges the files of all processes: counters
+and histograms are summed over all processes that ever ran, so they
+survive worker restarts, and gauges are summed over live processes
+only. The directory should be emptied when the deployment starts.
+Without METRICS_DIR, /metrics shows the serving process only.
+
+Values that are already counted elsewhere, such as the token cache
+statistics, are read when a snapshot is taken, through a collect function.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds (seconds) for latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric(object):
+    """
+    A metric @name with the label names @labels. Its values are kept per
+    tuple of label values. @collect, if given, is a function returning
+    more values as a {label values: value} dict, read at snapshot time.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """
+        Return the current values as a list of [label values, value] pairs.
+        """
+        with self._lock:
+            values = dict(self._values)
+        if self.collect is not None:
+            try:
+                for labels, value in self.collect().items():
+                    values[labels] = self._add(values.get(labels), value)
+            except Exception:
+                logger.exception("Could not collect metric %s", self.name)
+        return [[list(labels), value] for labels, value in values.items()]
+
+    def _add(self, a, b):
+        return b if a is None else a + b
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Histogram with the bucket upper bounds @buckets. Its value per
+    label tuple is [count per bucket (the last for +Inf), sum].
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            return [[list(labels), [list(counts), total]] for labels, (counts, total) in self._values.items()]
+
+    def _add(self, a, b):
+        if a is None:
+            return b
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric {} already exists".format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=(), collect=None):
+        return self._register(Counter(name, documentation, labels, collect))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self._register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self):
+        """
+        Return the values of all metrics of this process, as JSON-able data.
+        """
+        return {name: metric.samples() for name, metric in self._metrics.items()}
+
+    '''
+    Multi-process support
+    '''
+    def _path(self, pid):
+        return os.path.join(settings.METRICS_DIR, 'metrics-{}.json'.format(pid))
+
+    def flush(self):
+        """
+        Write the snapshot of this process to METRICS_DIR, if set.
+        """
+        if not settings.METRICS_DIR:
+            return
+        path = self._path(os.getpid())
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+    def start(self):
+        """
+        Make sure this process writes its snapshot every
+        METRICS_FLUSH_INTERVAL seconds. Cheap enough to call per request;
+        it also restarts the writer in processes forked after the first call.
+        """
+        if not settings.METRICS_DIR or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_forever, name='metrics-flusher', daemon=True)
+        thread.start()
+
+    def _flush_forever(self):
+        while True:
+            self.flush()
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+
+    def merged(self):
+        """
+        Return the snapshots of all processes merged, see the module documentation.
+        """
+        merged = {name: {} for name in self._metrics}
+        snapshots = [(os.getpid(), self.snapshot())]
+        if settings.METRICS_DIR:
+            self.flush()
+            for filename in os.listdir(settings.METRICS_DIR):
+                if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                    continue
+                pid = int(filename[len('metrics-'):-len('.json')])
+                if pid == os.getpid():
+                    continue
+                try:
+                    with open(os.path.join(settings.METRICS_DIR, filename)) as f:
+                        snapshots.append((pid, json.load(f)))
+                except (OSError, ValueError) as e:
+                    logger.warning("Could not read metrics file %s: %s", filename, e)
+
+        for pid, snapshot in snapshots:
+            alive = pid == os.getpid() or _alive(pid)
+            for name, samples in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    merged[name][labels] = metric._add(merged[name].get(labels), value)
+        return merged
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, values in sorted(self.merged().items()):
+            metric = self._metrics[name]
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+            # Label values may mix types, e.g. status codes and exception names
+            for labels, value in sorted(values.items(), key=lambda item: [str(label) for label in item[0]]):
+                pairs = list(zip(metric.labels, labels))
+                if metric.kind != 'histogram':
+                    lines.append('{}{} {}'.format(name, _labels(pairs), _number(value)))
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append('{}_bucket{} {}'.format(name, _labels(pairs + [('le', le)]), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(pairs), _number(total)))
+                lines.append('{}_count{} {}'.format(name, _labels(pairs), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to someone else
+        return True
+    return True
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                                      .replace('\n', '\\n'))
+                          for key, value in pairs) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+'''
+The app's metrics
+'''
+registry = Registry()
+
+def _token_cache():
+    from api.authentication import token_cache
+    stats = token_cache.stats()
+    return {('token', 'hit'): stats['hits'], ('token', 'miss'): stats['misses']}
+
+def _webhook_queue():
+    from api.webhooks import dispatcher
+    return {(): dispatcher.queue_depth()}
+
+def _webhook_deliveries():
+    from api.webhooks import dispatcher
+    return {('delivered',): dispatcher.delivered, ('failed',): dispatcher.failed}
+
+def _slp_queue():
+    import api.slp_helpers as slp_helpers
+    return {(): slp_helpers.executor._work_queue.qsize()}
+
+def _limiter(attribute):
+    def collect():
+        import api.concurrency_limiter as concurrency_limiter
+        return {(name,): getattr(limiter, attribute)
+                for name, limiter in concurrency_limiter.lanes.items() if limiter is not None}
+    return collect
+
+slp_requests = registry.histogram(
+    'ftl_slp_request_duration_seconds', "Duration of ledger calls", ('operation', 'status'))
+slp_executor_wait = registry.histogram(
+    'ftl_slp_executor_wait_seconds', "Time ledger calls submitted by views wait for a worker")
+slp_executor_queue = registry.gauge(
+    'ftl_slp_executor_queue_depth', "Ledger calls waiting for a worker", collect=_slp_queue)
+slp_concurrency_limit = registry.gauge(
+    'ftl_slp_concurrency_limit', "Adaptive limit of concurrent ledger calls", ('lane',),
+    collect=_limiter('limit'))
+slp_in_flight = registry.gauge(
+    'ftl_slp_in_flight', "Ledger calls in progress", ('lane',), collect=_limiter('in_flight'))
+slp_waiting = registry.gauge(
+    'ftl_slp_waiting', "Ledger calls waiting for the concurrency limiter", ('lane',),
+    collect=_limiter('waiting'))
+slp_shed = registry.counter(
+    'ftl_slp_shed_total', "Ledger calls shed by the concurrency limiter", ('lane',),
+    collect=_limiter('shed'))
+status_lookups = registry.histogram(
+    'ftl_status_lookup_duration_seconds', "Duration of status lookups of assets", ('kind',))
+cache_lookups = registry.counter(
+    'ftl_cache_lookups_total', "Lookups in in-process caches", ('cache', 'result'), collect=_token_cache)
+webhook_queue = registry.gauge(
+    'ftl_webhook_queue_depth', "Webhook notifications waiting to be delivered", collect=_webhook_queue)
+webhook_notifications = registry.counter(
+    'ftl_webhook_notifications_total', "Webhook notifications by outcome", ('result',),
+    collect=_webhook_deliveries)
+webhook_retries = registry.counter(
+    'ftl_webhook_retries_total', "Webhook deliveries that failed and will be retried")
+view_requests = registry.histogram(
+    'ftl_http_request_duration_seconds', "Duration of HTTP requests per view", ('view', 'method', 'status'))
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency of every request, labelled with its view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        registry.start()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        view_requests.observe(time.perf_counter() - start, view, request.method, response.status_code)
+        return response
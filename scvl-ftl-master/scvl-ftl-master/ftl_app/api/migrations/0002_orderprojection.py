@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderProjection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=64, unique=True)),
+                ('latest_tx_id', models.CharField(max_length=64)),
+                ('status', models.IntegerField(blank=True, null=True)),
+                ('customer', models.CharField(blank=True, db_index=True, default='', max_length=44)),
+                ('provider', models.CharField(blank=True, db_index=True, default='', max_length=44)),
+                ('modified', models.DateTimeField()),
+                ('synced', models.DateTimeField()),
+            ],
+        ),
+    ]
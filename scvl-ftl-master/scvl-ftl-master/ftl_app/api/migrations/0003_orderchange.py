@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_orderprojection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(editable=False, max_length=64)),
+                ('tx_id', models.CharField(editable=False, max_length=64)),
+                ('kind', models.CharField(choices=[('ORDER', 'ORDER'), ('STATUS', 'STATUS'), ('EVENT', 'EVENT'), ('TRANSFER', 'TRANSFER'), ('SYNC', 'SYNC')], editable=False, max_length=8)),
+                ('status', models.IntegerField(blank=True, editable=False, null=True)),
+                ('customer', models.CharField(blank=True, db_index=True, default='', editable=False, max_length=44)),
+                ('provider', models.CharField(blank=True, db_index=True, default='', editable=False, max_length=44)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
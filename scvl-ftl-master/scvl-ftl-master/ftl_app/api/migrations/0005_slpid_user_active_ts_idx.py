@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_webhooksubscription'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='slpid',
+            index=models.Index(fields=['user', 'active', '-timestamp'], name='slpid_user_active_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_slpid_user_active_ts_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledSlpId',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slp_id', models.CharField(max_length=100, unique=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('public_key', models.CharField(max_length=44)),
+                ('private_key', models.CharField(max_length=44)),
+                ('received_public_key', models.CharField(max_length=44)),
+                ('received_private_key', models.CharField(max_length=44)),
+            ],
+        ),
+    ]
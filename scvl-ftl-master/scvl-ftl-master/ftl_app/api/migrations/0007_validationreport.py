@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_pooledslpid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidationReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=64, unique=True)),
+                ('conforms', models.BooleanField()),
+                ('violations', models.TextField(blank=True, default='[]')),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_validationreport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishedShape',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ledger_url', models.CharField(blank=True, default='', max_length=200)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=100)),
+                ('asset_id', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('ledger_url', 'content_hash')},
+            },
+        ),
+    ]
@@ -16,6 +16,25 @@ class SlpId(models.Model):
     class Meta:
         app_label = "api"
         unique_together = ('user', 'slp_id')
+        indexes = [
+            # Serves the lookup of a user's active SLP IDs, newest first
+            models.Index(fields=['user', 'active', '-timestamp'], name='slpid_user_active_ts_idx'),
+        ]
+
+
+class PooledSlpId(models.Model):
+    # Ledger identity that was created in advance and is not assigned
+    # to a user yet. Claimed (and deleted) when a user is created,
+    # see api/identity_pool.py
+    slp_id = models.CharField(max_length=100, null=False, blank=False, unique=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    public_key = models.CharField(max_length=44, null=False, blank=False)
+    private_key = models.CharField(max_length=44, null=False, blank=False)
+    received_public_key = models.CharField(max_length=44, null=False, blank=False)
+    received_private_key = models.CharField(max_length=44, null=False, blank=False)
+
+    class Meta:
+        app_label = "api"
 
 
 class AddressBook(models.Model):
@@ -47,3 +66,88 @@ class Setting(models.Model):
 
     class Meta:
         app_label = "api"
+
+
+class OrderProjection(models.Model):
+    # Local view of an order's ledger state, kept up to date by this app's
+    # own writes and by ledger reads. See api/projection.py
+    asset_id = models.CharField(max_length=64, null=False, blank=False, unique=True)
+    latest_tx_id = models.CharField(max_length=64, null=False, blank=False)
+    status = models.IntegerField(null=True, blank=True)
+    customer = models.CharField(max_length=44, null=False, blank=True, default='', db_index=True)
+    provider = models.CharField(max_length=44, null=False, blank=True, default='', db_index=True)
+    # Time at which latest_tx_id last changed
+    modified = models.DateTimeField()
+    # Time at which latest_tx_id was last known to match the ledger
+    synced = models.DateTimeField()
+
+    class Meta:
+        app_label = "api"
+
+
+class OrderChange(models.Model):
+    # Append-only log of changes to orders.
+    # The (auto-incrementing) primary key doubles as the cursor of the changes feed.
+    ORDER = 'ORDER'
+    STATUS = 'STATUS'
+    EVENT = 'EVENT'
+    TRANSFER = 'TRANSFER'
+    SYNC = 'SYNC'
+    kinds = [ORDER, STATUS, EVENT, TRANSFER, SYNC]
+
+    asset_id = models.CharField(max_length=64, null=False, blank=False, editable=False)
+    tx_id = models.CharField(max_length=64, null=False, blank=False, editable=False)
+    kind = models.CharField(max_length=8, null=False, blank=False, editable=False,
+                            choices=[(kind, kind) for kind in kinds])
+    status = models.IntegerField(null=True, blank=True, editable=False)
+    customer = models.CharField(max_length=44, null=False, blank=True, default='', editable=False, db_index=True)
+    provider = models.CharField(max_length=44, null=False, blank=True, default='', editable=False, db_index=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = "api"
+
+
+class WebhookSubscription(models.Model):
+    # Endpoint that is notified of changes to the orders its user takes part in.
+    # See api/webhooks.py
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE, null=False, blank=False, editable=False)
+    url = models.URLField(max_length=500, null=False, blank=False)
+    # Used to sign deliveries (HMAC-SHA256), if set
+    secret = models.CharField(max_length=100, null=False, blank=True, default='')
+    active = models.BooleanField(default=True, null=False, blank=False)
+    # Maximum number of deliveries in flight to this endpoint
+    max_concurrency = models.PositiveSmallIntegerField(default=1, null=False, blank=False)
+    timestamp = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        app_label = "api"
+
+
+class ValidationReport(models.Model):
+    # Outcome of the ledger's SHACL validation of an asset. Assets and shapes
+    # are immutable, so the outcome never changes. See api/validation_reports.py
+    # The ledger validates against the shapes attached at publication
+    asset_id = models.CharField(max_length=64, null=False, blank=False, unique=True)
+    conforms = models.BooleanField()
+    # JSON list of the reports of non-conforming shapes
+    violations = models.TextField(null=False, blank=True, default='[]')
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = "api"
+
+
+class PublishedShape(models.Model):
+    # SHACL shape published to the ledger, by the hash of its canonical form,
+    # so that set_shacl does not publish unchanged shapes again
+    # Ledger the shape was published to; another ledger needs its own copy
+    ledger_url = models.CharField(max_length=200, null=False, blank=True, default='')
+    content_hash = models.CharField(max_length=64, null=False, blank=False)
+    name = models.CharField(max_length=100, null=False, blank=False)
+    asset_id = models.CharField(max_length=100, null=False, blank=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = "api"
+        unique_together = ('ledger_url', 'content_hash')
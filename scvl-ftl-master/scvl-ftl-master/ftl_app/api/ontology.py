@@ -0,0 +1,118 @@
+"""
+A module that answers subclass questions about the SCVL ontology.
+
+semantics.has_type used to match rdf:type exactly, so data typed with a
+specialised class (say, a subclass of scvl:Order declared in ftl_onto.owl)
+was not recognised as an order. Reasoning over the ontology on every check
+would be far too slow, so the ontology is loaded once per process and its
+rdfs:subClassOf closure is computed up front: for every class, the set of
+all its (direct and indirect) subclasses, itself included.
+A type check then takes one set lookup per rdf:type triple.
+
+owl:equivalentClass counts as a subclass relation in both directions.
+An empty or unreadable ontology file leaves every class with only itself
+as subclass, which is the exact matching of before.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+import rdflib
+from rdflib import OWL, RDFS
+
+logger = logging.getLogger(__name__)
+
+ONTOLOGY_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'semantics', 'ftl_onto.owl')
+
+
+class Ontology:
+    def __init__(self, graph=None):
+        """
+        Precompute the subclass closure of the classes in @graph.
+        """
+        # Direct subclasses per class
+        children = {}
+        if graph is not None:
+            for sub, sup in graph.subject_objects(RDFS.subClassOf):
+                children.setdefault(sup, set()).add(sub)
+            for a, b in graph.subject_objects(OWL.equivalentClass):
+                children.setdefault(a, set()).add(b)
+                children.setdefault(b, set()).add(a)
+
+        # Transitive closure; iterative, since the ontology may contain cycles
+        self._subclasses = {}
+        for cls in children:
+            closure = {cls}
+            todo = [cls]
+            while todo:
+                for sub in children.get(todo.pop(), ()):
+                    if sub not in closure:
+                        closure.add(sub)
+                        todo.append(sub)
+            self._subclasses[cls] = frozenset(closure)
+
+    def __len__(self):
+        return len(self._subclasses)
+
+    def subclasses(self, cls):
+        """
+        Return the set of all subclasses of @cls, including @cls itself.
+        """
+        cls = rdflib.URIRef(cls)
+        return self._subclasses.get(cls) or frozenset((cls,))
+
+    def is_a(self, cls, type):
+        """
+        Answer whether @cls is @type or one of its subclasses.
+        """
+        return cls in self.subclasses(type)
+
+
+def load(path):
+    """
+    Parse the ontology in the file at @path.
+    The format is guessed from the extension; a missing, empty or
+    malformed file results in an empty ontology.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning("Could not read ontology %s: %s", path, e)
+        return Ontology()
+    if not data.strip():
+        logger.info("Ontology %s is empty, types are matched exactly", path)
+        return Ontology()
+
+    graph = rdflib.Graph()
+    try:
+        graph.parse(data=data, format=rdflib.util.guess_format(path) or 'xml')
+    except Exception as e:
+        logger.warning("Could not parse ontology %s: %s", path, e)
+        return Ontology()
+    return Ontology(graph)
+
+
+_ontology = None
+_lock = threading.Lock()
+
+def get():
+    """
+    Return the process-wide ontology, loading it on first use
+    from the ONTOLOGY_FILE setting.
+    """
+    global _ontology
+    if _ontology is None:
+        with _lock:
+            if _ontology is None:
+                _ontology = load(getattr(settings, 'ONTOLOGY_FILE', ONTOLOGY_FILE))
+    return _ontology
+
+def reset(ontology=None):
+    """
+    Replace the process-wide ontology by @ontology,
+    or have it loaded again on next use.
+    """
+    global _ontology
+    _ontology = ontology
@@ -114,6 +114,59 @@ class UserSchema(AutoSchema):
         return operation
 
 
+class WebhookSchema(AutoSchema):
+    def get_operation(self, path, method):
+        operation = super().get_operation(path, method)
+        if method == 'POST' or method == 'PUT':
+            operation['parameters'] += [
+                {
+                    "name": "url",
+                    "in": "form",
+                    "required": method == 'POST',
+                    "description": "Endpoint that receives batches of order changes",
+                    "schema": {'type': 'string'}
+                },
+                {
+                    "name": "secret",
+                    "in": "form",
+                    "required": False,
+                    "description": "Secret for signing deliveries (X-FTL-Signature header)",
+                    "schema": {'type': 'string'}
+                },
+                {
+                    "name": "max_concurrency",
+                    "in": "form",
+                    "required": False,
+                    "description": "Maximum number of simultaneous deliveries",
+                    "schema": {'type': 'integer', 'default': 1}
+                },
+            ]
+        return operation
+
+
+class ValidationSchema(AutoSchema):
+    def get_operation(self, path, method):
+        operation = super().get_operation(path, method)
+        if method == 'POST':
+            operation['parameters'] += [
+                {
+                    "name": "shape",
+                    "in": "form",
+                    "required": True,
+                    "description": "Setting holding the SHACL shape, e.g. order_shape or event_shape",
+                    "schema": {'type': 'string'}
+                },
+                {
+                    "name": "graphs",
+                    "in": "form",
+                    "required": True,
+                    "description": "List of JSON-LD graphs to validate",
+                    "schema": {'type': 'array', 'items': {'type': 'object'}}
+                },
+            ]
+        return operation
+
+
 class SlpIdSchema(AutoSchema):
     def get_operation(self, path, method):
         operation = super().get_operation(path, method)
@@ -235,6 +288,36 @@ class TransferSchema(AutoSchema):
         })
         return operation
 
+class ChangeSchema(AutoSchema):
+    def get_operation(self, path, method):
+        operation = super().get_operation(path, method)
+        if method == 'GET':
+            operation['parameters'] += [
+                {
+                    "name": "cursor",
+                    "in": "query",
+                    "required": False,
+                    "description": "Cursor returned by the previous call",
+                    "schema": {'type': 'integer', 'default': 0}
+                },
+                {
+                    "name": "limit",
+                    "in": "query",
+                    "required": False,
+                    "description": "Maximum number of changes to return",
+                    "schema": {'type': 'integer', 'default': 100}
+                },
+            ]
+            if path.rstrip('/').endswith('stream'):
+                operation['parameters'].append({
+                    "name": "timeout",
+                    "in": "query",
+                    "required": False,
+                    "description": "Seconds to wait for changes when long-polling",
+                    "schema": {'type': 'integer'}
+                })
+        return operation
+
 class OrderSchema(AutoSchema):
     def get_operation(self, path, method):
         operation = super().get_operation(path, method)
@@ -0,0 +1,189 @@
+"""
+A module that profiles selected requests of a running deployment.
+
+Timings (api/timing.py) tell how long ledger calls, RDF processing and
+queries took, but not which Python code a slow view spends its time in.
+With PROFILING_DIR set, ProfilingMiddleware runs a request under a
+profiler when
+- it has an X-Profile header equal to PROFILING_SECRET, or
+- it is picked at random, with probability PROFILING_SAMPLE_RATE,
+and stores the result in PROFILING_DIR, named after the view and the
+request ID (the X-Request-ID header, or a generated one). The name is
+returned in the X-Profile-Id response header, and profiles are listed and
+downloaded by admins through /api/profiles/.
+
+Two formats are supported (PROFILING_FORMAT, or an X-Profile-Format header
+on requests profiled on demand):
+- 'pstats': a cProfile dump, for pstats or snakeviz
+- 'collapsed': stacks of the request thread sampled every
+  PROFILING_INTERVAL seconds, one "frame;frame;... count" line per stack,
+  as read by flamegraph.pl and speedscope. Sampling has a far lower
+  overhead than cProfile, so this is the format for sampled traffic.
+Only the request thread is profiled: ledger calls made through
+slp_helpers.submit show up as time spent waiting for their futures.
+
+The newest PROFILING_MAX_FILES profiles are kept.
+"""
+from collections import Counter
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+FORMATS = {'pstats': '.pstats', 'collapsed': '.collapsed'}
+
+# <view>.<request ID><extension>
+NAME = re.compile(r'^(?P<view>[A-Za-z0-9_-]+)\.(?P<request_id>[A-Za-z0-9_-]{1,64})(?P<extension>\.pstats|\.collapsed)$')
+REQUEST_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class StackSampler(object):
+    """
+    Samples the stack of the thread with @thread_id every @interval
+    seconds from a background thread, counting identical stacks.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                  code.co_firstlineno))
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def path(name):
+    """
+    Return the path of the profile @name, or None if it is not a valid name.
+    """
+    if not NAME.match(name):
+        return None
+    return os.path.join(settings.PROFILING_DIR, name)
+
+
+def list_profiles():
+    """
+    Return the stored profiles, newest first.
+    """
+    profiles = []
+    for name in os.listdir(settings.PROFILING_DIR):
+        match = NAME.match(name)
+        if match is None:
+            continue
+        try:
+            stat = os.stat(os.path.join(settings.PROFILING_DIR, name))
+        except FileNotFoundError:
+            # Pruned meanwhile
+            continue
+        profiles.append({
+            'name': name,
+            'view': match.group('view'),
+            'request_id': match.group('request_id'),
+            'format': match.group('extension')[1:],
+            'size': stat.st_size,
+            'created': stat.st_mtime,
+        })
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def prune():
+    """
+    Delete all but the newest PROFILING_MAX_FILES profiles.
+    """
+    for profile in list_profiles()[settings.PROFILING_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, profile['name']))
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles selected requests, see the module documentation.
+    Only installed when the PROFILING_DIR setting is set.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_DIR', None):
+            raise MiddlewareNotUsed()
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        self.get_response = get_response
+
+    def selected(self, request):
+        """
+        Return the format to profile @request in, or None to not profile it.
+        """
+        header = request.META.get('HTTP_X_PROFILE')
+        if header and settings.PROFILING_SECRET and hmac.compare_digest(header, settings.PROFILING_SECRET):
+            requested = request.META.get('HTTP_X_PROFILE_FORMAT')
+            return requested if requested in FORMATS else settings.PROFILING_FORMAT
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return settings.PROFILING_FORMAT
+        return None
+
+    def __call__(self, request):
+        format = self.selected(request)
+        if format is None:
+            return self.get_response(request)
+
+        if format == 'pstats':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        else:
+            profiler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID.match(request_id):
+            request_id = '{}-{}'.format(int(time.time()), uuid.uuid4().hex[:12])
+        match = getattr(request, 'resolver_match', None)
+        view = re.sub(r'[^A-Za-z0-9_-]', '_', (match.url_name or match.view_name) if match else 'unmatched')
+        name = '{}.{}{}'.format(view, request_id, FORMATS[format])
+        if format == 'pstats':
+            profiler.dump_stats(path(name))
+        else:
+            profiler.dump(path(name))
+        prune()
+
+        response['X-Profile-Id'] = name
+        return response
@@ -0,0 +1,308 @@
+"""
+A module that keeps a local projection of the ledger state of orders.
+
+For every order, the projection stores the ID of the latest known
+transaction, the order status and the public keys of the participants.
+It is updated whenever this app writes to an order, and whenever
+a view reads an order's transactions from the ledger anyway.
+
+Views use the projection to answer conditional GET requests
+(If-None-Match / If-Modified-Since) without contacting the ledger.
+Since other applications may write to the same ledger,
+the projection is only trusted for PROJECTION_MAX_AGE seconds
+after it was last checked against the ledger.
+
+Every change to the projection is also appended to the OrderChange log,
+which backs the changes feed: clients pass the cursor of the last change
+they saw and receive only the changes after it.
+New changes are announced on the in-process broker (api/pubsub.py),
+so that waiting clients are woken as soon as they happen,
+and queued for delivery to webhook subscriptions (api/webhooks.py).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from api.models import OrderChange, OrderProjection
+import api.identity as identity
+from api.pubsub import broker
+import api.webhooks as webhooks
+
+
+def record(asset_id, tx_id, status=None, customer=None, provider=None, kind=OrderChange.SYNC):
+    """
+    Register @tx_id as the latest transaction of the order @asset_id.
+
+    The optional @status, @customer and @provider (public keys)
+    are only updated when given.
+    If this changed the latest known transaction, a change of @kind
+    is appended to the change log and the change is returned.
+    Otherwise, returns None.
+    """
+    now = timezone.now()
+    tx_id = str(tx_id)
+    with transaction.atomic():
+        projection, created = OrderProjection.objects.get_or_create(
+            asset_id=asset_id,
+            defaults={'latest_tx_id': tx_id, 'modified': now, 'synced': now}
+        )
+        changed = created or projection.latest_tx_id != tx_id
+        if changed:
+            projection.latest_tx_id = tx_id
+            projection.modified = now
+        if status is not None:
+            projection.status = status
+        if customer:
+            projection.customer = customer
+        if provider:
+            projection.provider = provider
+        projection.synced = now
+        projection.save()
+
+        if not changed:
+            return None
+        change = OrderChange.objects.create(
+            asset_id=asset_id,
+            tx_id=tx_id,
+            kind=kind,
+            status=projection.status,
+            customer=projection.customer,
+            provider=projection.provider
+        )
+        # Once the change is visible to them, wake waiting participants
+        # and queue it for their webhooks; nothing is sent on a rollback
+        participants = [key for key in (change.customer, change.provider) if key]
+        data = serialize_change(change)
+        transaction.on_commit(lambda: broker.publish(participants))
+        transaction.on_commit(lambda: webhooks.notify(data, participants))
+        return change
+
+def record_transfer(asset_id, tx_id):
+    """
+    Register a plain asset transfer, if the asset is a known order.
+    """
+    if OrderProjection.objects.filter(asset_id=asset_id).exists():
+        return record(asset_id, tx_id, kind=OrderChange.TRANSFER)
+    return None
+
+def sync(asset_id, transactions, status=None):
+    """
+    Update the projection of @asset_id from its full,
+    chronologically sorted list of ledger @transactions.
+    """
+    sync_many([observe(asset_id, transactions, status)])
+
+def observe(asset_id, transactions, status=None):
+    """
+    Return what sync_many needs to know of the order @asset_id, given its
+    chronologically sorted @transactions, or None if there are none.
+    """
+    if not transactions:
+        return None
+    # The CREATE transaction identifies the participants:
+    # the customer publishes the order to the service provider.
+    customer = provider = ''
+    try:
+        create_tx = transactions[0]
+        customer = create_tx['inputs'][0]['owners_before'][0]
+        provider = create_tx['outputs'][0]['public_keys'][0]
+    except (KeyError, IndexError, TypeError):
+        pass
+    return asset_id, str(transactions[-1]['id']), status, customer, provider
+
+def sync_many(observations):
+    """
+    Update the projection from a list of observe() results.
+
+    Reads are far more frequent than changes, so this only writes what
+    actually changed: orders whose latest transaction, status or
+    participants differ are recorded one by one, and the others only get
+    their synced time refreshed, in one query, once it is more than half
+    of PROJECTION_MAX_AGE old.
+    """
+    observed = {observation[0]: observation[1:] for observation in observations if observation}
+    if not observed:
+        return
+
+    now = timezone.now()
+    max_age = settings.PROJECTION_MAX_AGE
+    stale = []
+    known = OrderProjection.objects.filter(asset_id__in=list(observed)).values_list(
+        'asset_id', 'latest_tx_id', 'status', 'customer', 'provider', 'synced')
+    known = {row[0]: row[1:] for row in known}
+    for asset_id, (tx_id, status, customer, provider) in observed.items():
+        row = known.get(asset_id)
+        if (row is None or row[0] != tx_id or (status is not None and row[1] != status)
+                or (customer and row[2] != customer) or (provider and row[3] != provider)):
+            record(asset_id, tx_id, status=status, customer=customer,
+                   provider=provider, kind=OrderChange.SYNC)
+        elif max_age and (now - row[4]).total_seconds() > max_age / 2:
+            stale.append(asset_id)
+    if stale:
+        OrderProjection.objects.filter(asset_id__in=stale).update(synced=now)
+
+def is_fresh(synced):
+    """
+    Whether a projection that was last checked against
+    the ledger at @synced may still be trusted.
+    """
+    max_age = settings.PROJECTION_MAX_AGE
+    if synced is None:
+        return False
+    if max_age is None:
+        return True
+    return (timezone.now() - synced).total_seconds() <= max_age
+
+def order_validators(asset_id):
+    """
+    Return the (etag, last_modified) pair for a single order,
+    or (None, None) if the projection cannot be trusted.
+    """
+    try:
+        projection = OrderProjection.objects.get(asset_id=asset_id)
+    except OrderProjection.DoesNotExist:
+        return None, None
+    if not is_fresh(projection.synced):
+        return None, None
+    return quote_etag(projection.latest_tx_id), projection.modified
+
+def _list_sync_key(user):
+    return 'projection:order_list_synced:{}'.format(user.pk)
+
+def _public_keys(user):
+    return [slp_id.public_key for slp_id in identity.active_ids(user)]
+
+def _participant_filter(user):
+    """
+    A query filter selecting the orders (or changes)
+    in which one of the active SLP IDs of @user takes part.
+    """
+    public_keys = _public_keys(user)
+    return Q(customer__in=public_keys) | Q(provider__in=public_keys)
+
+def mark_list_synced(user, asset_ids):
+    """
+    Register that the order list of @user was just read from the ledger,
+    and that it held the orders @asset_ids.
+    """
+    cache.set(_list_sync_key(user), (timezone.now(), sorted(asset_ids)), None)
+
+def order_list_etag(user, *query_args, check_fresh=True):
+    """
+    Return the ETag for the order list of @user,
+    or None if the projection cannot be trusted.
+
+    The ETag is a hash over the @query_args of the list call and the
+    latest transaction of every order in the list when it was last read
+    from the ledger, which includes orders held through a transfer.
+    Orders the user has since started taking part in are included too,
+    so that orders placed through this app show up right away.
+
+    Lists have no Last-Modified: an order leaving the list
+    does not make any of the remaining orders more recent.
+    """
+    if not user.is_authenticated:
+        return None
+    list_sync = cache.get(_list_sync_key(user))
+    if list_sync is None or (check_fresh and not is_fresh(list_sync[0])):
+        return None
+    _, asset_ids = list_sync
+
+    latest = dict(OrderProjection.objects.filter(_participant_filter(user))
+                  .values_list('asset_id', 'latest_tx_id').iterator())
+    for start in range(0, len(asset_ids), 500):
+        latest.update(OrderProjection.objects.filter(asset_id__in=asset_ids[start:start + 500])
+                      .values_list('asset_id', 'latest_tx_id'))
+    for asset_id in asset_ids:
+        # Listed orders that are not projected still count
+        latest.setdefault(asset_id, '')
+
+    digest = hashlib.sha256()
+    for query_arg in query_args:
+        digest.update('{};'.format(query_arg).encode())
+    for asset_id in sorted(latest):
+        digest.update('{}:{};'.format(asset_id, latest[asset_id]).encode())
+    return quote_etag(digest.hexdigest())
+
+def not_modified(request, etag, last_modified):
+    """
+    Return a 304 Not Modified response if the conditional headers of
+    @request match @etag / @last_modified, or None otherwise.
+    """
+    if etag is None:
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+def set_validators(response, etag, last_modified):
+    """
+    Add ETag and Last-Modified headers to @response, if known.
+    """
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+    return response
+
+def serialize_change(change):
+    """
+    Compact representation of an OrderChange for the changes feed.
+    """
+    return {
+        'cursor': change.pk,
+        'asset_id': change.asset_id,
+        'tx_id': change.tx_id,
+        'kind': change.kind,
+        'status': change.status,
+        'timestamp': change.timestamp.isoformat(),
+    }
+
+def changes_since(user, cursor=0, limit=100):
+    """
+    Return the changes to orders of @user after @cursor,
+    at most @limit of them, as a (changes, new_cursor, more) tuple.
+
+    The new cursor points past all changes that were inspected,
+    also those of other users, so that the next call
+    does not have to scan them again.
+    """
+    latest = OrderChange.objects.aggregate(Max('pk'))['pk__max'] or 0
+    changes = list(OrderChange.objects.filter(
+        _participant_filter(user), pk__gt=cursor, pk__lte=latest
+    ).order_by('pk')[:limit + 1])
+
+    more = len(changes) > limit
+    changes = changes[:limit]
+    if more:
+        new_cursor = changes[-1].pk
+    else:
+        new_cursor = max(cursor, latest)
+    return [serialize_change(change) for change in changes], new_cursor, more
+
+def wait_for_changes(user, cursor=0, limit=100, timeout=25, poll_interval=5):
+    """
+    Long-polling variant of changes_since.
+
+    Returns as soon as there are changes after @cursor for @user,
+    or after @timeout seconds with an empty list of changes.
+    The thread sleeps until the broker announces a change for the user;
+    every @poll_interval seconds the change log is checked anyway,
+    to catch changes recorded by other processes.
+    """
+    deadline = time.monotonic() + timeout
+    # Subscribe before looking at the log, so no change can slip in between
+    with broker.subscribe(_public_keys(user)) as subscription:
+        while True:
+            changes, new_cursor, more = changes_since(user, cursor, limit)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes, new_cursor, more
+            cursor = new_cursor
+            subscription.wait(min(remaining, poll_interval))
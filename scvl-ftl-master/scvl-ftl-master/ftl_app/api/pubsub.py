@@ -0,0 +1,95 @@
+"""
+A minimal in-process publish/subscribe hub.
+
+Subscribers register interest in a set of topics (here: the public keys
+of a user's SLP IDs) and block until something is published on one of them.
+A subscription is only a threading.Event, and publishing only touches the
+subscribers of the published topics, so idle subscribers cost no CPU time.
+They do hold the thread that waits on them, though, so the views bound
+the number of waiting requests (see api/views/ChangeViews.py).
+
+Notifications carry no payload: they only tell subscribers to look
+at the change log again (see api/projection.py). The change log remains
+the single source of truth, also for changes made by other processes,
+which are picked up by the periodic re-check of long-polling views.
+"""
+import threading
+
+
+class Subscription(object):
+    """
+    Interest of one waiting client in a set of topics.
+    Use as a context manager to unsubscribe reliably.
+    """
+
+    def __init__(self, broker, topics):
+        self.broker = broker
+        self.topics = frozenset(topics)
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Block until a notification arrives or @timeout seconds pass.
+        Returns True if notified (and resets the subscription).
+        """
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Broker(object):
+    """
+    Keeps track of subscriptions by topic and wakes them on publish.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, topics):
+        subscription = Subscription(self, topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscriptions.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[topic]
+
+    def publish(self, topics):
+        """
+        Wake every subscription on any of @topics.
+        """
+        with self._lock:
+            woken = set()
+            for topic in topics:
+                woken.update(self._subscriptions.get(topic, ()))
+        for subscription in woken:
+            subscription.notify()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._subscriptions.values())) if self._subscriptions else 0
+
+
+# Broker shared by all threads in this process
+broker = Broker()
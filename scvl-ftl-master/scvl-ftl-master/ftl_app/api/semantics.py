@@ -4,6 +4,9 @@ import json
 from rdflib.namespace import RDF, XSD
 import re
 
+import api.ontology as ontology
+import api.timing as timing
+
 BDB_NS = "bdb://"
 
 
@@ -11,7 +14,8 @@ def has_type(type, asset):
     """
     This function takes a semantic type @type and an asset @asset
     and answers whether the rdf of @asset contains any subject
-    carrying @type.
+    carrying @type, or a subclass of @type according to the ontology
+    (see api/ontology.py).
 
     Example:
     For a valid order asset @order_asset
@@ -22,7 +26,14 @@ def has_type(type, asset):
     # Check that the asset is stripped down to its data
     if 'data' in asset.keys():
         asset = asset['data']
-    return Semantics().triple_exists(asset['rdf'], (None, Semantics.RDF.type, type))
+    g = Semantics.load_rdf(json.dumps(asset['rdf']))
+    if g is False:
+        return False
+    types = ontology.get().subclasses(type)
+    for o in g.objects(None, RDF.type):
+        if o in types:
+            return True
+    return False
 
 class Semantics:
     NODE_ID = "{}[id]/".format(BDB_NS)
@@ -48,6 +59,7 @@ class Semantics:
     Utility functions
     '''
     @classmethod
+    @timing.timed('rdf_parse')
     def load_rdf(cls, serialized_data, data_format='json-ld'):
         g = rdflib.ConjunctiveGraph()
 
@@ -139,7 +151,8 @@ class Semantics:
 
         # Process output format
         if returns in ('dict', 'string'):
-            rdf_str = g.serialize(format='json-ld', context=self.context)
+            with timing.span('rdf_serialize'):
+                rdf_str = g.serialize(format='json-ld', context=self.context)
             if returns == "dict":
                 return json.loads(rdf_str)
             elif returns == "string":
@@ -173,7 +186,8 @@ class Semantics:
         # to prevent duplication between this function and
         # creating orders.
         if returns in ('dict', 'string'):
-            rdf_str = g.serialize(format='json-ld', context=self.context)
+            with timing.span('rdf_serialize'):
+                rdf_str = g.serialize(format='json-ld', context=self.context)
             # Serialize returns bytestring, decode before letting JSON handle it
             if isinstance(rdf_str, bytes):
                 rdf_str = rdf_str.decode()
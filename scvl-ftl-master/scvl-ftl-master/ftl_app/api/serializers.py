@@ -1,10 +1,12 @@
 from rest_framework import serializers
 # from rest_framework_recursive.fields import RecursiveField # Was used in Verifiability, might be useful.
+from django.conf import settings
 from django.contrib.auth.models import User
 import os
 
-from api.models import Setting, SlpId, AddressBook
+from api.models import Setting, SlpId, AddressBook, WebhookSubscription
 from api.slp_interface import SlpInterface
+import api.webhooks as webhooks
 
 from api.status.event_milestones import EventMilestones
 
@@ -55,6 +57,28 @@ class AddressBookSerializer(serializers.ModelSerializer):
         return AddressBook.objects.create(**validated_data)
 
 
+class WebhookSubscriptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookSubscription
+        fields = ('id', 'url', 'secret', 'active', 'max_concurrency', 'timestamp')
+        read_only_fields = ('id', 'timestamp')
+        # A form without the checkbox would otherwise read as active=False
+        extra_kwargs = {'secret': {'write_only': True}, 'active': {'default': True}}
+
+    def validate_url(self, value):
+        try:
+            webhooks.check_url(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_max_concurrency(self, value):
+        if not 1 <= value <= settings.WEBHOOK_MAX_CONCURRENCY:
+            raise serializers.ValidationError(
+                "max_concurrency must be between 1 and {}".format(settings.WEBHOOK_MAX_CONCURRENCY))
+        return value
+
+
 class SlpIdSerializer(serializers.ModelSerializer):
     class Meta:
         model = SlpId
@@ -146,3 +170,10 @@ class EventCallSerializer(serializers.Serializer):
     event = EventInputSerializer(required=True)
     # TODO optionally, check length of asset id (64 characters)
     #   probably can even subclass CharField as AssetField etc.
+
+
+class ValidationCallSerializer(serializers.Serializer):
+    # Name of the setting holding the shape, e.g. order_shape
+    shape = serializers.CharField(required=True)
+    # JSON-LD graphs, as objects or strings
+    graphs = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
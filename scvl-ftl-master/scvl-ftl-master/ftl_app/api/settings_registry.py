@@ -0,0 +1,141 @@
+"""
+A module that serves the Setting rows from memory.
+
+Settings (such as the asset IDs of the SHACL shapes) are read on many
+requests but only change when set_shacl runs or an admin edits them.
+The registry loads all Setting rows at once and keeps them in process.
+
+Every process compares its copy against a version number in the shared
+Django cache (see api/shared_version.py). Saving or deleting a Setting
+bumps that version (see api/signals/handlers.py), after which every
+process reloads on its next access. To limit round trips to the cache,
+the version is checked at most every SETTINGS_VERSION_CHECK_INTERVAL
+seconds; the process that made the change reloads immediately.
+Note that the default cache is per process: configure a shared backend
+(CACHE_BACKEND / CACHE_LOCATION) when running several workers.
+"""
+import threading
+
+from api.models import Setting
+from api.shared_version import SharedVersion
+import api.metrics as metrics
+
+VERSION_KEY = 'settings_registry:version'
+
+
+def parse_bool(value):
+    """
+    Interpret a setting value such as 'true', '1' or 'off' as a boolean.
+    """
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError("Not a boolean: {}".format(value))
+
+
+class SettingDefinition(object):
+    """
+    A known setting: its name, the type of its value
+    and the value to use when it is not set.
+    """
+
+    def __init__(self, name, type=str, default=None, description=''):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.description = description
+
+    def parse(self, value):
+        return self.type(value)
+
+
+class SettingsRegistry(object):
+    """
+    Typed, cached access to the Setting rows.
+    """
+
+    def __init__(self):
+        self._definitions = {}
+        self._lock = threading.Lock()
+        self._values = None
+        # Incremented by every invalidation, so that loads
+        # which raced with one are not kept
+        self._generation = 0
+        self.version = SharedVersion(VERSION_KEY, 'SETTINGS_VERSION_CHECK_INTERVAL')
+
+    def register(self, name, type=str, default=None, description=''):
+        """
+        Declare the setting @name, whose value is converted with @type.
+        """
+        self._definitions[name] = SettingDefinition(name, type, default, description)
+
+    def get(self, name, default=None):
+        """
+        Return the typed value of setting @name.
+        If it is not set, returns @default or the registered default,
+        and raises Setting.DoesNotExist if there is neither.
+        """
+        values = self._current()
+        if name in values:
+            return values[name]
+        definition = self._definitions.get(name)
+        if default is None and definition is not None:
+            default = definition.default
+        if default is None:
+            raise Setting.DoesNotExist("Setting {} not set".format(name))
+        return default
+
+    def all(self):
+        """
+        Return all settings as a {name: typed value} dict.
+        """
+        return dict(self._current())
+
+    def invalidate(self):
+        """
+        Make all processes reload the settings on their next access.
+        """
+        self.version.bump()
+        self._drop()
+
+    def _drop(self):
+        with self._lock:
+            self._generation += 1
+            self._values = None
+
+    def _current(self):
+        # The version is read before the rows, so that
+        # a concurrent change is at worst loaded twice, never missed
+        if self.version.changed():
+            self._drop()
+        values = self._values
+        if values is not None:
+            metrics.cache_lookups.inc('settings', 'hit')
+            return values
+
+        metrics.cache_lookups.inc('settings', 'miss')
+        generation = self._generation
+        values = self._load()
+        with self._lock:
+            if generation == self._generation:
+                self._values = values
+        return values
+
+    def _load(self):
+        values = {}
+        for name, value in Setting.objects.values_list('setting', 'value'):
+            definition = self._definitions.get(name)
+            values[name] = definition.parse(value) if definition else value
+        return values
+
+
+# Registry shared by all threads in this process
+registry = SettingsRegistry()
+registry.register('order_shape', str, description="Asset ID of the SHACL shape for orders")
+registry.register('event_shape', str, description="Asset ID of the SHACL shape for events")
+
+
+def get(name, default=None):
+    return registry.get(name, default)
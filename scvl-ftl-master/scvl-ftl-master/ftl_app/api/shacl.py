@@ -0,0 +1,427 @@
+"""
+A module that validates RDF data against SHACL shapes locally.
+
+The ledger checks every publication against its SHACL shape, but only
+after a full round trip, and rejects it with a rather bare error.
+The shapes referenced by the shape settings (see set_shacl) are therefore
+fetched once per process and compiled into plain Python checks,
+so views can reject invalid data before contacting the ledger.
+
+The compiler covers the SHACL Core constraints that our shapes use.
+Shapes using anything else are validated with pyshacl instead, if it is
+installed, and are otherwise left to the ledger. The ledger remains
+the authority either way: local validation only avoids pointless calls.
+"""
+from concurrent.futures import Future
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+import rdflib
+from rdflib import RDF, XSD
+import requests
+from rdflib.collection import Collection
+from rdflib.compare import to_canonical_graph
+
+try:
+    import pyshacl
+except ImportError:
+    pyshacl = None
+
+from api.deadline import LedgerUnavailable
+from api.models import Setting
+from api.semantics import Semantics
+import api.settings_registry as settings_registry
+import api.slp_helpers as slp_helpers
+import api.timing as timing
+
+logger = logging.getLogger(__name__)
+
+SH = rdflib.Namespace('http://www.w3.org/ns/shacl#')
+
+# Shape files that set_shacl publishes, used when a shape
+# cannot be fetched from the ledger
+SHAPE_FILES = {
+    'order_shape': os.path.join(os.path.dirname(os.path.realpath(__file__)), 'semantics', 'ftl_order_shape.ttl'),
+    'event_shape': os.path.join(os.path.dirname(os.path.realpath(__file__)), 'semantics', 'ftl_event_shape.ttl'),
+}
+
+TARGETS = {SH.targetClass, SH.targetNode, SH.targetSubjectsOf, SH.targetObjectsOf}
+# Predicates without effect on validation
+ANNOTATIONS = {RDF.type, SH.name, SH.description, SH.message, SH.severity,
+               SH.order, SH.group, rdflib.RDFS.label, rdflib.RDFS.comment}
+VALUE_CONSTRAINTS = {SH.datatype, SH['class'], SH['in'], SH.hasValue, SH.node,
+                     SH.nodeKind, SH.pattern, SH.flags, SH.minLength, SH.maxLength}
+NODE_KINDS = {
+    SH.IRI: (rdflib.URIRef,),
+    SH.BlankNode: (rdflib.BNode,),
+    SH.Literal: (rdflib.Literal,),
+    SH.BlankNodeOrIRI: (rdflib.BNode, rdflib.URIRef),
+    SH.BlankNodeOrLiteral: (rdflib.BNode, rdflib.Literal),
+    SH.IRIOrLiteral: (rdflib.URIRef, rdflib.Literal),
+}
+
+
+class UnsupportedShape(Exception):
+    pass
+
+
+def _normalize(term):
+    """
+    Treat plain literals and xsd:string literals as equal.
+    """
+    if isinstance(term, rdflib.Literal) and term.datatype == XSD.string:
+        return rdflib.Literal(str(term))
+    return term
+
+
+class CompiledShapes(object):
+    """
+    SHACL shapes compiled into a list of (shape, targets, checks).
+    validate() only walks the data graph; the shapes graph is not
+    consulted anymore after compilation.
+    """
+
+    def __init__(self, shapes_graph):
+        self.graph = shapes_graph
+        self._node_checks = {}
+        self.shapes = []
+        node_shapes = set(shapes_graph.subjects(RDF.type, SH.NodeShape))
+        for target in TARGETS:
+            node_shapes.update(shapes_graph.subjects(target, None))
+        for shape in node_shapes:
+            targets = [(target, value) for target in TARGETS for value in shapes_graph.objects(shape, target)]
+            if targets:
+                self.shapes.append((shape, targets, self._compile_node_shape(shape)))
+
+    def validate(self, data_graph):
+        """
+        Return the list of violations of @data_graph (empty if it conforms).
+        """
+        violations = []
+        for shape, targets, checks in self.shapes:
+            for focus in self._focus_nodes(data_graph, targets):
+                for check in checks:
+                    violations.extend(check(data_graph, focus))
+        return violations
+
+    def _focus_nodes(self, data_graph, targets):
+        focus_nodes = set()
+        for target, value in targets:
+            if target == SH.targetClass:
+                focus_nodes.update(data_graph.subjects(RDF.type, value))
+            elif target == SH.targetNode:
+                focus_nodes.add(value)
+            elif target == SH.targetSubjectsOf:
+                focus_nodes.update(data_graph.subjects(value, None))
+            elif target == SH.targetObjectsOf:
+                focus_nodes.update(data_graph.objects(None, value))
+        return focus_nodes
+
+    def _name(self, term):
+        try:
+            return term.n3(self.graph.namespace_manager)
+        except Exception:
+            return str(term)
+
+    def _compile_node_shape(self, shape):
+        # Memoized (and registered before compiling), so that
+        # shapes referring to each other through sh:node terminate
+        if shape in self._node_checks:
+            return self._node_checks[shape]
+        checks = []
+        self._node_checks[shape] = checks
+
+        for predicate in set(self.graph.predicates(shape, None)):
+            if predicate not in TARGETS | ANNOTATIONS | VALUE_CONSTRAINTS | {SH.property, SH.closed, SH.ignoredProperties, SH.deactivated}:
+                raise UnsupportedShape("{} uses {}".format(self._name(shape), self._name(predicate)))
+        if self._flag(shape, SH.closed):
+            raise UnsupportedShape("{} is closed".format(self._name(shape)))
+        if self._flag(shape, SH.deactivated):
+            return checks
+
+        # Constraints on the focus node itself
+        value_check = self._compile_value_constraints(shape, self._name(shape))
+        if value_check:
+            checks.append(lambda g, focus: value_check(g, [focus]))
+
+        for property_shape in self.graph.objects(shape, SH.property):
+            checks.append(self._compile_property_shape(shape, property_shape))
+        return checks
+
+    def _flag(self, shape, predicate):
+        flag = self.graph.value(shape, predicate)
+        return flag is not None and flag.toPython() is True
+
+    def _compile_path(self, path):
+        """
+        Return a function listing the values of a focus node along @path.
+        """
+        if isinstance(path, rdflib.URIRef):
+            return (lambda g, focus: list(g.objects(focus, path))), self._name(path)
+        inverse = self.graph.value(path, SH.inversePath)
+        if isinstance(inverse, rdflib.URIRef):
+            return (lambda g, focus: list(g.subjects(inverse, focus))), '^' + self._name(inverse)
+        raise UnsupportedShape("Unsupported property path")
+
+    def _compile_property_shape(self, shape, property_shape):
+        allowed = ANNOTATIONS | VALUE_CONSTRAINTS | {SH.path, SH.minCount, SH.maxCount, SH.deactivated}
+        for predicate in self.graph.predicates(property_shape, None):
+            if predicate not in allowed:
+                raise UnsupportedShape("{} uses {}".format(self._name(shape), self._name(predicate)))
+
+        if self._flag(property_shape, SH.deactivated):
+            return lambda g, focus: ()
+        values_of, path_name = self._compile_path(self.graph.value(property_shape, SH.path))
+        label = "{} {}".format(self._name(shape), path_name)
+        min_count = self.graph.value(property_shape, SH.minCount)
+        max_count = self.graph.value(property_shape, SH.maxCount)
+        min_count = int(min_count) if min_count is not None else None
+        max_count = int(max_count) if max_count is not None else None
+        value_check = self._compile_value_constraints(property_shape, label)
+
+        def check(g, focus):
+            values = values_of(g, focus)
+            if min_count is not None and len(values) < min_count:
+                yield "{}: expected at least {} value(s), found {}".format(label, min_count, len(values))
+            if max_count is not None and len(values) > max_count:
+                yield "{}: expected at most {} value(s), found {}".format(label, max_count, len(values))
+            if value_check:
+                yield from value_check(g, values)
+        return check
+
+    def _compile_value_constraints(self, shape, label):
+        """
+        Compile the constraints on individual values of @shape
+        into one function checking a list of values, or None if there are none.
+        """
+        value = lambda predicate: self.graph.value(shape, predicate)
+        checks = []
+
+        datatype = value(SH.datatype)
+        if datatype is not None:
+            def check_datatype(g, v):
+                if not isinstance(v, rdflib.Literal):
+                    return "is not a literal"
+                actual = v.datatype or (None if v.language else XSD.string)
+                if actual != datatype or getattr(v, 'ill_typed', False):
+                    return "is not a valid {}".format(self._name(datatype))
+            checks.append(check_datatype)
+
+        rdf_class = value(SH['class'])
+        if rdf_class is not None:
+            checks.append(lambda g, v: None if (v, RDF.type, rdf_class) in g
+                          else "is not a {}".format(self._name(rdf_class)))
+
+        members = value(SH['in'])
+        if members is not None:
+            allowed = {_normalize(member) for member in Collection(self.graph, members)}
+            checks.append(lambda g, v: None if _normalize(v) in allowed
+                          else "is not one of {}".format(', '.join(sorted(str(a) for a in allowed))))
+
+        node_kind = value(SH.nodeKind)
+        if node_kind is not None:
+            kinds = NODE_KINDS[node_kind]
+            checks.append(lambda g, v: None if isinstance(v, kinds)
+                          else "is not a {}".format(self._name(node_kind)))
+
+        pattern = value(SH.pattern)
+        if pattern is not None:
+            flags = re.IGNORECASE if 'i' in str(value(SH.flags) or '') else 0
+            regex = re.compile(str(pattern), flags)
+            checks.append(lambda g, v: None if not isinstance(v, rdflib.BNode) and regex.search(str(v))
+                          else "does not match {}".format(pattern))
+
+        min_length = value(SH.minLength)
+        if min_length is not None:
+            min_length = int(min_length)
+            checks.append(lambda g, v: None if len(str(v)) >= min_length
+                          else "is shorter than {}".format(min_length))
+
+        max_length = value(SH.maxLength)
+        if max_length is not None:
+            max_length = int(max_length)
+            checks.append(lambda g, v: None if len(str(v)) <= max_length
+                          else "is longer than {}".format(max_length))
+
+        node = value(SH.node)
+        if node is not None:
+            node_checks = self._compile_node_shape(node)
+            def check_node(g, v):
+                for node_check in node_checks:
+                    for violation in node_check(g, v):
+                        return "does not conform to {} ({})".format(self._name(node), violation)
+            checks.append(check_node)
+
+        has_value = value(SH.hasValue)
+        if not checks and has_value is None:
+            return None
+
+        def check_values(g, values):
+            for v in values:
+                for check in checks:
+                    problem = check(g, v)
+                    if problem:
+                        yield "{}: value {} {}".format(label, v, problem)
+            if has_value is not None and _normalize(has_value) not in {_normalize(v) for v in values}:
+                yield "{}: missing value {}".format(label, has_value)
+        return check_values
+
+
+class PyshaclShapes(object):
+    """
+    Fallback for shapes the compiler does not support.
+    The shapes graph is only parsed once.
+    """
+
+    def __init__(self, shapes_graph):
+        self.graph = shapes_graph
+
+    def validate(self, data_graph):
+        conforms, _, results_text = pyshacl.validate(data_graph, shacl_graph=self.graph, inference='none')
+        return [] if conforms else [results_text]
+
+
+def compile_shapes(shapes_graph):
+    """
+    Return a validator for @shapes_graph,
+    or None if it can only be validated by the ledger.
+    """
+    try:
+        return CompiledShapes(shapes_graph)
+    except UnsupportedShape as e:
+        if pyshacl is not None:
+            return PyshaclShapes(shapes_graph)
+        logger.warning("Shapes cannot be validated locally (%s) and pyshacl is not installed", e)
+        return None
+
+
+def canonical_hash(graph):
+    """
+    Return a SHA-256 hash of the triples in @graph that does not depend on
+    their order, prefixes, formatting or blank node labels.
+    """
+    triples = to_canonical_graph(graph).serialize(format='nt')
+    if isinstance(triples, bytes):
+        triples = triples.decode()
+    lines = sorted(line for line in triples.splitlines() if line.strip())
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+
+def parse_rdf(data, data_format='json-ld'):
+    """
+    Parse @data (a string, or JSON-LD as dicts and lists) into a graph.
+    Returns None if it is not valid RDF.
+    """
+    if not isinstance(data, (str, bytes)):
+        data = json.dumps(data)
+    graph = Semantics.load_rdf(data, data_format)
+    return graph if graph is not False else None
+
+
+def _load_shapes_graph(setting, asset_id):
+    """
+    Fetch the shapes published as @asset_id from the ledger,
+    or read the bundled shape file for @setting if that fails.
+    Returns a (graph or None, whether it came from the ledger) pair.
+    """
+    try:
+        rdf = slp_helpers.get_asset(asset_id)['rdf']
+        for data_format in (('json-ld',) if not isinstance(rdf, str) else ('json-ld', 'turtle', 'n3')):
+            graph = parse_rdf(rdf, data_format)
+            if graph is not None and len(graph):
+                return graph, True
+    except (LedgerUnavailable, requests.RequestException, ValueError, KeyError, TypeError) as e:
+        # LedgerUnavailable covers connection errors, timeouts, the deadline,
+        # the circuit breaker and the concurrency limiter, see SlpInterface._request
+        logger.info("Unable to fetch shape %s from the ledger: %s", asset_id, e)
+    if setting in SHAPE_FILES:
+        graph = rdflib.Graph()
+        graph.parse(SHAPE_FILES[setting], format='turtle')
+        return graph, False
+    return None, False
+
+
+# Compiled validators by shape asset ID. A changed setting points to
+# another asset, so entries never need to be invalidated. Only shapes
+# fetched from the ledger are kept; after a failed fetch, the next
+# validation tries again.
+_validators = {}
+# Futures of the validators being loaded, by shape asset ID,
+# so that concurrent validations share one ledger call
+_loading = {}
+_lock = threading.Lock()
+
+
+def validator_for(setting):
+    """
+    Return the compiled validator for the shape in @setting
+    (e.g. 'order_shape'), or None if there is none.
+    """
+    try:
+        asset_id = settings_registry.get(setting)
+    except Setting.DoesNotExist:
+        return None
+    if asset_id in _validators:
+        return _validators[asset_id]
+    with _lock:
+        if asset_id in _validators:
+            return _validators[asset_id]
+        future = _loading.get(asset_id)
+        if future is None:
+            future = _loading[asset_id] = Future()
+            loading = True
+        else:
+            loading = False
+    if not loading:
+        return future.result()
+
+    # Fetched without holding the lock, so that validations
+    # against other shapes do not wait for this one
+    try:
+        shapes_graph, fetched = _load_shapes_graph(setting, asset_id)
+        validator = compile_shapes(shapes_graph) if shapes_graph is not None else None
+    except BaseException as e:
+        with _lock:
+            del _loading[asset_id]
+        future.set_exception(e)
+        raise
+    with _lock:
+        if fetched:
+            _validators[asset_id] = validator
+        del _loading[asset_id]
+    future.set_result(validator)
+    return validator
+
+
+def validate(setting, data):
+    """
+    Validate @data (an RDF graph, or JSON-LD as a string or dict) against
+    the shape in @setting. Returns the list of violations, which is empty
+    if the data conforms or cannot be validated locally.
+    """
+    return validate_many(setting, [data])[0]
+
+
+def validate_many(setting, data_list):
+    """
+    Validate every item of @data_list against the shape in @setting,
+    compiling the shape only once. Returns a list of violation lists.
+    """
+    validator = validator_for(setting) if settings.SHACL_LOCAL_VALIDATION else None
+    results = []
+    for data in data_list:
+        if validator is None:
+            results.append([])
+            continue
+        graph = data if isinstance(data, rdflib.Graph) else parse_rdf(data)
+        if graph is None:
+            results.append(["Data is not valid JSON-LD"])
+        else:
+            with timing.span('shacl'):
+                results.append(validator.validate(graph))
+    return results
@@ -0,0 +1,67 @@
+"""
+A module for version numbers in the shared Django cache, through which
+worker processes tell each other that their in-process caches are stale.
+
+A process that changes cached data bumps the version; every process
+compares the version against the one it saw last, at most every
+CACHE_VERSION_CHECK_INTERVAL seconds, and drops its cache when it moved.
+This is how the token cache (api/authentication.py), the SLP ID
+cache (api/identity.py) and the settings registry
+(api/settings_registry.py) are invalidated across processes.
+Note that the default cache is per process: configure a shared backend
+(CACHE_BACKEND / CACHE_LOCATION) when running several workers.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def bump(key):
+    """
+    Change the version stored under @key.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        # No version yet (or it was evicted): start a new one.
+        # Any value differs from the versions seen before,
+        # as long as it is not reused
+        cache.set(key, int(time.time() * 1000), None)
+
+
+class SharedVersion(object):
+    """
+    The version under @key, as last seen by this process.
+    @interval_setting names the setting holding the check interval.
+    """
+
+    def __init__(self, key, interval_setting='CACHE_VERSION_CHECK_INTERVAL'):
+        self.key = key
+        self.interval_setting = interval_setting
+        self._seen = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def bump(self):
+        bump(self.key)
+
+    def changed(self):
+        """
+        Whether the version moved since the last call that checked it.
+        Only asks the shared cache once per check interval.
+        """
+        interval = getattr(settings, self.interval_setting)
+        now = time.monotonic()
+        if now - self._checked < interval:
+            return False
+        with self._lock:
+            if now - self._checked < interval:
+                return False
+            version = cache.get(self.key)
+            self._checked = now
+            if version == self._seen:
+                return False
+            self._seen = version
+            return True
@@ -1,9 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
+from django.db import transaction
 from rest_framework.authtoken.models import Token
 
-from api.serializers import SlpIdSerializer
+from api.authentication import token_cache
+from api.models import Setting, SlpId
+import api.identity as identity
+import api.identity_pool as identity_pool
+import api.settings_registry as settings_registry
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -15,7 +20,41 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_slp_id(sender, instance=None, created=False, **kwargs):
     if created:
-        serializer = SlpIdSerializer(data={'active': True})
-        if not serializer.is_valid():
-            raise ValueError("Unable to create semantic-ledger ID")
-        serializer.create(instance)
+        # Claims a pre-created identity if possible, see api/identity_pool.py
+        try:
+            identity_pool.assign(instance)
+        except ValueError as e:
+            raise ValueError("Unable to create semantic-ledger ID: %s" % e)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance=None, **kwargs):
+    token_cache.invalidate_key(instance.key)
+    # Other processes may cache the token again until the deletion commits
+    transaction.on_commit(token_cache.version.bump)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens(sender, instance=None, created=False, **kwargs):
+    # E.g. a deactivated user must not keep authenticating with a cached token
+    if not created:
+        token_cache.invalidate_user(instance.pk)
+        transaction.on_commit(token_cache.version.bump)
+
+
+@receiver(post_save, sender=SlpId)
+@receiver(post_delete, sender=SlpId)
+def invalidate_slp_id_cache(sender, instance=None, **kwargs):
+    identity.invalidate(instance.user_id)
+    # Other processes may cache the old rows again until the change commits
+    transaction.on_commit(identity.version.bump)
+
+
+@receiver(post_save, sender=Setting)
+@receiver(post_delete, sender=Setting)
+def invalidate_settings_registry(sender, instance=None, **kwargs):
+    # Bump right away for this process, and again after commit,
+    # in case another process reloaded the old rows in between
+    settings_registry.registry.invalidate()
+    transaction.on_commit(settings_registry.registry.invalidate)
@@ -3,16 +3,27 @@ A module containing utility functions for interaction with an SLP node.
 Actual communication is performed in slp_interface.py.
 The present module captures common or intuitive usage patterns of the SLP interface.
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework.response import Response
 from rest_framework import status as http_status
 
+from api.deadline import LedgerUnavailable
 from api.slp_interface import SlpInterface
 
-from api.models import SlpId
+import api.deadline as deadline
+import api.identity as identity
+import api.metrics as metrics
 import api.semantics as semantics
+import api.timing as timing
 
 import os
+import time
+
+# Worker pool shared by all requests in this process, see submit()
+executor = ThreadPoolExecutor(max_workers=settings.SLP_MAX_WORKERS)
 
 # Simple wrapper functions
 def get_asset(*args, **kwargs):
@@ -55,46 +66,49 @@ def all_assets(user, type=None, history=False, created=False):
 
     The return object is a dictionary where the keys are asset IDs and the values
     are dictionaries containing all the asset data.
+    For large accounts, prefer iter_assets, which does not
+    hold all assets in memory at once.
+    """
+    return dict(iter_assets(user, type=type, history=history, created=created))
+
+def iter_assets(user, type=None, history=False, created=False):
+    """
+    Stream all assets owned by a user as (asset_id, asset) pairs.
+
+    Takes the same arguments as all_assets.
+    The ledger responses are decoded incrementally, and type filtering
+    and deduplication across the user's SLP IDs happen lazily,
+    so only the asset IDs seen so far are kept in memory.
     """
     slp_interface = SlpInterface()
 
     # Retrieve user's SLP IDs
-    try:
-        slp_ids = SlpId.objects.filter(user=user, active=True)
-        # Extract the actual SLP-ID string from the complex SLP-ID object
-        slp_ids = [id.slp_id for id in slp_ids]
-    except ObjectDoesNotExist:
-        # TODO any special exception handling?
-        raise ObjectDoesNotExist("Could not retrieve user's SLP IDs")
-
-    # collect assets
-    assets = {}
+    # Extract the actual SLP-ID string from the complex SLP-ID object
+    slp_ids = [id.slp_id for id in identity.active_ids(user)]
+
+    # Asset IDs that were already yielded for another SLP ID
+    seen = set()
     for slp_id in slp_ids:
-        try:
-            if history:
-                # Get all transactions in a user's history, grouped by asset
-                assetDicts = slp_interface.get_history_of_user(slp_id, created=created)
-            else:
-                # Send asData=True flag, else this only returns asset IDs!
-                assetDicts = slp_interface.get_assets_of(slp_id, asData=True)
-        except Exception as e:
-            #TODO handle exception type?
-            raise e
-        
+        if history:
+            # Get all transactions in a user's history, grouped by asset
+            assetDicts = slp_interface.iter_history_of_user(slp_id, created=created)
+        else:
+            # Full assets, not just asset IDs
+            assetDicts = slp_interface.iter_assets_of(slp_id)
+
         # Extract only the assets
-        for assetID, assetDict in assetDicts.items():
+        for assetID, assetDict in assetDicts:
+            if assetID in seen:
+                continue
+            seen.add(assetID)
             asset = assetDict['asset']
             if 'id' not in asset:
                 # CREATE transactions do not insert an 'id' field...
                 # TODO fix this in the SLP platform
                 asset['id'] = assetID
-            assets[assetID] = asset
-    
-    if type:
-        assets = {assetID:asset for (assetID, asset) in assets.items()
-                    if semantics.has_type(type, asset)}
-    
-    return assets
+            if type and not semantics.has_type(type, asset):
+                continue
+            yield assetID, asset
 
 def owns(user, asset_id):
     """
@@ -116,19 +130,16 @@ def owns(user, asset_id):
         return False
     
     # Retrieve user's SLP IDs
-    try:
-        slp_ids = SlpId.objects.filter(user=user, active=True)
-        # Extract the actual SLP-ID string from the complex SLP-ID object
-        slp_ids = [id.slp_id for id in slp_ids]
-    except ObjectDoesNotExist:
-        # TODO any special exception handling?
-        return False
+    # Extract the actual SLP-ID string from the complex SLP-ID object
+    slp_ids = [id.slp_id for id in identity.active_ids(user)]
     
     # For each SLP ID, check if the asset is among the
     # assets owned by that ID
     for slp_id in slp_ids:
         try:
             user_assets = slp_interface.get_assets_of(slp_id)
+        except LedgerUnavailable:
+            raise
         except Exception as e:
             # TODO handle some exceptions differently? E.g. bad request could be passed on.. 
             print('Cannot check asset ownership:', str(e))
@@ -177,25 +188,77 @@ def get_transactions(asset_id, type=None, **kwargs):
     """
     # TODO Type filtering can probably also happen in slp_interface,
     # or even in the slp platform.
+    txs = SlpInterface().get_transactions(asset_id, **kwargs)
+    if type:
+        txs = filter_transactions(txs, type)
+    return txs
+
+def filter_transactions(txs, type):
+    """
+    Return only those transactions in @txs whose data
+    carries the semantic type @type.
+    """
     # TODO It seems clunky to have to juggle different txs in specific functions;
     # couldn't we create abstract TX objects whenever we get them, so we
     # don't have to worry about this?
-    txs = SlpInterface().get_transactions(asset_id, kwargs)
-    if type:
-        filtered_txs = []
-        for tx in txs:
-            # Set up the path to get the data from the tx object
-            data_key = lambda tx_dict: tx_dict['metadata']['data']
-            if tx['operation'] == "CREATE":
-                # Data is stored in a different place for CREATE transactions
-                data_key = lambda tx_dict: tx_dict['asset']['data']
-            # Do the typechecking
+    filtered_txs = []
+    for tx in txs:
+        # Set up the path to get the data from the tx object
+        data_key = lambda tx_dict: tx_dict['metadata']['data']
+        if tx['operation'] == "CREATE":
+            # Data is stored in a different place for CREATE transactions
+            data_key = lambda tx_dict: tx_dict['asset']['data']
+        # Do the typechecking
+        try:
+            if semantics.has_type(type, data_key(tx)):
+                filtered_txs.append(tx)
+        except (KeyError, TypeError):
+            # Tx does not contain data
+            continue
+    return filtered_txs
+
+def submit(fn, *args, **kwargs):
+    """
+    Schedule a (ledger) call on a shared worker pool,
+    returning a Future for its result.
+
+    This lets views fire independent ledger requests at the same time.
+    Submitted functions should not submit further work themselves,
+    since the pool is bounded.
+    Calls are timed as part of the submitting request, see api/timing.py,
+    and keep its deadline, see api/deadline.py.
+    """
+    fn = deadline.bind(timing.bind(fn))
+    submitted = time.perf_counter()
+
+    def run(*args, **kwargs):
+        metrics.slp_executor_wait.observe(time.perf_counter() - submitted)
+        return fn(*args, **kwargs)
+    return executor.submit(run, *args, **kwargs)
+
+def bounded_map(fn, items, executor, max_in_flight):
+    """
+    Apply @fn to every item of the iterable @items on @executor,
+    yielding (item, future) pairs in order of completion.
+
+    At most @max_in_flight calls are pending at any time, and @items is
+    only consumed as calls complete, so arbitrarily long streams
+    (e.g. a queryset .iterator()) are processed in bounded memory.
+    """
+    pending = {}
+    items = iter(items)
+    exhausted = False
+    fn = deadline.bind(timing.bind(fn))
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
             try:
-                if semantics.has_type(type, data_key(tx)):
-                    filtered_txs.append(tx)
-            except KeyError:
-                # Tx does not contain data
-                continue
-        # Continue working with the filtered txs only
-        txs = filtered_txs
-    return txs
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[executor.submit(fn, item)] = item
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
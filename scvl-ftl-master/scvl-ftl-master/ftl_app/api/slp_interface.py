@@ -1,20 +1,203 @@
 import requests
+from contextlib import closing
 from datetime import datetime
 from rest_framework.status import HTTP_200_OK
 import json
+import re
 
 import os
+import time
+
+from django.conf import settings
+
+from api.circuit_breaker import CircuitBreaker
+from api.deadline import DeadlineExceeded, LedgerUnavailable
+import api.concurrency_limiter as concurrency_limiter
+import api.deadline as deadline
+import api.fake_ledger as fake_ledger
+import api.metrics as metrics
+import api.timing as timing
+
+# Matches (possibly empty) runs of JSON whitespace
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# The ledger endpoint of every operation, as reported in the slow request log
+URL_TEMPLATES = {
+    'create_id': 'POST /id/',
+    'publish': 'POST /publish/',
+    'transfer': 'POST /transfer/',
+    'validate_publication': 'GET /validate_asset/{asset_id}',
+    'get_publication': 'GET /asset/{asset_id}',
+    'get_assets_of': 'GET /assets/{slp_id}',
+    'iter_assets_of': 'GET /assets/{slp_id}/?asData=True',
+    'get_history_of_user': 'GET /history/{slp_id}',
+    'iter_history_of_user': 'GET /history/{slp_id}',
+    'get_inputs': 'GET /transaction/inputs/{tx_id}',
+    'get_transactions': 'GET /asset/{asset_id}/transactions/',
+    'get_block_height': 'GET /transaction/{tx_id}/?block=true',
+}
+
+# Shared by all threads of this process, see api/circuit_breaker.py
+breaker = CircuitBreaker()
+
+
+def iter_json_members(response, chunk_size=64 * 1024):
+    """
+    Incrementally decode a JSON object from a streamed @response,
+    yielding its (key, value) members one at a time.
+
+    Only the member that is currently being decoded is kept in memory,
+    so large ledger responses (e.g. a user's full history) can be
+    processed without materializing the whole document.
+    """
+    decoder = json.JSONDecoder()
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    chunks = response.iter_content(chunk_size=chunk_size, decode_unicode=True)
+
+    buffer = ''
+    position = 0
+    opened = False
+    exhausted = False
+    while not exhausted:
+        try:
+            buffer += next(chunks)
+        except StopIteration:
+            exhausted = True
+
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position >= len(buffer):
+                # Need more data
+                break
+            char = buffer[position]
+            if not opened:
+                if char != '{':
+                    raise ValueError("Expected a JSON object in ledger response")
+                opened = True
+                position += 1
+                continue
+            if char == '}':
+                return
+            if char == ',':
+                position += 1
+                continue
+            try:
+                key, end = decoder.raw_decode(buffer, position)
+                end = WHITESPACE.match(buffer, end).end()
+                if end >= len(buffer):
+                    break
+                if buffer[end] != ':':
+                    raise ValueError("Malformed JSON object in ledger response")
+                end = WHITESPACE.match(buffer, end + 1).end()
+                value, end = decoder.raw_decode(buffer, end)
+            except json.JSONDecodeError:
+                # The member is not complete yet
+                break
+            end = WHITESPACE.match(buffer, end).end()
+            # A trailing number could still be cut off mid-way (e.g. "-15"
+            # of "-1500.0"), so only accept the member once its delimiter is visible.
+            if end >= len(buffer):
+                break
+            if buffer[end] not in ',}':
+                if exhausted:
+                    raise ValueError("Malformed JSON object in ledger response")
+                break
+            yield key, value
+            position = end
+
+        # Drop everything that has been consumed
+        buffer = buffer[position:]
+        position = 0
+
+    raise ValueError("Truncated JSON object in ledger response")
+
 
 class SlpInterface:
-    def __init__(self, URL=os.getenv('SLP_URL'), TOKEN=os.getenv('SLP_TOKEN')):
+    def __init__(self, URL=None, TOKEN=None):
+        # Read the environment on every call, so the ledger can be switched
+        URL = URL or os.getenv('SLP_URL')
+        TOKEN = TOKEN or os.getenv('SLP_TOKEN')
+        if fake_ledger.is_fake(URL):
+            # Ledger served from this process, see api/fake_ledger.py
+            URL = fake_ledger.resolve(URL)
+            TOKEN = TOKEN or 'fake'
         if not URL or not TOKEN:
             raise AttributeError("URL or TOKEN not set")
         self.slp_url = URL
         self.slp_auth_token = TOKEN
 
-    def create_id(self, username):
-        slp_id = "{}_{}".format(username, datetime.now().isoformat())
-        r = requests.post(
+    def _request(self, operation, method, url, **kwargs):
+        """
+        Make an HTTP request to the ledger for @operation (the name of
+        the calling method). Every ledger call goes through here, so this
+        is where calls are timed, see api/timing.py, and counted,
+        see api/metrics.py.
+        The time of streamed calls only covers receiving the headers.
+
+        The call times out when the request's deadline passes, see
+        api/deadline.py, and fails at once while the circuit breaker is
+        open. It waits for a slot of its lane of the concurrency limiter,
+        see api/concurrency_limiter.py, and fails if none frees up in time.
+        All of these, and connection errors, raise LedgerUnavailable.
+        """
+        start = time.perf_counter()
+        status = None
+        try:
+            # Do not queue for a slot once the deadline has passed
+            deadline.timeout()
+            limiter = concurrency_limiter.lane(operation)
+            if limiter is not None:
+                with timing.span('slp_wait'):
+                    started_with = limiter.acquire()
+            # Whether the call showed that the ledger is overloaded, None if it did not tell
+            failed = None
+            called = time.perf_counter()
+            try:
+                timeout = deadline.timeout()
+                # Only ask the breaker once nothing but the call itself can fail,
+                # and always tell it the outcome, so that a probe is never left pending
+                breaker.before_call()
+                try:
+                    with timing.span('slp', (operation, None, None)) as span:
+                        try:
+                            response = requests.request(method, url, **kwargs,
+                                                        timeout=(min(timeout, settings.SLP_CONNECT_TIMEOUT), timeout))
+                        except requests.Timeout as e:
+                            if timeout < settings.SLP_TIMEOUT:
+                                # Cut short by the deadline, which says little about the ledger
+                                raise DeadlineExceeded() from e
+                            failed = True
+                            raise LedgerUnavailable("The ledger did not answer within {} seconds".format(timeout)) from e
+                        except requests.RequestException as e:
+                            failed = True
+                            raise LedgerUnavailable("Could not reach the ledger: {}".format(e)) from e
+                        failed = response.status_code >= 500
+                        # Streamed bodies have not been read yet
+                        size = response.headers.get('Content-Length') if kwargs.get('stream') else len(response.content)
+                        span.detail = (operation, response.status_code, int(size) if size is not None else None)
+                finally:
+                    if failed is None:
+                        breaker.abandoned()
+                    elif failed:
+                        breaker.failed()
+                    else:
+                        breaker.succeeded()
+            finally:
+                if limiter is not None:
+                    limiter.release(operation, time.perf_counter() - called, failed, started_with)
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            metrics.slp_requests.observe(time.perf_counter() - start, operation, status)
+        return response
+
+    def create_id(self, username, alias=None):
+        # The alias defaults to the username, made unique by a timestamp
+        slp_id = alias or "{}_{}".format(username, datetime.now().isoformat())
+        r = self._request('create_id', 'post',
             "{}/id/".format(self.slp_url),
             data={
                 'alias': slp_id
@@ -55,7 +238,7 @@ class SlpInterface:
             data['shapes'] = [{"shape": shape_param, "shape_format": 'json-ld'}]
 
         url = "{}/publish/".format(self.slp_url)
-        r = requests.post(
+        r = self._request('publish', 'post',
             url,
             json=data,
             headers={
@@ -83,7 +266,7 @@ class SlpInterface:
             data['metadata'] = metadata
 
         url = "{}/transfer/".format(self.slp_url)
-        r = requests.post(
+        r = self._request('transfer', 'post',
             url,
             json=data,
             headers={
@@ -99,7 +282,7 @@ class SlpInterface:
 
     def validate_publication(self, asset_id):
         url = "{}/validate_asset/{}".format(self.slp_url, asset_id)
-        r = requests.get(url)
+        r = self._request('validate_publication', 'get', url)
 
         if r.status_code != HTTP_200_OK:
             raise ValueError("Could not validate asset, %s" % r.text)
@@ -120,7 +303,7 @@ class SlpInterface:
 
     def get_publication(self, asset_id):
         url = "{}/asset/{}".format(self.slp_url, asset_id)
-        r = requests.get(url)
+        r = self._request('get_publication', 'get', url)
 
         if r.status_code != HTTP_200_OK:
             raise ValueError("Could not retrieve asset, %s" % r.text)
@@ -135,7 +318,7 @@ class SlpInterface:
         # TODO refactor into two separate function calls...
         if asData:
             url += '/?asData=True'
-        r = requests.get(url,
+        r = self._request('get_assets_of', 'get', url,
                          headers={'Authorization': 'Token {}'.format(self.slp_auth_token)}
                          )
 
@@ -146,6 +329,24 @@ class SlpInterface:
         # print("Result from get_assets_of: {}".format(r.json()))
         return r.json()
 
+    def iter_assets_of(self, slp_id):
+        """
+        Streaming variant of get_assets_of(@slp_id, asData=True).
+
+        Yields (asset_id, asset_dict) pairs while the ledger
+        response is being received, instead of decoding it all at once.
+        """
+        url = "{}/assets/{}/?asData=True".format(self.slp_url, slp_id)
+        r = self._request('iter_assets_of', 'get', url,
+                         headers={'Authorization': 'Token {}'.format(self.slp_auth_token)},
+                         stream=True
+                         )
+
+        with closing(r):
+            if r.status_code != HTTP_200_OK:
+                raise ValueError("Could not retrieve assets, %s" % r.text)
+            yield from iter_json_members(r)
+
     def get_history_of_user(self, slp_id, created=False):
         """
         Return the full history of a user's activity.
@@ -170,7 +371,7 @@ class SlpInterface:
         params = {}
         if created:
             params['created'] = True
-        response = requests.get(url,
+        response = self._request('get_history_of_user', 'get', url,
                          headers={'Authorization': 'Token {}'.format(self.slp_auth_token)},
                          params=params
                          )
@@ -182,11 +383,31 @@ class SlpInterface:
         # Return the response object
         return response.json()
 
+    def iter_history_of_user(self, slp_id, created=False):
+        """
+        Streaming variant of get_history_of_user.
+
+        Yields (asset_id, {'asset': asset, 'transactions': [...]}) pairs
+        while the ledger response is being received.
+        """
+        url = "{}/history/{}".format(self.slp_url, slp_id)
+        params = {}
+        if created:
+            params['created'] = True
+        response = self._request('iter_history_of_user', 'get', url,
+                         headers={'Authorization': 'Token {}'.format(self.slp_auth_token)},
+                         params=params,
+                         stream=True
+                         )
 
+        with closing(response):
+            if response.status_code != HTTP_200_OK:
+                raise ValueError("Could not retrieve assets, %s" % response.text)
+            yield from iter_json_members(response)
 
     def get_inputs(self, tx_id):
         url = "{}/transaction/inputs/{}".format(self.slp_url, tx_id)
-        r = requests.get(url)
+        r = self._request('get_inputs', 'get', url)
 
         if r.status_code != HTTP_200_OK:
             raise ValueError("Could not retrieve inputs of tx %s; %s" % (tx_id, r.text))
@@ -207,7 +428,7 @@ class SlpInterface:
         # Add query arguments
         if sort:
             url += '?sort=True'
-        response = requests.get(url)
+        response = self._request('get_transactions', 'get', url)
 
         if response.status_code != HTTP_200_OK:
             #TODO catch specific exceptions?
@@ -224,7 +445,7 @@ class SlpInterface:
         # TODO describe return format
         # TODO set url
         url = "{}/transaction/{}/?block=true".format(self.slp_url, tx_id)
-        response = requests.get(url)
+        response = self._request('get_block_height', 'get', url)
 
         if response.status_code != HTTP_200_OK:
             #TODO catch specific exceptions?
@@ -7,7 +7,10 @@ Author: Jeroen Breteler
 Date: 2019-12-27
 """
 
+import time
+
 from api.slp_interface import SlpInterface
+import api.metrics as metrics
 import api.slp_helpers as slp_helpers
 
 class Status(object):
@@ -39,14 +42,27 @@ class Status(object):
         Determine the current status of an asset.
         @asset_id is the ID of the asset.
         """
+        start = time.perf_counter()
         slp_interface = SlpInterface()
         # Get transactions for this asset
         transactions = slp_interface.get_transactions(asset_id, sort=True)
+        status = cls.status_from_transactions(transactions)
+        metrics.status_lookups.observe(time.perf_counter() - start, cls.__name__)
+        return status
+
+    @classmethod
+    def status_from_transactions(cls, transactions):
+        """
+        Determine the current status of an asset
+        from its chronologically sorted @transactions.
+
+        Use this instead of get_status when the transactions
+        were already retrieved for another purpose.
+        """
         # Iterate over transactions looking
         # for the latest status update.
         # Order counter-chronologically.
-        transactions.reverse()
-        for latest_tx in transactions:
+        for latest_tx in reversed(transactions):
             # Determine status
             # If the tx operation is CREATE,
             # the asset is in initial status.
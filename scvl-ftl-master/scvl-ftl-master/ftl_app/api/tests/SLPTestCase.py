@@ -8,7 +8,9 @@ from django.contrib.auth.models import User
 
 from django.core.management import call_command
 
+import api.fake_ledger as fake_ledger
 import api.tests.testdata as testdata
+import os
 
 class SLPTestCase(APITestCase):
     """
@@ -32,10 +34,17 @@ class SLPTestCase(APITestCase):
         Before running any tests, this method sets up
         the admin account.
         It also posts SHACL shapes and sets the Settings for them.
+
+        Run the tests with SLP_URL=fake:// to use a ledger served from
+        this process instead of a real SLP node (see api/fake_ledger.py);
+        cls.ledger then holds it, e.g. to inject latency.
         """
         # Call super for Django TestCase initialization
         super().setUpClass()
 
+        # Start the fake ledger, if configured (None for a real ledger)
+        cls.ledger = fake_ledger.get(os.getenv('SLP_URL'))
+
         # Create client
         cls.client = APIClient()
 
@@ -0,0 +1,101 @@
+from rest_framework.authtoken.models import Token
+from rest_framework import status as http_status
+
+from django.test import override_settings
+from django.urls import reverse
+
+from api.models import OrderChange
+from api.status.order_status import OrderStatus
+from api.tests.SLPTestCase import SLPTestCase
+import api.views.ChangeViews as ChangeViews
+
+class ChangeFeedTest(SLPTestCase):
+    '''
+    Test that order changes made through the API
+    show up in the changes feed of both participants.
+    '''
+
+    def getChanges(self, username, cursor=0):
+        """
+        Retrieve the changes feed as @username, starting at @cursor.
+        """
+        user_token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+        response = self.client.get(reverse('changes'), {'cursor': cursor})
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        return response.data
+
+    def testChangeFeed(self):
+        """
+        Test that posting and confirming an order
+        produce changes, and that cursors only return newer changes.
+        """
+        order_asset_id = self.postOrder()
+
+        # Both customer and service provider see the new order
+        for username in ('alice', 'bob'):
+            feed = self.getChanges(username)
+            self.assertEqual([change['asset_id'] for change in feed['changes']], [order_asset_id])
+            self.assertEqual(feed['changes'][0]['kind'], OrderChange.ORDER)
+            self.assertEqual(feed['changes'][0]['status'], OrderStatus.TO_BE_CONFIRMED)
+        cursor = feed['cursor']
+
+        # Nothing changed since the cursor
+        self.assertEqual(self.getChanges('alice', cursor)['changes'], [])
+
+        # Confirming the order yields exactly one new change
+        self.confirmOrder(order_asset_id)
+        feed = self.getChanges('alice', cursor)
+        self.assertEqual(len(feed['changes']), 1)
+        self.assertEqual(feed['changes'][0]['kind'], OrderChange.STATUS)
+        self.assertEqual(feed['changes'][0]['status'], OrderStatus.CONFIRMED)
+        self.assertGreater(feed['cursor'], cursor)
+        print('Changes feed returned the confirmation only')
+
+    def testChangeLongPoll(self):
+        """
+        Test that long-polling returns pending changes right away,
+        and times out with an empty list when nothing changes.
+        """
+        order_asset_id = self.postOrder()
+
+        url = reverse('change_stream')
+        user_token = Token.objects.get(user__username='bob')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+
+        response = self.client.get(url, {'cursor': 0, 'timeout': 5})
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertEqual([change['asset_id'] for change in response.data['changes']], [order_asset_id])
+
+        response = self.client.get(url, {'cursor': response.data['cursor'], 'timeout': 1})
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(response.data['changes'], [])
+        print('Long-poll timed out without changes')
+
+    def testWaitingLimit(self):
+        """
+        Test that clients beyond CHANGES_MAX_WAITING are refused with 503,
+        and that finished waits free their slot.
+        """
+        url = reverse('change_stream')
+        user_token = Token.objects.get(user__username='bob')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+
+        with override_settings(CHANGES_MAX_WAITING=1):
+            release = ChangeViews.waiting_slots.reserve()
+            try:
+                for accept in ('application/json', 'text/event-stream'):
+                    response = self.client.get(url, {'timeout': 0}, HTTP_ACCEPT=accept)
+                    self.assertEqual(response.status_code, http_status.HTTP_503_SERVICE_UNAVAILABLE)
+                    self.assertIn('Retry-After', response)
+            finally:
+                release()
+
+            response = self.client.get(url, {'timeout': 0})
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+            # A stream holds its slot until it is closed
+            response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+            self.assertEqual(ChangeViews.waiting_slots.waiting, 1)
+            response.close()
+            self.assertEqual(ChangeViews.waiting_slots.waiting, 0)
@@ -0,0 +1,37 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from api.models import SlpId
+from api.tests.SLPTestCase import SLPTestCase
+import api.identity as identity
+
+@override_settings(CACHE_VERSION_CHECK_INTERVAL=0)
+class SlpIdCacheTest(SLPTestCase):
+    '''
+    Test that cached SLP IDs are dropped in every process when they change.
+    '''
+
+    def testDeactivationAcrossProcesses(self):
+        """
+        Test that a deactivation in another process is seen,
+        and that a lookup that raced with an invalidation is not cached.
+        """
+        alice = User.objects.get(username='alice')
+        self.assertTrue(identity.active_ids(alice))
+
+        # Another process deactivates the IDs, and bumps the shared version
+        SlpId.objects.filter(user=alice).update(active=False)
+        identity.version.bump()
+        self.assertEqual(identity.active_ids(alice), ())
+
+        SlpId.objects.filter(user=alice).update(active=True)
+        filter = SlpId.objects.filter
+        def racing_filter(*args, **kwargs):
+            identity.invalidate(alice.pk)
+            return filter(*args, **kwargs)
+        with mock.patch.object(SlpId.objects, 'filter', side_effect=racing_filter):
+            identity.invalidate(alice.pk)
+            identity.active_ids(alice)
+        self.assertNotIn(alice.pk, identity._cache)
@@ -0,0 +1,58 @@
+import io
+import json
+
+from django.test import SimpleTestCase
+from requests.models import Response
+
+from api.slp_interface import iter_json_members
+
+def streamed(data):
+    """
+    Return a requests Response that streams the bytes @data.
+    """
+    response = Response()
+    response.raw = io.BytesIO(data)
+    response.status_code = 200
+    return response
+
+class JsonStreamingTest(SimpleTestCase):
+    '''
+    Test that streamed ledger responses are decoded correctly, wherever they are split.
+    '''
+
+    document = {
+        'a': -1500.0,
+        'b': 1.5e-7,
+        'c': [1, 2E+10, {'d': None}],
+        'e': 'vrachtwagen 🚚 café',
+        'f': {'nested': {'x': True, 'y': False}},
+        'g': 12,
+    }
+
+    def testEveryChunkSize(self):
+        """
+        Test that the members come out unchanged for every chunk size
+        """
+        for indent in (None, 2):
+            data = json.dumps(self.document, indent=indent, ensure_ascii=False).encode()
+            for chunk_size in range(1, len(data) + 1):
+                members = list(iter_json_members(streamed(data), chunk_size=chunk_size))
+                self.assertEqual(dict(members), self.document, (indent, chunk_size))
+                self.assertEqual([key for key, value in members], list(self.document))
+
+    def testTrailingNumber(self):
+        """
+        Test that a number cut at a chunk boundary is not taken early
+        """
+        for chunk_size in range(1, 15):
+            self.assertEqual(list(iter_json_members(streamed(b'{"e": -1500.0}'), chunk_size=chunk_size)),
+                             [('e', -1500.0)])
+
+    def testMalformed(self):
+        """
+        Test that truncated or malformed documents raise ValueError
+        """
+        for data in (b'{"a": 1', b'{"a": 1 2}', b'[1]', b'{"a" 1}'):
+            for chunk_size in (1, 3, 64):
+                with self.assertRaises(ValueError):
+                    list(iter_json_members(streamed(data), chunk_size=chunk_size))
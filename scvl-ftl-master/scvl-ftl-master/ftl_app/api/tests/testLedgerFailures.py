@@ -0,0 +1,143 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from api.circuit_breaker import CircuitBreaker, CircuitOpen
+from api.concurrency_limiter import ConcurrencyLimiter, LedgerOverloaded
+from api.deadline import DeadlineExceeded
+from api.fake_ledger import FakeLedger
+from api.slp_interface import SlpInterface
+import api.concurrency_limiter as concurrency_limiter
+import api.deadline as deadline
+import api.slp_interface as slp_interface
+
+class LedgerFailureTest(SimpleTestCase):
+    '''
+    Test that ledger calls give up in time, and stop while the ledger fails.
+    '''
+
+    def testDeadline(self):
+        """
+        Test that ledger calls time out at the deadline, and are not made after it
+        """
+        with FakeLedger(latency=1) as ledger, mock.patch.object(slp_interface, 'breaker', CircuitBreaker()):
+            slp = SlpInterface(URL=ledger.url, TOKEN='fake')
+            started = time.monotonic()
+            with deadline.activate(started + 0.1), self.assertRaises(DeadlineExceeded):
+                slp.get_publication('missing')
+            self.assertLess(time.monotonic() - started, 0.9)
+
+            requests = ledger.requests
+            with deadline.activate(time.monotonic() - 1), self.assertRaises(DeadlineExceeded):
+                slp.get_publication('missing')
+            self.assertEqual(ledger.requests, requests)
+            # Timeouts due to the deadline do not count as ledger failures
+            self.assertEqual(slp_interface.breaker.consecutive_failures, 0)
+
+    def testCircuitBreaker(self):
+        """
+        Test that the breaker opens after consecutive failures, and closes after a successful probe
+        """
+        breaker = CircuitBreaker(failures=2, reset=0.2)
+        with FakeLedger(error_rate=1) as ledger, mock.patch.object(slp_interface, 'breaker', breaker):
+            slp = SlpInterface(URL=ledger.url, TOKEN='fake')
+            for attempt in range(2):
+                with self.assertRaises(ValueError):
+                    slp.get_publication('missing')
+            requests = ledger.requests
+            with self.assertRaises(CircuitOpen):
+                slp.get_publication('missing')
+            self.assertEqual(ledger.requests, requests)
+
+            # The ledger recovers; after the reset time a probe closes the breaker
+            ledger.error_rate = 0
+            time.sleep(0.2)
+            with self.assertRaises(ValueError):
+                # Not found, but answered
+                slp.get_publication('missing')
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def testConcurrencyLimit(self):
+        """
+        Test that the limit grows while calls are fast, and shrinks once when they slow down
+        """
+        limiter = ConcurrencyLimiter('read', initial=4, minimum=1, maximum=10)
+        for call in range(20):
+            for slot in range(4):
+                limiter.acquire()
+            for slot in range(4):
+                limiter.release('get_publication', 0.01)
+        self.assertGreater(limiter.limit, 6)
+        self.assertLessEqual(limiter.limit, 10)
+
+        limit = limiter.limit
+        for slot in range(4):
+            limiter.acquire()
+        for slot in range(4):
+            limiter.release('get_publication', 1)
+        self.assertAlmostEqual(limiter.limit, limit * 0.8)
+
+        # Failures decrease the limit, but calls that did not tell do not;
+        # let the next calls start after the last decrease
+        time.sleep(0.01)
+        limiter.acquire()
+        limiter.release('get_publication', 0.01, failed=None)
+        self.assertAlmostEqual(limiter.limit, limit * 0.8)
+        limiter.acquire()
+        limiter.release('get_publication', 0.01, failed=True)
+        self.assertAlmostEqual(limiter.limit, limit * 0.8 * 0.8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def testConcurrencyShedding(self):
+        """
+        Test that calls over the limit wait, and are shed when no slot frees up in time
+        """
+        limiter = ConcurrencyLimiter('write', initial=1, minimum=1, maximum=1)
+        limiter.acquire()
+        with override_settings(SLP_LIMIT_QUEUE_TIMEOUT=0.05), self.assertRaises(LedgerOverloaded):
+            limiter.acquire()
+        with override_settings(SLP_LIMIT_MAX_QUEUE=0), self.assertRaises(LedgerOverloaded):
+            limiter.acquire()
+        self.assertEqual(limiter.shed, 2)
+
+        # Calls do not wait past their deadline
+        with deadline.activate(time.monotonic() - 1), self.assertRaises(LedgerOverloaded):
+            limiter.acquire()
+
+        # A waiting call gets the slot once it is released
+        timer = threading.Timer(0.05, limiter.release, ('publish', 0.01))
+        timer.start()
+        limiter.acquire()
+        self.assertEqual(limiter.in_flight, 1)
+
+        # Reads and writes have lanes of their own
+        self.assertIsNot(concurrency_limiter.lane('publish'), concurrency_limiter.lane('get_publication'))
+        self.assertIs(concurrency_limiter.lane('transfer'), concurrency_limiter.lane('publish'))
+
+    def testShedProbe(self):
+        """
+        Test that a probe call that is shed while waiting for a slot does not keep the breaker open
+        """
+        breaker = CircuitBreaker(failures=1, reset=0.05)
+        limiter = ConcurrencyLimiter('read', initial=1, minimum=1, maximum=1)
+        with FakeLedger(error_rate=1) as ledger, mock.patch.object(slp_interface, 'breaker', breaker), \
+                mock.patch.dict(concurrency_limiter.lanes, {'read': limiter}):
+            slp = SlpInterface(URL=ledger.url, TOKEN='fake')
+            with self.assertRaises(ValueError):
+                slp.get_publication('missing')
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            time.sleep(0.05)
+
+            # Fill the read lane, so that the would-be probe is shed
+            limiter.acquire()
+            with override_settings(SLP_LIMIT_QUEUE_TIMEOUT=0.01), self.assertRaises(LedgerOverloaded):
+                slp.get_publication('missing')
+            limiter.release('get_publication', 0.01)
+
+            ledger.error_rate = 0
+            with self.assertRaises(ValueError):
+                # Not found, but answered
+                slp.get_publication('missing')
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.test import override_settings
+
+from api.deadline import LedgerUnavailable
+from api.models import PooledSlpId, SlpId
+from api.tests.SLPTestCase import SLPTestCase
+import api.identity_pool as identity_pool
+
+# No refills in the background while the pool is counted
+@override_settings(IDENTITY_POOL_SIZE=0)
+class OnboardingTest(SLPTestCase):
+    '''
+    Test that users are onboarded in bulk with identities from the pool.
+    '''
+
+    def testOnboardFromPool(self):
+        """
+        Test that onboarded users take identities from the pool
+        """
+        identity_pool.fill(target=2, workers=2)
+        call_command('onboard_users', count=3, prefix='onboarded', stdout=mock.MagicMock(), stderr=mock.MagicMock())
+        self.assertEqual(identity_pool.size(), 0)
+        self.assertEqual(SlpId.objects.filter(user__username__startswith='onboarded', active=True).count(), 3)
+
+    def testFailedBatchKeepsPool(self):
+        """
+        Test that identities claimed for a batch that fails to save go back to the pool
+        """
+        identity_pool.fill(target=2, workers=2)
+        slp_ids = set(PooledSlpId.objects.values_list('slp_id', flat=True))
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=IntegrityError("duplicate")), \
+                self.assertRaises(CommandError):
+            call_command('onboard_users', count=2, prefix='failed', stdout=mock.MagicMock(), stderr=mock.MagicMock())
+        self.assertEqual(set(PooledSlpId.objects.values_list('slp_id', flat=True)), slp_ids)
+
+    def testLedgerUnavailableSkipsUser(self):
+        """
+        Test that a user whose identity cannot be created is skipped,
+        and the rest of the batch is still onboarded
+        """
+        create_identity = identity_pool.create_identity
+
+        def flaky_create_identity(username, alias=None):
+            if username == 'flaky0':
+                raise LedgerUnavailable()
+            return create_identity(username, alias=alias)
+
+        with mock.patch.object(identity_pool, 'create_identity', flaky_create_identity):
+            call_command('onboard_users', count=3, prefix='flaky', stdout=mock.MagicMock(), stderr=mock.MagicMock())
+        self.assertEqual(sorted(User.objects.filter(username__startswith='flaky').values_list('username', flat=True)),
+                         ['flaky1', 'flaky2'])
+        self.assertEqual(SlpId.objects.filter(user__username__startswith='flaky').count(), 2)
+
+    def testFailedBatchPoolsCreatedIdentities(self):
+        """
+        Test that identities created on the ledger for a batch that fails to save are pooled
+        """
+        self.assertEqual(identity_pool.size(), 0)
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=IntegrityError("duplicate")), \
+                self.assertRaises(CommandError):
+            call_command('onboard_users', count=2, prefix='failed', stdout=mock.MagicMock(), stderr=mock.MagicMock())
+        self.assertEqual(identity_pool.size(), 2)
@@ -1,12 +1,39 @@
+import copy
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import rdflib
+
 from rest_framework.authtoken.models import Token
 from rest_framework import status as http_status
+from rest_framework.test import APIClient
 
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import override_settings
 
+from api.models import OrderProjection, ValidationReport
+from api.semantics import Semantics, has_type
+from api.serializers import OrderInputSerializer
+from api.slp_interface import SlpInterface
 from api.status.order_status import OrderStatus
+from api.timing import ProcessRotatingFileHandler
 
 from api.tests.SLPTestCase import SLPTestCase
+import api.ontology as ontology
+import api.projection as projection
+import api.tests.testdata as testdata
+import api.validation_reports as validation_reports
 
 class OrderFlowTest(SLPTestCase):
     '''
@@ -140,8 +167,333 @@ class OrderFlowTest(SLPTestCase):
         # Check that the order status has properly mutated
         self.assertEqual(OrderStatus.get_status(order_asset_id), OrderStatus.REJECTED)
 
+    def testOrderConditionalGet(self):
+        '''
+        Test that unchanged orders are answered with 304 Not Modified,
+        and that a status change invalidates the ETag.
+        '''
+        # Set up user variables
+        alice = User.objects.get(username='alice')
+        alice_token = Token.objects.get(user=alice).key
+
+        order_asset_id = self.postOrder()
+
+        # As Alice
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+
+        for url in (reverse('order_detail', kwargs={'asset_id':order_asset_id}), reverse('order')):
+            # A full GET returns an ETag
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+            self.assertIn('ETag', response)
+            etag = response['ETag']
+
+            # Asking again with that ETag yields Not Modified
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, http_status.HTTP_304_NOT_MODIFIED)
+            print('Conditional GET on {} answered with 304'.format(url))
+
+        # Confirming the order changes its ETag
+        detail_url = reverse('order_detail', kwargs={'asset_id':order_asset_id})
+        etag = self.client.get(detail_url)['ETag']
+        self.confirmOrder(order_asset_id)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(response.data['metadata']['status'], OrderStatus.CONFIRMED)
+
+    def testOrderListETagFollowsListedOrders(self):
+        '''
+        Test that the order list ETag covers the orders listed by the
+        ledger, also those in which the user's keys are not participants
+        (e.g. held through a transfer), and that lists have no Last-Modified.
+        '''
+        alice = User.objects.get(username='alice')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=alice).key)
+        response = self.client.get(reverse('order'))
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+
+        # An order of other participants that the ledger listed for Alice
+        now = timezone.now()
+        held = OrderProjection.objects.create(asset_id='0' * 64, latest_tx_id='1' * 64,
+                                              customer='other', provider='other', modified=now, synced=now)
+        projection.mark_list_synced(alice, [held.asset_id])
+        etag = projection.order_list_etag(alice)
+        OrderProjection.objects.filter(pk=held.pk).update(latest_tx_id='2' * 64)
+        self.assertNotEqual(projection.order_list_etag(alice), etag)
+
+    def testOrderReadsDoNotWrite(self):
+        '''
+        Test that reading unchanged orders does not write the projection,
+        except to refresh its synced time once in a while, in one query.
+        '''
+        alice_token = Token.objects.get(user__username='alice').key
+        order_asset_ids = [self.postOrder(), self.postOrder()]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+        urls = [reverse('order'), reverse('order_detail', kwargs={'asset_id': order_asset_ids[0]})]
+
+        def projection_writes(url):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, http_status.HTTP_200_OK)
+            return [query['sql'] for query in queries
+                    if 'api_orderprojection' in query['sql'] and not query['sql'].startswith('SELECT')]
+
+        for url in urls:
+            self.assertEqual(projection_writes(url), [])
+
+        # Once the synced time is old, the list refreshes it in one query
+        OrderProjection.objects.filter(asset_id__in=order_asset_ids).update(
+            synced=timezone.now() - datetime.timedelta(seconds=200))
+        with override_settings(PROJECTION_MAX_AGE=300):
+            self.assertEqual(len(projection_writes(urls[0])), 1)
+            self.assertEqual(projection_writes(urls[0]), [])
+
+    def testOrderDetailFetchesOnce(self):
+        """
+        Test that the order detail view fetches the order and its
+        transactions exactly once each, and concurrently
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+
+        # Each fetch waits for the other one to start, which
+        # times out (and fails the view) if they run one after the other
+        both_started = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def recording(fetch):
+            def wrapper(slp, *args, **kwargs):
+                calls.append(fetch.__name__)
+                both_started.wait()
+                return fetch(slp, *args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(SlpInterface, 'get_publication', recording(SlpInterface.get_publication)), \
+                mock.patch.object(SlpInterface, 'get_transactions', recording(SlpInterface.get_transactions)):
+            response = self.client.get(reverse('order_detail', kwargs={'asset_id': order_asset_id}))
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(sorted(calls), ['get_publication', 'get_transactions'])
+        self.assertFalse(both_started.broken)
+
+    def testServerTiming(self):
+        """
+        Test that timed requests report where their time went
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        url = reverse('order_detail', kwargs={'asset_id': order_asset_id})
+
+        # Middleware is loaded per client, so use new ones
+        with override_settings(REQUEST_TIMING=True):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+            response = client.get(url)
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        timings = {entry.split(';')[0].strip() for entry in response['Server-Timing'].split(',')}
+        self.assertTrue({'slp', 'rdf_parse', 'db', 'total'} <= timings, timings)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+        self.assertNotIn('Server-Timing', client.get(url))
+
+    def testSlowRequestLog(self):
+        """
+        Test that slow requests are logged with their ledger calls
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        url = reverse('order_detail', kwargs={'asset_id': order_asset_id})
+
+        # Middleware is loaded per client, so use a new one
+        with override_settings(SLOW_REQUEST_THRESHOLD=1e-6), self.assertLogs('api.slow_requests') as logs:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+            response = client.get(url)
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'order_detail')
+        # Ledger calls run concurrently, so their order varies
+        call = {call['url']: call for call in record['slp_calls']}['GET /asset/{asset_id}/transactions/']
+        self.assertEqual(call['status'], 200)
+        self.assertGreater(call['bytes'], 0)
+        self.assertEqual(record['slp']['count'], len(record['slp_calls']))
+        self.assertGreater(record['rdf_parse']['count'], 0)
+        self.assertGreater(record['db']['count'], 0)
+
+    def testSlowRequestLogPerProcess(self):
+        """
+        Test that every process writes and rotates a slow request log of its own
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            handler = ProcessRotatingFileHandler(os.path.join(directory, 'slow.log'), maxBytes=100, backupCount=1)
+            try:
+                for i in range(3):
+                    handler.emit(logging.makeLogRecord({'msg': 'x' * 60}))
+            finally:
+                handler.close()
+            name = 'slow.{}.log'.format(os.getpid())
+            self.assertEqual(sorted(os.listdir(directory)), [name, name + '.1'])
+
+    def testDeadline(self):
+        """
+        Test that requests whose deadline passes are answered with 504
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+        with override_settings(REQUEST_DEADLINE=1e-9):
+            response = self.client.get(reverse('order_detail', kwargs={'asset_id': order_asset_id}))
+        self.assertEqual(response.status_code, http_status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def testMetrics(self):
+        """
+        Test that ledger calls and view latencies show up in /metrics, for admins only
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+        self.client.get(reverse('order_detail', kwargs={'asset_id': order_asset_id}))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, http_status.HTTP_403_FORBIDDEN)
+
+        admin_token = Token.objects.get(user__username='admin').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + admin_token)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('ftl_slp_request_duration_seconds_count{operation="get_transactions",status="200"}', body)
+        self.assertIn('ftl_http_request_duration_seconds_count{view="order_detail",method="GET",status="200"}', body)
+        self.assertIn('# TYPE ftl_cache_lookups_total counter', body)
+
+
+    def testProfiling(self):
+        """
+        Test that requests with the profiling header are profiled, and their profiles downloadable by admins
+        """
+        order_asset_id = self.postOrder()
+        alice_token = Token.objects.get(user__username='alice').key
+        admin_token = Token.objects.get(user__username='admin').key
+        url = reverse('order_detail', kwargs={'asset_id': order_asset_id})
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(PROFILING_DIR=directory, PROFILING_SECRET='secret'):
+            # Middleware is loaded per client, so use new ones
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+            self.assertNotIn('X-Profile-Id', client.get(url))
+            self.assertNotIn('X-Profile-Id', client.get(url, HTTP_X_PROFILE='wrong'))
+            response = client.get(url, HTTP_X_PROFILE='secret', HTTP_X_REQUEST_ID='req1')
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+            self.assertEqual(response['X-Profile-Id'], 'order_detail.req1.pstats')
+
+            detail = reverse('profile_detail', kwargs={'name': 'order_detail.req1.pstats'})
+            self.assertEqual(client.get(reverse('profile_list')).status_code, http_status.HTTP_403_FORBIDDEN)
+            client.credentials(HTTP_AUTHORIZATION='Token ' + admin_token)
+            profiles = client.get(reverse('profile_list')).data
+            self.assertEqual([(p['view'], p['request_id'], p['format']) for p in profiles],
+                             [('order_detail', 'req1', 'pstats')])
+            response = client.get(detail)
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+            self.assertIn(b'OrderViews.py', b''.join(response.streaming_content))
+
+    def testValidationReports(self):
+        """
+        Test that validation reports are cached per asset, and failures are not
+        """
+        order_asset_ids = [self.postOrder(), self.postOrder()]
+        asset_ids = order_asset_ids + ['missing']
+
+        requests = self.ledger.requests
+        results = dict(validation_reports.validate_many(asset_ids, workers=2))
+        self.assertEqual(self.ledger.requests - requests, 3)
+        self.assertEqual([results[asset_id] for asset_id in order_asset_ids], [True, True])
+        self.assertIsInstance(results['missing'], ValueError)
+        self.assertEqual(ValidationReport.objects.filter(asset_id__in=asset_ids).count(), 2)
+
+        # Cached reports cost no ledger call; the failed one is tried again
+        requests = self.ledger.requests
+        self.assertEqual(dict(validation_reports.validate_many(order_asset_ids)),
+                         {asset_id: True for asset_id in order_asset_ids})
+        self.assertEqual(self.ledger.requests, requests)
+        list(validation_reports.validate_many(['missing']))
+        self.assertEqual(self.ledger.requests, requests + 1)
+
+        requests = self.ledger.requests
+        list(validation_reports.validate_many(order_asset_ids, refresh=True))
+        self.assertEqual(self.ledger.requests, requests + 2)
+        self.assertEqual(ValidationReport.objects.filter(asset_id__in=asset_ids).count(), 2)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('audit_shapes', *asset_ids, stdout=stdout, stderr=stderr)
+        self.assertEqual([json.loads(line)['asset_id'] for line in stdout.getvalue().splitlines()], ['missing'])
+        self.assertIn('2 conforming', stderr.getvalue())
+
 class OrderFormattingTest(SLPTestCase):
     '''
     Test whether faulty Order data objects are correctly rejected.
     '''
-    pass
\ No newline at end of file
+
+    def invalidOrder(self):
+        order = copy.deepcopy(testdata.orders['valid'][0])
+        order['cargo']['cargo_type'] = 'Liquid'
+        return order
+
+    def testInvalidOrderRejected(self):
+        '''
+        Test that an order violating the order shape
+        is rejected before it is published.
+        '''
+        alice_token = Token.objects.get(user__username='alice').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+
+        response = self.client.post(reverse('order'), data={
+            'order': self.invalidOrder(),
+            'service_provider': 'bob'
+        }, format='json')
+        self.assertEqual(response.status_code, http_status.HTTP_400_BAD_REQUEST)
+        self.assertIn('typeOfCargo', response.data)
+
+    def testBulkValidation(self):
+        '''
+        Test that many orders can be validated in one call.
+        '''
+        alice_token = Token.objects.get(user__username='alice').key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + alice_token)
+
+        graphs = []
+        for order in (testdata.orders['valid'][0], self.invalidOrder()):
+            serializer = OrderInputSerializer(data=order)
+            self.assertTrue(serializer.is_valid())
+            graphs.append(Semantics().create_order(serializer.validated_data, returns='dict'))
+
+        response = self.client.post(reverse('validate'), data={
+            'shape': 'order_shape',
+            'graphs': graphs
+        }, format='json')
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertEqual([result['conforms'] for result in response.data], [True, False])
+
+    def testSubclassHasType(self):
+        """
+        Test that data typed with a subclass of Order
+        is recognised as an order, but not as an event.
+        """
+        scvl = Semantics.SCVL
+        onto = rdflib.Graph()
+        onto.add((scvl.ExpressOrder, rdflib.RDFS.subClassOf, scvl.UrgentOrder))
+        onto.add((scvl.UrgentOrder, rdflib.RDFS.subClassOf, scvl.Order))
+        ontology.reset(ontology.Ontology(onto))
+        self.addCleanup(ontology.reset)
+
+        serializer = OrderInputSerializer(data=testdata.orders['valid'][0])
+        self.assertTrue(serializer.is_valid())
+        g = Semantics().create_order(serializer.validated_data)
+        g.set((rdflib.URIRef(Semantics.NODE_ID), rdflib.RDF.type, scvl.ExpressOrder))
+        order = json.loads(g.serialize(format='json-ld', context=Semantics.context))
+
+        self.assertTrue(has_type(scvl.Order, {'rdf': order}))
+        self.assertTrue(has_type(scvl.UrgentOrder, {'rdf': order}))
+        self.assertFalse(has_type(scvl.Event, {'rdf': order}))
+
@@ -0,0 +1,75 @@
+from io import StringIO
+import json
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from api.models import OrderProjection
+from api.tests.SLPTestCase import SLPTestCase
+import api.slp_helpers as slp_helpers
+
+# An asset ID that was never written to the ledger
+UNKNOWN_ASSET_ID = '0' * 64
+
+class ReconcileProjectionTest(SLPTestCase):
+    '''
+    Test that the reconcile command compares the order projection
+    with the ledger, and only repairs it when asked to.
+    '''
+
+    def reconcile(self, *args):
+        """
+        Run the projection check of reconcile with @args,
+        and return the reported differences by asset ID.
+        """
+        output = StringIO()
+        call_command('reconcile', '--check', 'projection', *args, stdout=output, stderr=StringIO())
+        differences = [json.loads(line) for line in output.getvalue().splitlines()]
+        return {difference['id']: difference for difference in differences}
+
+    def setUpOrders(self):
+        """
+        Post a consistent and a stale order, and project a missing one.
+        Returns their asset IDs and the latest transaction of the stale order.
+        """
+        consistent = self.postOrder()
+        stale = self.postOrder()
+        latest_tx_id = slp_helpers.get_transactions(stale, sort=True)[-1]['id']
+        OrderProjection.objects.filter(asset_id=stale).update(latest_tx_id='1' * 64)
+        now = timezone.now()
+        OrderProjection.objects.create(asset_id=UNKNOWN_ASSET_ID, latest_tx_id='2' * 64,
+                                       modified=now, synced=now)
+        return consistent, stale, latest_tx_id
+
+    def testReport(self):
+        """
+        Test that without --repair, differences are reported
+        and the projection is left alone.
+        """
+        consistent, stale, latest_tx_id = self.setUpOrders()
+
+        differences = self.reconcile()
+        self.assertNotIn(consistent, differences)
+        self.assertEqual(differences[stale]['kind'], 'stale')
+        self.assertEqual(differences[stale]['ledger']['latest_tx_id'], latest_tx_id)
+        self.assertFalse(differences[stale]['repaired'])
+        self.assertEqual(differences[UNKNOWN_ASSET_ID]['kind'], 'missing')
+        self.assertEqual(OrderProjection.objects.get(asset_id=stale).latest_tx_id, '1' * 64)
+        print('Reconcile reported a stale and a missing order')
+
+    def testRepair(self):
+        """
+        Test that --repair updates stale projections, leaves missing
+        orders in place, and that a second run finds only those.
+        """
+        consistent, stale, latest_tx_id = self.setUpOrders()
+
+        differences = self.reconcile('--repair')
+        self.assertNotIn(consistent, differences)
+        self.assertTrue(differences[stale]['repaired'])
+        self.assertFalse(differences[UNKNOWN_ASSET_ID]['repaired'])
+        self.assertEqual(OrderProjection.objects.get(asset_id=stale).latest_tx_id, latest_tx_id)
+        self.assertTrue(OrderProjection.objects.filter(asset_id=UNKNOWN_ASSET_ID).exists())
+
+        self.assertEqual(list(self.reconcile('--repair')), [UNKNOWN_ASSET_ID])
+        print('Reconcile repaired the stale order')
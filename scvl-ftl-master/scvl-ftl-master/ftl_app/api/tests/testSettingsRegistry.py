@@ -0,0 +1,38 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from api.models import Setting
+from api.settings_registry import SettingsRegistry
+from api.tests.SLPTestCase import SLPTestCase
+
+@override_settings(SETTINGS_VERSION_CHECK_INTERVAL=0)
+class SettingsRegistryTest(SLPTestCase):
+    '''
+    Test that changed settings are reloaded in every process.
+    '''
+
+    def testChangeAcrossProcesses(self):
+        """
+        Test that a change made in another process is seen,
+        and that a load that raced with an invalidation is not kept.
+        """
+        # Registries of two processes, sharing the Django cache
+        this, other = SettingsRegistry(), SettingsRegistry()
+        order_shape = this.get('order_shape')
+
+        Setting.objects.filter(setting='order_shape').update(value='changed')
+        other.invalidate()
+        self.assertEqual(this.get('order_shape'), 'changed')
+
+        load = this._load
+        def racing_load():
+            values = load()
+            this.invalidate()
+            return values
+        Setting.objects.filter(setting='order_shape').update(value=order_shape)
+        with mock.patch.object(this, '_load', side_effect=racing_load):
+            this.invalidate()
+            this.get('order_shape')
+        self.assertIsNone(this._values)
+        self.assertEqual(this.get('order_shape'), order_shape)
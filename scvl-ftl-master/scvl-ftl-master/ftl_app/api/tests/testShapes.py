@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import os
+import threading
+
+import rdflib
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from api.circuit_breaker import CircuitBreaker
+from api.models import Publication, PublishedShape
+from api.semantics import Semantics
+from api.tests.SLPTestCase import SLPTestCase
+import api.management.commands.set_shacl as set_shacl
+import api.settings_registry as settings_registry
+import api.shacl as shacl
+import api.slp_helpers as slp_helpers
+import api.slp_interface as slp_interface
+
+# A ledger that cannot be reached: nothing listens on the discard port
+UNREACHABLE = {'SLP_URL': 'http://127.0.0.1:9', 'SLP_TOKEN': 'fake'}
+
+class ShapePublicationTest(SLPTestCase):
+    '''
+    Test that set_shacl publishes shapes once per ledger,
+    and that they are fetched from the ledger for local validation.
+    '''
+
+    def setShacl(self, **options):
+        """
+        Run set_shacl without the shapes this process remembers publishing,
+        and return the number of shapes it published.
+        """
+        publications = Publication.objects.count()
+        with mock.patch.dict(set_shacl.published, clear=True):
+            call_command('set_shacl', admin_username='admin', **options)
+        return Publication.objects.count() - publications
+
+    def testUnchangedShapesNotPublished(self):
+        """
+        Test that unchanged shapes are only published again to another ledger
+        """
+        self.assertEqual(self.setShacl(force=True), 2)
+        self.assertEqual(self.setShacl(), 0)
+
+        # As if SLP_URL pointed at another ledger before
+        PublishedShape.objects.update(ledger_url='http://other-ledger')
+        self.assertEqual(self.setShacl(), 2)
+        self.assertEqual(self.setShacl(), 0)
+
+    def testLedgerUnreachableWhilePublishing(self):
+        """
+        Test that set_shacl fails with a clear error, and leaves the settings alone,
+        when the ledger cannot be reached
+        """
+        order_shape = settings_registry.get('order_shape')
+        with mock.patch.dict(os.environ, UNREACHABLE), mock.patch.object(slp_interface, 'breaker', CircuitBreaker()), \
+                self.assertRaisesRegex(CommandError, 'Failed to publish shape'):
+            self.setShacl(force=True)
+        self.assertEqual(settings_registry.get('order_shape'), order_shape)
+
+    def testFailedFetchNotCached(self):
+        """
+        Test that a shape that could not be fetched from the ledger is fetched again
+        """
+        asset_id = settings_registry.get('order_shape')
+        get_asset = slp_helpers.get_asset
+        with mock.patch.dict(shacl._validators, clear=True):
+            with mock.patch.object(slp_helpers, 'get_asset', side_effect=ValueError("Ledger down")):
+                # Falls back to the bundled shape file
+                self.assertIsNotNone(shacl.validator_for('order_shape'))
+            self.assertNotIn(asset_id, shacl._validators)
+
+            with mock.patch.object(slp_helpers, 'get_asset', side_effect=get_asset) as fetch:
+                validator = shacl.validator_for('order_shape')
+                self.assertIs(shacl.validator_for('order_shape'), validator)
+            self.assertEqual(fetch.call_count, 1)
+            self.assertIs(shacl._validators[asset_id], validator)
+
+    def testLedgerUnreachable(self):
+        """
+        Test that the bundled shape is used, and not cached, while the ledger cannot be reached
+        """
+        asset_id = settings_registry.get('order_shape')
+        with mock.patch.dict(shacl._validators, clear=True), mock.patch.dict(os.environ, UNREACHABLE), \
+                mock.patch.object(slp_interface, 'breaker', CircuitBreaker()):
+            validator = shacl.validator_for('order_shape')
+            self.assertIsNotNone(validator)
+            self.assertNotIn(asset_id, shacl._validators)
+            # An order without any of its required properties
+            order = rdflib.Graph()
+            order.add((rdflib.URIRef('http://example.org/order'), rdflib.RDF.type, Semantics().SCVL.Order))
+            self.assertTrue(shacl.validate('order_shape', order))
+
+    def testFetchOutsideLock(self):
+        """
+        Test that a slow shape fetch only holds up validations against that shape,
+        which share its ledger call
+        """
+        order_shape = settings_registry.get('order_shape')
+        get_asset = slp_helpers.get_asset
+        release = threading.Event()
+        def slow_get_asset(asset_id):
+            if asset_id == order_shape:
+                release.wait(5)
+            return get_asset(asset_id)
+
+        with mock.patch.dict(shacl._validators, clear=True), \
+                mock.patch.object(slp_helpers, 'get_asset', side_effect=slow_get_asset) as fetch:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                orders = [executor.submit(shacl.validator_for, 'order_shape') for _ in range(2)]
+                # Not held up by the order shape
+                self.assertIsNotNone(shacl.validator_for('event_shape'))
+                self.assertFalse(any(order.done() for order in orders))
+                release.set()
+                self.assertIs(orders[0].result(), orders[1].result())
+            self.assertEqual([call[0][0] for call in fetch.call_args_list].count(order_shape), 1)
@@ -0,0 +1,65 @@
+from rest_framework.authtoken.models import Token
+from rest_framework import status as http_status
+
+from django.test import override_settings
+from django.urls import reverse
+
+from api.authentication import TokenCache, token_cache
+from api.tests.SLPTestCase import SLPTestCase
+
+class TokenCacheTest(SLPTestCase):
+    '''
+    Test that cached tokens stop working
+    as soon as they are rotated.
+    '''
+
+    def testTokenRotation(self):
+        """
+        Test that repeated calls with a token are served from the cache,
+        and that the old token is rejected after rotating it.
+        """
+        old_token = Token.objects.get(user__username='alice')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + old_token.key)
+
+        hits = token_cache.stats()['hits']
+        for _ in range(3):
+            response = self.client.get(reverse('slp_list'))
+            self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        self.assertGreaterEqual(token_cache.stats()['hits'], hits + 2)
+
+        # Rotate the token
+        response = self.client.put(reverse('create_token'), data={
+            'username': 'alice',
+            'password': 'halloalice'
+        })
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        new_token = response.data['token']
+        self.assertNotEqual(new_token, old_token.key)
+
+        # The old token is no longer accepted, the new one is
+        response = self.client.get(reverse('slp_list'))
+        self.assertIn(response.status_code, (http_status.HTTP_401_UNAUTHORIZED, http_status.HTTP_403_FORBIDDEN))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + new_token)
+        response = self.client.get(reverse('slp_list'))
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+
+    @override_settings(CACHE_VERSION_CHECK_INTERVAL=0)
+    def testInvalidationAcrossProcesses(self):
+        """
+        Test that invalidating a token reaches the caches of other processes,
+        and that a lookup that raced with an invalidation is not cached.
+        """
+        token = Token.objects.get(user__username='alice')
+        # Caches of two processes, sharing the Django cache
+        this, other = TokenCache(ttl=30), TokenCache(ttl=30)
+        other.get(token.key)
+        other.set(token.key, token.user, token, other.generation)
+        self.assertIsNotNone(other.get(token.key))
+
+        this.invalidate_key(token.key)
+        self.assertIsNone(other.get(token.key))
+
+        generation = this.generation
+        this.invalidate_user(token.user.pk)
+        this.set(token.key, token.user, token, generation)
+        self.assertIsNone(this.get(token.key))
@@ -0,0 +1,121 @@
+from unittest import mock
+
+from rest_framework.authtoken.models import Token
+from rest_framework import status as http_status
+
+from django.db import transaction
+from django.test import override_settings
+from django.urls import reverse
+
+from api.models import OrderChange, WebhookSubscription
+from api.status.order_status import OrderStatus
+from api.tests.SLPTestCase import SLPTestCase
+from api.tests.webhook_receiver import WebhookReceiver
+import api.projection as projection
+import api.webhooks as webhooks
+
+# The test receiver listens on localhost
+@override_settings(WEBHOOK_ALLOW_PRIVATE=True)
+class WebhookTest(SLPTestCase):
+    '''
+    Test that webhook subscriptions receive order changes.
+    '''
+
+    def subscribe(self, username, url):
+        """
+        Subscribe @url to the order changes of @username, posting a form.
+        """
+        user_token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+        response = self.client.post(reverse('webhook_list'), data={'url': url, 'secret': 'shh'})
+        self.assertEqual(response.status_code, http_status.HTTP_200_OK)
+        # Subscriptions are active unless asked otherwise
+        self.assertTrue(response.data['active'])
+        return response.data['id']
+
+    def testWebhookDelivery(self):
+        """
+        Test that creating and confirming an order notifies the customer's webhook,
+        also when the first delivery attempt fails.
+        """
+        with WebhookReceiver(fail_first=1) as receiver:
+            self.subscribe('alice', receiver.url)
+
+            # Notifications are queued once the change is committed
+            with self.captureOnCommitCallbacks(execute=True):
+                order_asset_id = self.postOrder()
+                self.confirmOrder(order_asset_id)
+
+            notifications = receiver.wait_for(2)
+            self.assertEqual([n['asset_id'] for n in notifications], [order_asset_id] * 2)
+            self.assertEqual([n['kind'] for n in notifications], [OrderChange.ORDER, OrderChange.STATUS])
+            self.assertEqual(notifications[-1]['status'], OrderStatus.CONFIRMED)
+            self.assertTrue(receiver.headers[0]['X-FTL-Signature'].startswith('sha256='))
+            print('Webhook received {} notifications'.format(len(notifications)))
+
+    def testRollback(self):
+        """
+        Test that changes rolled back with their transaction are not notified
+        """
+        order_asset_id = self.postOrder()
+        with WebhookReceiver() as receiver:
+            self.subscribe('alice', receiver.url)
+            with mock.patch.object(webhooks, 'notify') as notify, \
+                    self.captureOnCommitCallbacks(execute=True) as callbacks:
+                try:
+                    with transaction.atomic():
+                        projection.record(order_asset_id, 'rolled-back', kind=OrderChange.TRANSFER)
+                        raise RuntimeError()
+                except RuntimeError:
+                    pass
+            self.assertEqual(callbacks, [])
+            notify.assert_not_called()
+            self.assertFalse(OrderChange.objects.filter(tx_id='rolled-back').exists())
+
+    @override_settings(WEBHOOK_MAX_CONCURRENCY=4)
+    def testConcurrencyLimit(self):
+        """
+        Test that subscriptions cannot ask for more concurrent deliveries
+        than WEBHOOK_MAX_CONCURRENCY, and that the dispatcher caps them too
+        """
+        user_token = Token.objects.get(user__username='alice')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+        for max_concurrency in (0, 5, 32767):
+            response = self.client.post(reverse('webhook_list'), format='json',
+                                        data={'url': 'http://localhost/', 'max_concurrency': max_concurrency})
+            self.assertEqual(response.status_code, http_status.HTTP_400_BAD_REQUEST, max_concurrency)
+            self.assertIn('max_concurrency', response.data)
+
+        endpoint = webhooks.Endpoint(1, 'http://localhost/', '', 32767)
+        self.assertEqual(endpoint.max_concurrency, 4)
+        endpoint.update('http://localhost/', '', 0)
+        self.assertEqual(endpoint.max_concurrency, 1)
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE=False)
+    def testPrivateUrls(self):
+        """
+        Test that webhooks cannot point at loopback, private or non-http URLs,
+        neither when subscribing nor at delivery
+        """
+        user_token = Token.objects.get(user__username='alice')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + user_token.key)
+        for url in ('http://127.0.0.1:8000/', 'http://localhost/', 'http://169.254.169.254/latest/',
+                    'http://10.0.0.1/', 'http://[::1]/', 'http://[::ffff:192.168.0.1]/', 'ftp://93.184.216.34/'):
+            response = self.client.post(reverse('webhook_list'), data={'url': url}, format='json')
+            self.assertEqual(response.status_code, http_status.HTTP_400_BAD_REQUEST, url)
+            self.assertIn('url', response.data)
+        self.assertFalse(WebhookSubscription.objects.filter(user__username='alice').exists())
+
+        with WebhookReceiver() as receiver:
+            dispatcher = webhooks.Dispatcher()
+            with mock.patch.object(dispatcher._session, 'post') as post:
+                dispatcher._deliver(1, receiver.url, '', [{}])
+            post.assert_not_called()
+            self.assertEqual(dispatcher._queue.get_nowait(), ('done', 1, [{}], False))
+
+            # A host that resolves to a public address when checked,
+            # but to a private one when connecting, is refused as well
+            with mock.patch.object(webhooks, 'check_url'):
+                dispatcher._deliver(2, receiver.url, '', [{}])
+            self.assertEqual(dispatcher._queue.get_nowait(), ('done', 2, [{}], False))
+            self.assertEqual(receiver.deliveries, [])
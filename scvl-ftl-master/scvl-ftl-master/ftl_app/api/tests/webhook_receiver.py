@@ -0,0 +1,88 @@
+"""
+A local HTTP server that receives webhook deliveries during tests.
+
+Usage:
+    with WebhookReceiver() as receiver:
+        # subscribe receiver.url, trigger some changes...
+        notifications = receiver.wait_for(2)
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import json
+import threading
+import time
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookReceiver(object):
+    """
+    Collects the notifications POSTed to it.
+
+    @fail_first makes the receiver answer HTTP 500 to
+    that many deliveries, to exercise retries.
+    """
+
+    def __init__(self, fail_first=0):
+        self.deliveries = []
+        self.headers = []
+        self.fail_first = fail_first
+        self._condition = threading.Condition()
+
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with receiver._condition:
+                    if receiver.fail_first > 0:
+                        receiver.fail_first -= 1
+                        status = 500
+                    else:
+                        receiver.deliveries.append(json.loads(body.decode()))
+                        receiver.headers.append(dict(self.headers))
+                        receiver._condition.notify_all()
+                        status = 200
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/hook'.format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def notifications(self):
+        with self._condition:
+            return [n for delivery in self.deliveries for n in delivery['notifications']]
+
+    def wait_for(self, count, timeout=10):
+        """
+        Wait until @count notifications were received and return them all.
+        """
+        end = time.monotonic() + timeout
+        with self._condition:
+            while len([n for d in self.deliveries for n in d['notifications']]) < count:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return self.notifications
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,299 @@
+"""
+A module that breaks the time of a request down by where it was spent.
+
+When an order call was slow, there was no telling whether the time went
+to ledger calls, to rdflib parsing and serializing RDF, or to the
+database. With REQUEST_TIMING on, TimingMiddleware gives every request
+a Timer, and the instrumented code records spans in it:
+- 'slp' for every ledger call made through SlpInterface._request
+- 'slp_wait' for the wait for a slot of the concurrency limiter
+- 'rdf_parse' and 'rdf_serialize' for Semantics
+- 'db' for every database query of the request thread
+
+Spans are summed per name, and reported in a Server-Timing response
+header, which browser developer tools display, and in a structured log
+line (logger 'api.timing', one JSON object per request).
+
+Work that a request hands to a worker thread is attributed to it when
+the function is wrapped with bind(); slp_helpers.submit and bounded_map
+do so.
+
+With SLOW_REQUEST_THRESHOLD set, requests are timed without reporting,
+and only those that take longer than the threshold are logged (logger
+'api.slow_requests', written to the rotating file SLOW_REQUEST_LOG),
+with every ledger call, its endpoint, status, duration and response size.
+Every process writes and rotates a file of its own, with its pid in the
+name (see ProcessRotatingFileHandler), since processes that share one
+rotating file lose or mix up records when they rotate it.
+With both settings off, the middleware is not installed, no Timer
+exists, and every hook is a single thread-local lookup.
+"""
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('api.slow_requests')
+
+# Individual spans kept per request, on top of the totals per name
+MAX_DETAILS = 200
+
+_local = threading.local()
+
+
+class ProcessRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that writes to a file per process, named after
+    @filename with the pid before the extension (slow_requests.log
+    becomes slow_requests.1234.log). The file is opened on the first
+    record, and again in processes forked after that.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        kwargs['delay'] = True
+        super().__init__(filename, *args, **kwargs)
+        self.template = self.baseFilename
+        self.pid = None
+
+    def emit(self, record):
+        # Called with the handler's lock held
+        pid = os.getpid()
+        if pid != self.pid:
+            if self.stream is not None:
+                # Inherited from the parent process
+                self.stream.close()
+                self.stream = None
+            root, extension = os.path.splitext(self.template)
+            self.baseFilename = '{}.{}{}'.format(root, pid, extension)
+            self.pid = pid
+        super().emit(record)
+
+
+class Timer(object):
+    """
+    The spans recorded during one request. Thread-safe, as a request
+    may record spans from several worker threads at once.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # name: [count, total seconds]
+        self.totals = {}
+        # (name, detail, start offset, duration) of spans recorded with a detail
+        self.details = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, detail=None):
+        """
+        Record a span @name that started at perf_counter() value @start
+        and took @duration seconds. @detail, e.g. the ledger operation,
+        is kept with the individual span.
+        """
+        with self._lock:
+            total = self.totals.get(name)
+            if total is None:
+                self.totals[name] = [1, duration]
+            else:
+                total[0] += 1
+                total[1] += duration
+            if detail is not None and len(self.details) < MAX_DETAILS:
+                self.details.append((name, detail, start - self.started, duration))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # For connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record('db', start, time.perf_counter() - start)
+
+    def server_timing(self, total):
+        """
+        Return the value of a Server-Timing header, with the totals
+        per span and @total seconds for the whole request.
+        """
+        entries = []
+        for name, (count, duration) in sorted(self.totals.items()):
+            entries.append('{};dur={:.1f};desc="{} calls"'.format(name, duration * 1000, count))
+        entries.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(entries)
+
+    def summary(self):
+        return {name: {'count': count, 'ms': round(duration * 1000, 2)}
+                for name, (count, duration) in self.totals.items()}
+
+
+def current():
+    """
+    Return the Timer of the request being handled by this thread, or None.
+    """
+    return getattr(_local, 'timer', None)
+
+
+class _Activate(object):
+    # Context manager that makes @timer current in this thread
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.previous = current()
+        _local.timer = self.timer
+        return self.timer
+
+    def __exit__(self, *exc_info):
+        _local.timer = self.previous
+
+
+def activate(timer):
+    return _Activate(timer)
+
+
+class span(object):
+    """
+    Context manager that records the time spent in its block as span
+    @name of the current request, if it is being timed.
+    """
+
+    def __init__(self, name, detail=None):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.timer = current()
+        if self.timer is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.record(self.name, self.start, time.perf_counter() - self.start, self.detail)
+
+
+def timed(name):
+    """
+    Decorator that records every call of the function as span @name.
+    For generator functions, the time spent producing items is recorded.
+    """
+    def decorate(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                iterator = fn(*args, **kwargs)
+                while True:
+                    with span(name):
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                    yield item
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timer = current()
+            if timer is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timer.record(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def bind(fn):
+    """
+    Return @fn such that, when called in another thread, its spans are
+    recorded for the request of the calling thread.
+    """
+    timer = current()
+    if timer is None:
+        return fn
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        with activate(timer):
+            return fn(*args, **kwargs)
+    return bound
+
+
+def slow_request_record(request, response, timer, total):
+    """
+    Return the slow request log record of @request, which took @total seconds.
+    """
+    # Imported here, as slp_interface itself records spans
+    from api.slp_interface import URL_TEMPLATES
+
+    calls = []
+    for name, detail, start, duration in timer.details:
+        if name != 'slp':
+            continue
+        operation, status, size = detail
+        calls.append({
+            'operation': operation,
+            'url': URL_TEMPLATES.get(operation, operation),
+            'status': status,
+            'bytes': size,
+            'start_ms': round(start * 1000, 2),
+            'ms': round(duration * 1000, 2),
+        })
+    match = getattr(request, 'resolver_match', None)
+    summary = timer.summary()
+    return {
+        'view': (match.url_name or match.view_name) if match is not None else None,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'ms': round(total * 1000, 2),
+        # Only the first MAX_DETAILS spans are kept, see 'slp' for the total
+        'slp_calls': calls,
+        'slp': summary.get('slp', {'count': 0, 'ms': 0}),
+        'rdf_parse': summary.get('rdf_parse', {'count': 0, 'ms': 0}),
+        'db': summary.get('db', {'count': 0, 'ms': 0}),
+        'spans': summary,
+    }
+
+
+class TimingMiddleware(object):
+    """
+    Times every request, see the module documentation.
+    Only installed when the REQUEST_TIMING or SLOW_REQUEST_THRESHOLD setting is on.
+    """
+
+    def __init__(self, get_response):
+        self.report = getattr(settings, 'REQUEST_TIMING', False)
+        self.threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', None)
+        if not self.report and not self.threshold:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = Timer()
+        with activate(timer), connection.execute_wrapper(timer.execute_wrapper):
+            response = self.get_response(request)
+        total = timer.elapsed()
+        if self.report:
+            response['Server-Timing'] = timer.server_timing(total)
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'ms': round(total * 1000, 2),
+                'spans': timer.summary(),
+            }, sort_keys=True))
+        if self.threshold and total >= self.threshold:
+            slow_logger.warning(json.dumps(slow_request_record(request, response, timer, total), sort_keys=True))
+        return response
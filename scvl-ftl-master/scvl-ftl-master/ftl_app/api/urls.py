@@ -10,7 +10,8 @@ from .views import SlpIdViews
 from .views import AddressbookViews
 from .views import PublicationViews
 from .views import TokenViews
-from .views import AssetViews, OrderViews, EventViews
+from .views import AssetViews, OrderViews, EventViews, ChangeViews, WebhookViews, ValidationViews
+from .views import ProfileViews
 
 from .standards import RegexPatterns as Pattern
 
@@ -53,5 +54,12 @@ urlpatterns = [
     re_path(r'^orders/?$', OrderViews.OrderView.as_view(), name="order"),
     re_path(r'^orders/(?P<asset_id>{})/?$'.format(Pattern.assetID),
         OrderViews.OrderDetailView.as_view(), name="order_detail"),
-    re_path(r'^events/?$', EventViews.EventView.as_view(), name="event")
+    re_path(r'^events/?$', EventViews.EventView.as_view(), name="event"),
+    re_path(r'^changes/?$', ChangeViews.ChangeFeedView.as_view(), name="changes"),
+    re_path(r'^changes/stream/?$', ChangeViews.ChangeStreamView.as_view(), name="change_stream"),
+    re_path(r'^webhooks/?$', WebhookViews.WebhookList.as_view(), name="webhook_list"),
+    re_path(r'^webhooks/(?P<webhook_id>[0-9]+)/?$', WebhookViews.WebhookDetail.as_view(), name="webhook_detail"),
+    re_path(r'^validate/?$', ValidationViews.ValidationView.as_view(), name="validate"),
+    re_path(r'^profiles/?$', ProfileViews.ProfileList.as_view(), name="profile_list"),
+    re_path(r'^profiles/(?P<name>[A-Za-z0-9_.-]+)/?$', ProfileViews.ProfileDetail.as_view(), name="profile_detail")
 ]
@@ -0,0 +1,95 @@
+"""
+A module that caches the ledger's SHACL validation of assets.
+
+SlpInterface.validate_publication asks the ledger to validate an asset
+against its shapes on every call. The ledger always validates against the
+shapes the asset was published with, and since both the asset and those
+shapes are immutable, the outcome never changes. It is therefore stored
+in the ValidationReport table, keyed by asset_id alone; a new order_shape
+setting only affects assets published after it.
+
+validate_many validates a batch of assets, calling the ledger concurrently
+for those that have no report yet, which makes audits over all orders
+(see `manage.py audit_shapes`) cheap after the first run.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+
+from django.conf import settings
+
+from api.models import ValidationReport
+from api.slp_interface import SlpInterface
+import api.slp_helpers as slp_helpers
+
+
+def _result(conforms, violations):
+    # Same format as SlpInterface.validate_publication
+    return True if conforms else violations
+
+def _fetch(asset_id):
+    """
+    Ask the ledger to validate @asset_id.
+    Returns a (conforms, violations) pair.
+    """
+    slp_interface = SlpInterface(
+        os.getenv('SLP_URL'),
+        os.getenv('SLP_TOKEN')
+    )
+    result = slp_interface.validate_publication(asset_id)
+    if result is True:
+        return True, []
+    return False, result
+
+def validate_many(asset_ids, workers=None, refresh=False):
+    """
+    Validate every asset in the iterable @asset_ids.
+
+    Yields (asset_id, result) pairs, where the result is True if the
+    asset conforms, the list of non-conforming shape reports otherwise
+    (as for SlpInterface.validate_publication), or the exception raised
+    for that asset.
+    Cached reports are looked up in chunks; the others are validated
+    on @workers concurrent ledger calls and stored in bulk.
+    Use @refresh to ignore (and replace) cached reports.
+    """
+    workers = workers or settings.SLP_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in _chunks(asset_ids, 500):
+            cached = {}
+            if refresh:
+                ValidationReport.objects.filter(asset_id__in=chunk).delete()
+            else:
+                for asset_id, conforms, violations in ValidationReport.objects.filter(
+                        asset_id__in=chunk
+                ).values_list('asset_id', 'conforms', 'violations'):
+                    cached[asset_id] = _result(conforms, json.loads(violations))
+            for asset_id in chunk:
+                if asset_id in cached:
+                    yield asset_id, cached[asset_id]
+
+            missing = [asset_id for asset_id in chunk if asset_id not in cached]
+            reports = []
+            for asset_id, future in slp_helpers.bounded_map(_fetch, missing, executor, 4 * workers):
+                try:
+                    conforms, violations = future.result()
+                except Exception as e:
+                    yield asset_id, e
+                    continue
+                reports.append(ValidationReport(
+                    asset_id=asset_id,
+                    conforms=conforms,
+                    violations=json.dumps(violations)
+                ))
+                yield asset_id, _result(conforms, violations)
+            ValidationReport.objects.bulk_create(reports, ignore_conflicts=True)
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,10 +1,11 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status as http_status
 from django.http import Http404
 
+from api.authentication import CachedTokenAuthentication
 from api.models import AddressBook
 from api.serializers import AddressBookSerializer
 from api.openapi import AddressSchema
@@ -15,7 +16,7 @@ class AddressbookList(APIView):
     List all address book entries or create a new entry
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     schema = AddressSchema()
@@ -37,7 +38,7 @@ class AddressbookDetail(APIView):
     """
     Retrieve, update or delete an addressbook entry
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     schema = AddressSchema()
@@ -1,4 +1,4 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -6,10 +6,13 @@ from rest_framework import status as http_status
 from rest_framework.serializers import ValidationError
 import os
 
+from api.authentication import CachedTokenAuthentication
 from api.serializers import TransferAssetSerializer
 from api.models import Publication, SlpId, AddressBook
 from api.slp_interface import SlpInterface
 from api.openapi import TransferSchema
+import api.identity as identity
+import api.projection as projection
 
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -19,7 +22,7 @@ class MyAssets(APIView):
     Overview of personal assets
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
@@ -28,10 +31,7 @@ class MyAssets(APIView):
             os.getenv('SLP_TOKEN')
         )
 
-        try:
-            slp_ids = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')
-        except ObjectDoesNotExist:
-            return Response("User ID does not exist", status=http_status.HTTP_404_NOT_FOUND)
+        slp_ids = identity.active_ids(request.user)
 
         all_assets = {}
 
@@ -50,7 +50,7 @@ class TransferAsset(APIView):
     Transfer asset to other person
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     schema = TransferSchema()
@@ -64,13 +64,13 @@ class TransferAsset(APIView):
 
         if 'slp_id' in serializer.validated_data:
             try:
-                slp_id = SlpId.objects.get(user=request.user, active=True, slp_id=serializer.validated_data["slp_id"])
+                slp_id = identity.get_id(request.user, serializer.validated_data["slp_id"])
             except ObjectDoesNotExist:
                 return Response("Provided Ledger-ID does not exist or is not active", status=http_status.HTTP_404_NOT_FOUND)
         else:
             try:
                 # get most recent, active, slp-id
-                slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
+                slp_id = identity.default_id(request.user)
             except ObjectDoesNotExist:
                 return Response("User ID does not exist", status=http_status.HTTP_404_NOT_FOUND)
 
@@ -105,4 +105,7 @@ class TransferAsset(APIView):
 
         publication.save()
 
+        # Feed the changes feed, in case an order was transferred
+        projection.record_transfer(serializer.validated_data['asset_id'], transfer)
+
         return Response(transfer, status=http_status.HTTP_200_OK)
@@ -0,0 +1,241 @@
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status as http_status
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from api.authentication import CachedTokenAuthentication
+from api.openapi import ChangeSchema
+import api.projection as projection
+
+import json
+import threading
+import time
+
+
+class WaitingSlots(object):
+    """
+    Counts the requests of this process that are waiting for changes.
+
+    Long-polling and streaming requests each hold a worker thread while
+    they wait, up to CHANGES_LONG_POLL_TIMEOUT or CHANGES_STREAM_DURATION
+    seconds: the broker saves CPU time, not threads. Above
+    CHANGES_MAX_WAITING of them, further waits are refused with 503 and
+    Retry-After, so that waiting clients cannot take every thread away
+    from other requests. Deployments need more threads than that per
+    process, e.g. gunicorn --worker-class gthread --threads 50.
+    """
+
+    def __init__(self):
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Return a release function for a new waiting request,
+        or None if there are too many already.
+        """
+        with self._lock:
+            if self.waiting >= settings.CHANGES_MAX_WAITING:
+                return None
+            self.waiting += 1
+        released = []
+
+        def release():
+            with self._lock:
+                if not released:
+                    released.append(True)
+                    self.waiting -= 1
+        return release
+
+
+# Shared by all threads in this process
+waiting_slots = WaitingSlots()
+
+
+def too_many_waiting():
+    response = Response("Too many clients are waiting for changes, try again later",
+                        status=http_status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(settings.CHANGES_POLL_INTERVAL)
+    return response
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """
+    StreamingHttpResponse that frees its waiting slot when closed,
+    also when the stream was never iterated.
+    """
+
+    def __init__(self, streaming_content, release, **kwargs):
+        super().__init__(streaming_content, **kwargs)
+        self.release = release
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.release()
+
+
+def parse_feed_arguments(request, default_limit=100, max_limit=1000):
+    """
+    Read the cursor and limit query arguments of a changes feed call.
+    Returns a (cursor, limit) tuple, or raises ValueError.
+    """
+    cursor = int(request.GET.get('cursor', 0))
+    limit = int(request.GET.get('limit', default_limit))
+    if cursor < 0 or limit < 1:
+        raise ValueError("cursor must be non-negative and limit positive")
+    return cursor, min(limit, max_limit)
+
+
+class ChangeFeedView(APIView):
+    """
+    List the changes to a user's orders since a cursor.
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    schema = ChangeSchema()
+
+    def get(self, request):
+        """
+        Retrieve every change to the orders that a user takes part in
+        (new orders, status changes, events, transfers)
+        that happened after a cursor.
+
+        ?cursor=<int> The cursor returned by the previous call (default: 0, from the start)
+        ?limit=<int> The maximum number of changes to return (default: 100)
+
+        The return data contains the changes in chronological order,
+        and the cursor to pass on the next call. For example:
+        {'changes': [
+            {'cursor': <int>, 'asset_id': <asset_id>, 'tx_id': <tx_id>,
+             'kind': <ORDER|STATUS|EVENT|TRANSFER|SYNC>, 'status': <status:int>,
+             'timestamp': <iso datetime>},
+            ...
+         ],
+         'cursor': <int>,
+         'more': <bool: whether further changes can be retrieved right away>
+        }
+        """
+        try:
+            cursor, limit = parse_feed_arguments(request)
+        except ValueError as e:
+            return Response("Invalid query arguments: {}".format(e), status=http_status.HTTP_400_BAD_REQUEST)
+
+        changes, new_cursor, more = projection.changes_since(request.user, cursor, limit)
+        return Response({
+            'changes': changes,
+            'cursor': new_cursor,
+            'more': more,
+        }, status=http_status.HTTP_200_OK)
+
+
+def event_stream(user, cursor, limit):
+    """
+    Generate server-sent events for all changes to the orders of @user
+    after @cursor, for at most CHANGES_STREAM_DURATION seconds.
+    Clients are expected to reconnect afterwards (EventSource does so automatically).
+    """
+    end = time.monotonic() + settings.CHANGES_STREAM_DURATION
+    # Reconnect quickly once the stream ends
+    yield 'retry: 1000\n\n'
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        changes, cursor, more = projection.wait_for_changes(
+            user, cursor, limit,
+            timeout=min(remaining, settings.CHANGES_LONG_POLL_TIMEOUT),
+            poll_interval=settings.CHANGES_POLL_INTERVAL
+        )
+        if not changes:
+            # Comment line, keeps proxies from closing an idle connection
+            yield ': keepalive\n\n'
+        for change in changes:
+            yield 'id: {}\nevent: change\ndata: {}\n\n'.format(change['cursor'], json.dumps(change))
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets clients select the stream by sending 'Accept: text/event-stream'.
+    Only error responses are rendered by this class;
+    the stream itself is a StreamingHttpResponse.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return 'event: error\ndata: {}\n\n'.format(json.dumps(data)).encode(self.charset)
+
+
+class ChangeStreamView(APIView):
+    """
+    Wait for changes to a user's orders, by long-polling or as server-sent events.
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, EventStreamRenderer)
+
+    schema = ChangeSchema()
+
+    def get(self, request):
+        """
+        Push changes to the orders that a user takes part in as they happen,
+        e.g. status transitions caused by LOAD and DISCHARGE events.
+
+        With 'Accept: text/event-stream', the changes are streamed
+        as server-sent events ('event: change', one JSON change per event,
+        with the cursor as event id).
+
+        Otherwise, the call long-polls: it returns as soon as there are changes
+        after the cursor, or after the timeout with an empty list of changes.
+        The return format is that of the changes feed.
+
+        ?cursor=<int> The cursor returned by the previous call (default: 0, from the start)
+        ?limit=<int> The maximum number of changes to return (default: 100)
+        ?timeout=<int> The number of seconds to wait for changes (long-polling only)
+
+        Every waiting client holds a server thread, so when too many are
+        waiting, the call is answered with 503 and a Retry-After header.
+        """
+        try:
+            cursor, limit = parse_feed_arguments(request)
+            timeout = min(float(request.GET.get('timeout', settings.CHANGES_LONG_POLL_TIMEOUT)),
+                          settings.CHANGES_LONG_POLL_TIMEOUT)
+            # Reconnecting EventSource clients report the id of the last event they received
+            if 'HTTP_LAST_EVENT_ID' in request.META:
+                cursor = int(request.META['HTTP_LAST_EVENT_ID'])
+        except ValueError as e:
+            return Response("Invalid query arguments: {}".format(e), status=http_status.HTTP_400_BAD_REQUEST)
+
+        # Waiting holds this thread, see WaitingSlots
+        release = waiting_slots.reserve()
+        if release is None:
+            return too_many_waiting()
+
+        if request.accepted_renderer.format == EventStreamRenderer.format:
+            response = EventStreamResponse(event_stream(request.user, cursor, limit), release,
+                                           content_type=EventStreamRenderer.media_type)
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        try:
+            changes, new_cursor, more = projection.wait_for_changes(
+                request.user, cursor, limit,
+                timeout=max(timeout, 0),
+                poll_interval=settings.CHANGES_POLL_INTERVAL
+            )
+        finally:
+            release()
+        return Response({
+            'changes': changes,
+            'cursor': new_cursor,
+            'more': more,
+        }, status=http_status.HTTP_200_OK)
@@ -1,14 +1,20 @@
 from django.core.exceptions import ObjectDoesNotExist
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework import status as http_status
 
+from api.authentication import CachedTokenAuthentication
+from api.deadline import LedgerUnavailable
 import api.Logic as Logic
+import api.identity as identity
+import api.projection as projection
+import api.settings_registry as settings_registry
+import api.shacl as shacl
 from api.serializers import EventCallSerializer
-from api.models import AddressBook, Setting, SlpId
+from api.models import AddressBook, OrderChange, SlpId
 from api.slp_interface import SlpInterface
 import api.slp_helpers as slp_helpers
 from api.semantics import Semantics
@@ -97,7 +103,7 @@ class EventView(APIView):
     the data objects are relatively simple. Lists of events are
     retrieved in the context of a single order.
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     schema = EventSchema()
@@ -115,6 +121,24 @@ class EventView(APIView):
         # Retrieve order
         order_asset_id = serializer.validated_data['order_asset_id']
 
+        # Create semantics
+        event_rdf = Semantics().create_event(serializer.validated_data, returns='string')
+        # Since this will be a transfer, not a create, we already load the data as JSON here
+        # (for creates, this is done in the platform)
+        # TODO unify this..
+        event_rdf = json.loads(event_rdf)
+        # Get SHACL shape for the event
+        try:
+            event_shape_asset = settings_registry.get('event_shape')
+        except ObjectDoesNotExist:
+            return Response("event_shape setting not set", status=http_status.HTTP_404_NOT_FOUND)
+        # Reject events that do not conform to the shape
+        # before spending any ledger calls on them
+        violations = shacl.validate('event_shape', event_rdf)
+        if violations:
+            return Response("Event does not conform to event_shape: {}".format('; '.join(violations)),
+                status=http_status.HTTP_400_BAD_REQUEST)
+
         # Check basic logic
         logic_response = Logic.checkLogic([
             (Logic.asset_exists, [order_asset_id]),
@@ -136,6 +160,8 @@ class EventView(APIView):
         slp_interface = SlpInterface()
         try:
             order_asset = slp_interface.get_publication(order_asset_id)
+        except LedgerUnavailable:
+            raise
         except Exception as e:
             return Response("Error posting event: Could not retrieve order details: {}".format(e),
                 status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -147,34 +173,22 @@ class EventView(APIView):
             return Response ('Milestone logic failure: {}'.format(location_logic_message),
                 status=http_status.HTTP_400_BAD_REQUEST)
 
-        # Create semantics
-        event_rdf = Semantics().create_event(serializer.validated_data, returns='string')
-        # Since this will be a transfer, not a create, we already load the data as JSON here
-        # (for creates, this is done in the platform)
-        # TODO unify this..
-        event_rdf = json.loads(event_rdf)
-        # Get SHACL shape for the event
-        try:
-            event_shape_asset = Setting.objects.get(setting='event_shape')
-        except ObjectDoesNotExist:
-            return Response("event_shape setting not set", status=http_status.HTTP_404_NOT_FOUND)
         # Construct the payload to be sent to the ledger
         payload = {
             "data":{
                 "rdf":event_rdf,
-                "constraints":event_shape_asset.value
+                "constraints":event_shape_asset
             },
             "metadata":{}
         }
 
         # Decide if the process status should change,
         # based on the nature of the milestone
-        # TODO can we run this by EventMilestones.transitions ?
         new_status = None
-        if milestone == EventMilestones.LOAD:
-            new_status = OrderStatus.STARTED
-        elif milestone == EventMilestones.DISCHARGE:
-            new_status = OrderStatus.COMPLETED
+        if milestone in EventMilestones.transitions:
+            (old_status, target_status) = EventMilestones.transitions[milestone]
+            if target_status != old_status:
+                new_status = target_status
         # Add the new status to payload
         if new_status:
             payload["metadata"]["status"] = new_status
@@ -183,13 +197,13 @@ class EventView(APIView):
         # TODO can we put this code in viewutils?
         if 'slp_id' in serializer.validated_data:
             try:
-                slp_id = SlpId.objects.get(user=request.user, active=True, slp_id=serializer.validated_data["slp_id"])
+                slp_id = identity.get_id(request.user, serializer.validated_data["slp_id"])
             except SlpId.DoesNotExist:
                 return Response("Provided SLP ID does not exist or is not active", status=http_status.HTTP_404_NOT_FOUND)
         else:
             try:
                 # get most recent, active, slp-id
-                slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
+                slp_id = identity.default_id(request.user)
             except SlpId.DoesNotExist:
                 return Response("SLP ID does not exist", status=http_status.HTTP_404_NOT_FOUND)
 
@@ -205,8 +219,7 @@ class EventView(APIView):
         except ValueError as e:
             return Response("Could not publish: %s" % e, status=http_status.HTTP_400_BAD_REQUEST)
 
-
-
+        projection.record(order_asset_id, event_asset_id, status=new_status, kind=OrderChange.EVENT)
 
         return Response(event_asset_id, status=http_status.HTTP_200_OK)
 
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.views import APIView
+
+from api.authentication import CachedTokenAuthentication
+import api.metrics as metrics
+
+
+class MetricsView(APIView):
+    """
+    Serve the metrics of all worker processes in the Prometheus text format.
+    Admins only, unless METRICS_PUBLIC is set.
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    schema = None
+
+    def get_permissions(self):
+        if settings.METRICS_PUBLIC:
+            return [AllowAny()]
+        return [IsAdminUser()]
+
+    def get(self, request):
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,14 +1,20 @@
 from django.core.exceptions import ObjectDoesNotExist
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework import status as http_status
 
+from api.authentication import CachedTokenAuthentication
+from api.deadline import LedgerUnavailable
 import api.Logic as Logic
+import api.identity as identity
+import api.projection as projection
+import api.settings_registry as settings_registry
+import api.shacl as shacl
 from api.status.order_status import OrderStatus
-from api.models import AddressBook, Setting, SlpId
+from api.models import AddressBook, OrderChange, SlpId
 from api.openapi import OrderSchema
 from api.semantics import Semantics
 from api.serializers import RawPublicationSerializer, OrderCallSerializer
@@ -22,7 +28,7 @@ class OrderView(APIView):
     """
     Create an order or list a user's orders.
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     schema = OrderSchema()
@@ -56,26 +62,43 @@ class OrderView(APIView):
         # TODO handle users calling this endpoint without authentication
         # (they should probably be blocked and receive a neat Response)
 
-        try:
-            # Crucially, set history to True
-            orders = slp_helpers.all_assets(request.user, type=Semantics().SCVL.Order, history=True)
-        except Exception as e:
-            return Response('Could not retrieve orders:' + str(e), status=http_status.HTTP_400_BAD_REQUEST)
+        # If the client's copy is still current according to the
+        # local projection, answer without contacting the ledger.
+        etag = projection.order_list_etag(request.user, role, completed)
+        response = projection.not_modified(request, etag, None)
+        if response: return response
+
+        # Crucially, set history to True
+        # Orders are streamed from the ledger, so they are
+        # only held in memory once, in the response dictionary.
+        orders = slp_helpers.iter_assets(request.user, type=Semantics().SCVL.Order, history=True)
 
         # For each order asset, determine its current metadata
         orderdict = {}
-        for asset_id, asset_dict in orders.items():
-            status = OrderStatus.get_status(asset_id)
-            asset_dict["metadata"] = {
-                "status":status,
-                "roles":{
-                    "customer":"Undefined",
-                    "service-provider":"Undefined"
+        synced = []
+        try:
+            for asset_id, asset_dict in orders:
+                txs = slp_helpers.get_transactions(asset_id, sort=True)
+                status = OrderStatus.status_from_transactions(txs)
+                synced.append(projection.observe(asset_id, txs, status))
+                asset_dict["metadata"] = {
+                    "status":status,
+                    "roles":{
+                        "customer":"Undefined",
+                        "service-provider":"Undefined"
+                    }
                 }
-            }
-            orderdict[asset_id] = asset_dict
+                orderdict[asset_id] = asset_dict
+        except LedgerUnavailable:
+            raise
+        except Exception as e:
+            return Response('Could not retrieve orders:' + str(e), status=http_status.HTTP_400_BAD_REQUEST)
 
-        return Response(orderdict, status=http_status.HTTP_200_OK)
+        # Only orders that changed on the ledger are written
+        projection.sync_many(synced)
+        projection.mark_list_synced(request.user, orderdict)
+        etag = projection.order_list_etag(request.user, role, completed, check_fresh=False)
+        return projection.set_validators(Response(orderdict, status=http_status.HTTP_200_OK), etag, None)
 
     def post(self, request):
         # Serialize and validata the input data
@@ -88,13 +111,13 @@ class OrderView(APIView):
         # Determine SLP ID to use for posting
         if 'slp_id' in serializer.validated_data:
             try:
-                slp_id = SlpId.objects.get(user=request.user, active=True, slp_id=serializer.validated_data["slp_id"])
+                slp_id = identity.get_id(request.user, serializer.validated_data["slp_id"])
             except SlpId.DoesNotExist:
                 return Response("Provided SLP ID does not exist or is not active", status=http_status.HTTP_404_NOT_FOUND)
         else:
             try:
                 # get most recent, active, slp-id
-                slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
+                slp_id = identity.default_id(request.user)
             except SlpId.DoesNotExist:
                 return Response("SLP ID does not exist", status=http_status.HTTP_404_NOT_FOUND)
 
@@ -109,10 +132,17 @@ class OrderView(APIView):
             return Response('Unknown recipient', status=http_status.HTTP_404_NOT_FOUND)
 
         try:
-            publication_shape_asset = Setting.objects.get(setting='order_shape')
+            publication_shape_asset = settings_registry.get('order_shape')
         except ObjectDoesNotExist:
             return Response("order_shape setting not set", status=http_status.HTTP_404_NOT_FOUND)
 
+        # Reject orders that do not conform to the shape locally,
+        # instead of after a round trip to the ledger
+        violations = shacl.validate('order_shape', order_rdf)
+        if violations:
+            return Response("Order does not conform to order_shape: {}".format('; '.join(violations)),
+                status=http_status.HTTP_400_BAD_REQUEST)
+
         # Create interface to SLP
         slp_interface = SlpInterface(
             os.getenv('SLP_URL'),
@@ -125,12 +155,16 @@ class OrderView(APIView):
                 slp_id=slp_id.slp_id,
                 private_key=slp_id.private_key,
                 payload=order_rdf,
-                shape=publication_shape_asset.value,
+                shape=publication_shape_asset,
                 recipient=recipient,
             )
         except ValueError as e:
             return Response("Could not publish: %s" % e, status=http_status.HTTP_400_BAD_REQUEST)
 
+        # The asset ID is the ID of the CREATE transaction
+        projection.record(ledger_asset, ledger_asset, status=OrderStatus.TO_BE_CONFIRMED,
+                          customer=slp_id.public_key, provider=recipient, kind=OrderChange.ORDER)
+
         return Response(ledger_asset, status=http_status.HTTP_200_OK)
 
 
@@ -138,7 +172,7 @@ class OrderDetailView(APIView):
     """
     Confirm or reject an order, or view the details of a specific order.
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     # Even viewing orders should have restrictions on permission, so we use IsAuthenticated (not OrReadOnly)
     permission_classes = (IsAuthenticated,)
 
@@ -150,19 +184,31 @@ class OrderDetailView(APIView):
         Also retrieve all events that were posted in
         relation to the order.
         """
+        # If the client's copy is still current according to the
+        # local projection, answer without contacting the ledger.
+        etag, last_modified = projection.order_validators(asset_id)
+        response = projection.not_modified(request, etag, last_modified)
+        if response: return response
+
+        # Retrieve the order asset and its transactions concurrently.
+        # Everything else (logic checks, events, status)
+        # is derived from these two ledger calls.
+        order_future = slp_helpers.submit(slp_helpers.get_asset, asset_id)
+        txs_future = slp_helpers.submit(slp_helpers.get_transactions, asset_id, sort=True)
+
         # Check logic and return any response if the check fails
         logic_response = Logic.checkLogic([
-            (Logic.asset_exists, [asset_id]),
-            (Logic.asset_has_type, [asset_id, Semantics().SCVL.Order]),
+            (Logic.asset_fetched, [order_future]),
+            (Logic.fetched_asset_has_type, [order_future, Semantics().SCVL.Order]),
             # (Logic.asset_owned_by, [asset_id, request.user])
         ])
         if logic_response: return logic_response
 
         try:
-            # Retrieve order asset
-            order = slp_helpers.get_asset(asset_id)
+            order = order_future.result()
+            txs = txs_future.result()
             # Retrieve all events of user
-            event_txs = slp_helpers.get_transactions(asset_id, type=Semantics.SCVL.Event, sort=True)
+            event_txs = slp_helpers.filter_transactions(txs, type=Semantics.SCVL.Event)
             # Trim to only the event data
             event_data = []
             for event_tx in event_txs:
@@ -172,7 +218,10 @@ class OrderDetailView(APIView):
                 except (KeyError, TypeError) as e:
                     print("Warning: Cannot access event data from tx: {}".format(e))
             # Get order status
-            status = OrderStatus.get_status(asset_id)
+            status = OrderStatus.status_from_transactions(txs)
+            projection.sync(asset_id, txs, status)
+        except LedgerUnavailable:
+            raise
         except Exception as e:
             return Response("Error while retrieving assets: {}".format(e),
                             status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -188,8 +237,9 @@ class OrderDetailView(APIView):
                 }
             }
         }
-        return Response(data=responseDict,
-                        status=http_status.HTTP_200_OK)
+        etag, last_modified = projection.order_validators(asset_id)
+        return projection.set_validators(Response(data=responseDict, status=http_status.HTTP_200_OK),
+                                         etag, last_modified)
 
 
     def put(self, request, asset_id):
@@ -210,8 +260,8 @@ class OrderDetailView(APIView):
         # This allows the ledger to register an update,
         # and include metadata indicating the 'CONFIRM' status change.
         try:
-            user_slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
-            slp_helpers.transfer(
+            user_slp_id = identity.default_id(request.user)
+            tx_id = slp_helpers.transfer(
                 asset_id=asset_id,
                 slp_id=user_slp_id.slp_id,
                 private_key=user_slp_id.private_key,
@@ -220,9 +270,13 @@ class OrderDetailView(APIView):
                     'metadata':{'status':OrderStatus.CONFIRMED}
                 }
             )            
+        except LedgerUnavailable:
+            raise
         except Exception as e:
             return Response(str(e), status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        projection.record(asset_id, tx_id, status=OrderStatus.CONFIRMED, kind=OrderChange.STATUS)
+
         return Response('Order confirmed for asset ID {}'.format(asset_id), status=http_status.HTTP_200_OK)
 
     def delete(self, request, asset_id):
@@ -244,9 +298,9 @@ class OrderDetailView(APIView):
         try:
             # Set up variables for transfer
             prev_owner = slp_helpers.previousOwner(asset_id)
-            user_slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
+            user_slp_id = identity.default_id(request.user)
             
-            slp_helpers.transfer(
+            tx_id = slp_helpers.transfer(
                 asset_id=asset_id,
                 slp_id=user_slp_id.slp_id,
                 private_key=user_slp_id.private_key,
@@ -255,7 +309,11 @@ class OrderDetailView(APIView):
                     'metadata':{'status':OrderStatus.REJECTED}
                 }
             )
+        except LedgerUnavailable:
+            raise
         except Exception as e:
             return Response(str(e), status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        projection.record(asset_id, tx_id, status=OrderStatus.REJECTED, kind=OrderChange.STATUS)
         
         return Response('Order rejected for asset ID {}'.format(asset_id), status=http_status.HTTP_200_OK)
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.http import FileResponse, Http404
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status as http_status
+
+from api.authentication import CachedTokenAuthentication
+import api.profiling as profiling
+
+
+class ProfileList(APIView):
+    """
+    List the stored request profiles, newest first
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAdminUser,)
+    schema = None
+
+    def get(self, request, format=None):
+        if not settings.PROFILING_DIR:
+            return Response([], status=http_status.HTTP_200_OK)
+        return Response(profiling.list_profiles(), status=http_status.HTTP_200_OK)
+
+
+class ProfileDetail(APIView):
+    """
+    Download a stored request profile
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAdminUser,)
+    schema = None
+
+    def get(self, request, name, format=None):
+        if not settings.PROFILING_DIR or profiling.path(name) is None:
+            raise Http404
+        try:
+            return FileResponse(open(profiling.path(name), 'rb'), as_attachment=True, filename=name)
+        except FileNotFoundError:
+            raise Http404
@@ -1,4 +1,4 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -7,11 +7,13 @@ from rest_framework.serializers import ValidationError
 from django.core.exceptions import ObjectDoesNotExist
 import os
 
+from api.authentication import CachedTokenAuthentication
 from api.serializers import RawPublicationSerializer
 from api.models import Publication, SlpId, Setting, AddressBook
 from api.slp_interface import SlpInterface
 from api.semantics import Semantics
 from api.openapi import RawPublicationSchema
+import api.identity as identity
 
 
 class RawPublicationsView(APIView):
@@ -19,7 +21,7 @@ class RawPublicationsView(APIView):
     Create new or retrieve verifiable publications
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAdminUser,)
 
     schema = RawPublicationSchema()
@@ -33,13 +35,13 @@ class RawPublicationsView(APIView):
 
         if 'slp_id' in serializer.validated_data:
             try:
-                slp_id = SlpId.objects.get(user=request.user, active=True, slp_id=serializer.validated_data["slp_id"])
+                slp_id = identity.get_id(request.user, serializer.validated_data["slp_id"])
             except ObjectDoesNotExist:
                 return Response("Provided Ledger-ID does not exist or is not active", status=http_status.HTTP_404_NOT_FOUND)
         else:
             try:
                 # get most recent, active, slp-id
-                slp_id = SlpId.objects.filter(user=request.user, active=True).order_by('-timestamp')[0]
+                slp_id = identity.default_id(request.user)
             except ObjectDoesNotExist:
                 return Response("User ID does not exist", status=http_status.HTTP_404_NOT_FOUND)
 
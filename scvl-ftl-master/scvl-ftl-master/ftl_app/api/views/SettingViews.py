@@ -1,10 +1,11 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status as http_status
 from django.http import Http404
 
+from api.authentication import CachedTokenAuthentication
 from api.models import Setting
 from api.serializers import SettingSerializer
 from api.permissions import IsAdminOrReadOnly
@@ -16,7 +17,7 @@ class SettingList(APIView):
     List all, or set a setting value
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAdminOrReadOnly,)
 
     # schema = SettingListSchema()
@@ -41,7 +42,7 @@ class SettingDetail(APIView):
     """
     Retrieve, delete or update specific setting
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     # schema = SettingDetailSchema()
@@ -1,10 +1,11 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status as http_status
 from django.http import Http404
 
+from api.authentication import CachedTokenAuthentication
 from api.models import SlpId
 from api.serializers import SlpIdSerializer
 from api.openapi import SlpIdSchema
@@ -14,7 +15,7 @@ class SlpIdList(APIView):
     """
     List all slp-ids, or create a new slp-id
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     schema = SlpIdSchema()
@@ -36,7 +37,7 @@ class SlpIdDetail(APIView):
     """
     Retrieve or delete an SLP-id
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     schema = SlpIdSchema()
@@ -1,4 +1,4 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status as http_status
 from rest_framework.response import Response
@@ -9,9 +9,11 @@ from rest_framework.views import APIView
 from django.http import Http404
 from django.db import IntegrityError
 
+from api.authentication import CachedTokenAuthentication
+
 
 class CreateTokenViews(APIView):
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
     """
     Get, or generate new token
@@ -1,4 +1,4 @@
-from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -7,6 +7,7 @@ from rest_framework import status as http_status
 from django.http import Http404
 from django.contrib.auth.models import User
 
+from api.authentication import CachedTokenAuthentication
 from api.openapi import UserSchema
 from api.serializers import UserSerializer
 
@@ -16,7 +17,7 @@ class UserListView(APIView):
     List all, or create a new user
     """
 
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAdminUser,)
 
     schema = UserSchema()
@@ -40,7 +41,7 @@ class UserDetailView(APIView):
     """
     Get, update or delete single user
     """
-    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication)
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAdminUser,)
 
     schema = UserSchema()
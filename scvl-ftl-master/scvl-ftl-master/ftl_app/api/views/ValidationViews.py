@@ -0,0 +1,49 @@
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status as http_status
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+
+from api.authentication import CachedTokenAuthentication
+from api.openapi import ValidationSchema
+from api.serializers import ValidationCallSerializer
+import api.settings_registry as settings_registry
+import api.shacl as shacl
+
+
+class ValidationView(APIView):
+    """
+    Validate many RDF graphs against a SHACL shape at once,
+    without publishing them
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    schema = ValidationSchema()
+
+    def post(self, request, format=None):
+        serializer = ValidationCallSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=http_status.HTTP_400_BAD_REQUEST)
+        shape = serializer.validated_data['shape']
+        graphs = serializer.validated_data['graphs']
+        if len(graphs) > settings.SHACL_BULK_MAX:
+            return Response("At most {} graphs can be validated per call".format(settings.SHACL_BULK_MAX),
+                            status=http_status.HTTP_400_BAD_REQUEST)
+
+        try:
+            settings_registry.get(shape)
+        except ObjectDoesNotExist:
+            return Response("{} setting not set".format(shape), status=http_status.HTTP_404_NOT_FOUND)
+        if not settings.SHACL_LOCAL_VALIDATION or shacl.validator_for(shape) is None:
+            return Response("{} cannot be validated locally".format(shape),
+                            status=http_status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        results = shacl.validate_many(shape, graphs)
+        return Response([
+            {'conforms': not violations, 'violations': violations}
+            for violations in results
+        ], status=http_status.HTTP_200_OK)
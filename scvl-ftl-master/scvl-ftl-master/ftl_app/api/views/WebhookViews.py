@@ -0,0 +1,72 @@
+from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status as http_status
+from django.http import Http404
+
+from api.authentication import CachedTokenAuthentication
+from api.models import WebhookSubscription
+from api.serializers import WebhookSubscriptionSerializer
+from api.openapi import WebhookSchema
+
+
+class WebhookList(APIView):
+    """
+    List all webhook subscriptions of a user, or subscribe a new endpoint
+    to changes of the user's orders
+    """
+
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    schema = WebhookSchema()
+
+    def get(self, request, format=None):
+        webhooks = WebhookSubscription.objects.filter(user=request.user)
+        serializer = WebhookSubscriptionSerializer(webhooks, many=True)
+        return Response(serializer.data, status=http_status.HTTP_200_OK)
+
+    def post(self, request, format=None):
+        serializer = WebhookSubscriptionSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(user=request.user)
+            return Response(serializer.data, status=http_status.HTTP_200_OK)
+        return Response(serializer.errors, status=http_status.HTTP_400_BAD_REQUEST)
+
+
+class WebhookDetail(APIView):
+    """
+    Retrieve, update or delete a webhook subscription
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    schema = WebhookSchema()
+
+    def get_object(self, user, webhook_id):
+        try:
+            return WebhookSubscription.objects.get(user=user, pk=webhook_id)
+        except WebhookSubscription.DoesNotExist:
+            raise Http404
+
+    def get(self, request, webhook_id):
+        webhook = self.get_object(request.user, webhook_id)
+        serializer = WebhookSubscriptionSerializer(webhook)
+        return Response(serializer.data)
+
+    def delete(self, request, webhook_id):
+        webhook = self.get_object(request.user, webhook_id)
+        try:
+            webhook.delete()
+        except:
+            return Response("Could not delete webhook", status=http_status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response("Deleted webhook %s" % webhook_id)
+
+    def put(self, request, webhook_id):
+        webhook = self.get_object(request.user, webhook_id)
+        serializer = WebhookSubscriptionSerializer(webhook, data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response("Invalid request: %s" % serializer.errors, status=http_status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+        return Response("Updated webhook %s" % webhook_id, status=http_status.HTTP_200_OK)
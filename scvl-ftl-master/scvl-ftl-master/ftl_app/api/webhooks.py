@@ -0,0 +1,339 @@
+"""
+A module that pushes order changes to webhook subscriptions.
+
+Views never wait for deliveries: notify() only looks up the subscribed
+endpoints and hands the notification to the Dispatcher's queue.
+The dispatcher runs in a background thread, and
+- collects notifications per endpoint into batches of up to WEBHOOK_BATCH_SIZE,
+  sent at least every WEBHOOK_BATCH_INTERVAL seconds,
+- delivers batches from a pool of WEBHOOK_WORKERS threads, with no more than
+  max_concurrency (at most WEBHOOK_MAX_CONCURRENCY) deliveries in flight
+  per endpoint, so that no endpoint can take up the whole pool,
+- retries failed deliveries with exponential backoff
+  (WEBHOOK_BACKOFF * 2^attempt seconds), up to WEBHOOK_MAX_ATTEMPTS attempts.
+  While an endpoint is backing off, nothing else is sent to it, and the failed
+  batch is retried before newer notifications, so endpoints with
+  max_concurrency 1 receive notifications in order.
+
+A delivery is a POST of {"notifications": [<change>, ...]} in JSON,
+where every change is formatted as in the changes feed.
+If the subscription has a secret, the body is signed with HMAC-SHA256
+in the X-FTL-Signature header.
+
+Since any user can subscribe an endpoint, webhook URLs must be http(s) URLs
+of public hosts: check_url() rejects hosts that resolve to loopback,
+private, link-local or otherwise non-global addresses, so that the server
+cannot be made to POST to itself or its internal network. It is called
+when a subscription is saved, and again before every delivery, since
+a host may resolve differently by then. As a host can also resolve
+differently between that check and the connection (DNS rebinding),
+deliveries go through PublicAddressAdapter, which checks the address
+every connection was actually made to. Redirects and proxies are not used.
+WEBHOOK_ALLOW_PRIVATE lifts the host check, e.g. for local development.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import requests
+
+from api.models import SlpId, WebhookSubscription
+import api.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+
+def check_url(url):
+    """
+    Raise ValueError if @url may not be used as a webhook endpoint,
+    see the module documentation.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("Webhook URLs must be http or https URLs")
+    if settings.WEBHOOK_ALLOW_PRIVATE:
+        return
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError("Cannot resolve webhook host {}".format(parts.hostname))
+    for family, type, proto, canonname, sockaddr in addresses:
+        check_address(parts.hostname, sockaddr[0])
+
+def check_address(host, address):
+    """
+    Raise ValueError if @address, which @host resolved to,
+    is not a public address.
+    """
+    address = ipaddress.ip_address(address.split('%')[0])
+    if getattr(address, 'ipv4_mapped', None) is not None:
+        address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+        raise ValueError("Webhook host {} is not a public address".format(host))
+
+
+class _CheckedConnectionMixin(object):
+    # Check the address a connection was made to, before anything is sent
+    def _new_conn(self):
+        sock = super()._new_conn()
+        if not settings.WEBHOOK_ALLOW_PRIVATE:
+            try:
+                check_address(self.host, sock.getpeername()[0])
+            except ValueError:
+                sock.close()
+                raise
+        return sock
+
+
+class _CheckedHTTPConnection(_CheckedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CheckedHTTPSConnection(_CheckedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CheckedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CheckedHTTPConnection
+
+
+class _CheckedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CheckedHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """
+    Transport adapter that only connects to public addresses,
+    see the module documentation. Raises ValueError otherwise.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CheckedHTTPConnectionPool,
+            'https': _CheckedHTTPSConnectionPool,
+        }
+
+
+def session():
+    """
+    Return a requests session for webhook deliveries, which ignores
+    proxy settings and cookies and only connects to public addresses.
+    """
+    webhook_session = requests.Session()
+    webhook_session.trust_env = False
+    # Endpoints do not get to set cookies for each other's deliveries
+    webhook_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=()))
+    adapter = PublicAddressAdapter()
+    webhook_session.mount('http://', adapter)
+    webhook_session.mount('https://', adapter)
+    return webhook_session
+
+
+def clamp_concurrency(max_concurrency):
+    """
+    Limit the @max_concurrency of a subscription to 1..WEBHOOK_MAX_CONCURRENCY.
+    """
+    return min(max(1, max_concurrency), max(1, settings.WEBHOOK_MAX_CONCURRENCY))
+
+
+class Endpoint(object):
+    """
+    Delivery state of a single webhook subscription.
+    Only accessed from the dispatcher thread.
+    """
+
+    def __init__(self, subscription_id, url, secret, max_concurrency):
+        self.subscription_id = subscription_id
+        self.url = url
+        self.secret = secret
+        self.max_concurrency = clamp_concurrency(max_concurrency)
+        self.pending = []
+        self.pending_since = None
+        self.in_flight = 0
+        # Backoff state after failed deliveries
+        self.attempt = 0
+        self.retry_at = 0
+
+    def update(self, url, secret, max_concurrency):
+        self.url = url
+        self.secret = secret
+        self.max_concurrency = clamp_concurrency(max_concurrency)
+
+
+class Dispatcher(object):
+    """
+    Batches notifications per endpoint and delivers them asynchronously.
+    """
+
+    def __init__(self, batch_size=None, batch_interval=None, workers=None,
+                 max_attempts=None, backoff=None, timeout=None):
+        self.batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+        self.batch_interval = batch_interval if batch_interval is not None else settings.WEBHOOK_BATCH_INTERVAL
+        self.workers = workers or settings.WEBHOOK_WORKERS
+        self.max_attempts = max_attempts or settings.WEBHOOK_MAX_ATTEMPTS
+        self.backoff = backoff if backoff is not None else settings.WEBHOOK_BACKOFF
+        self.timeout = timeout or settings.WEBHOOK_TIMEOUT
+
+        self._queue = queue.Queue()
+        self._session = session()
+        self._endpoints = {}
+        self._executor = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.delivered = 0
+        self.failed = 0
+
+    def enqueue(self, notification, endpoints):
+        """
+        Queue @notification for delivery to @endpoints,
+        a list of (subscription_id, url, secret, max_concurrency) tuples.
+        Never blocks.
+        """
+        if not endpoints:
+            return
+        self._ensure_started()
+        self._queue.put(('notify', notification, endpoints))
+
+    def queue_depth(self):
+        """
+        Number of notifications that are waiting to be delivered.
+        """
+        return self._queue.qsize() + sum(len(endpoint.pending) for endpoint in list(self._endpoints.values()))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=self._next_wakeup())
+            except queue.Empty:
+                message = None
+            try:
+                if message:
+                    self._handle(message)
+                self._dispatch()
+            except Exception:
+                logger.exception("Webhook dispatcher error")
+
+    def _next_wakeup(self):
+        """
+        Seconds until a batch or retry becomes due (at most one second).
+        """
+        now = time.monotonic()
+        wakeup = now + 1
+        for endpoint in self._endpoints.values():
+            if endpoint.pending:
+                wakeup = min(wakeup, max(endpoint.pending_since + self.batch_interval, endpoint.retry_at))
+        return max(wakeup - now, 0.01)
+
+    def _handle(self, message):
+        if message[0] == 'notify':
+            _, notification, endpoints = message
+            for subscription_id, url, secret, max_concurrency in endpoints:
+                endpoint = self._endpoints.get(subscription_id)
+                if endpoint is None:
+                    endpoint = Endpoint(subscription_id, url, secret, max_concurrency)
+                    self._endpoints[subscription_id] = endpoint
+                else:
+                    endpoint.update(url, secret, max_concurrency)
+                if not endpoint.pending:
+                    endpoint.pending_since = time.monotonic()
+                endpoint.pending.append(notification)
+        elif message[0] == 'done':
+            _, subscription_id, batch, success = message
+            endpoint = self._endpoints[subscription_id]
+            endpoint.in_flight -= 1
+            if success:
+                self.delivered += len(batch)
+                endpoint.attempt = 0
+                return
+            endpoint.attempt += 1
+            if endpoint.attempt < self.max_attempts:
+                # Put the batch back in front and back off
+                metrics.webhook_retries.inc()
+                endpoint.pending = batch + endpoint.pending
+                endpoint.retry_at = time.monotonic() + self.backoff * 2 ** (endpoint.attempt - 1)
+            else:
+                self.failed += len(batch)
+                endpoint.attempt = 0
+                logger.warning("Dropping %d webhook notifications for %s after %d attempts",
+                               len(batch), endpoint.url, self.max_attempts)
+
+    def _dispatch(self):
+        """
+        Send out every batch that is full or has waited long enough,
+        as far as the endpoints' concurrency limits and backoff allow.
+        """
+        now = time.monotonic()
+        for endpoint in self._endpoints.values():
+            while (endpoint.pending and endpoint.in_flight < endpoint.max_concurrency
+                   and now >= endpoint.retry_at and (
+                       len(endpoint.pending) >= self.batch_size
+                       or now - endpoint.pending_since >= self.batch_interval)):
+                batch = endpoint.pending[:self.batch_size]
+                endpoint.pending = endpoint.pending[self.batch_size:]
+                endpoint.pending_since = now
+                endpoint.in_flight += 1
+                self._executor.submit(self._deliver, endpoint.subscription_id,
+                                      endpoint.url, endpoint.secret, batch)
+
+    def _deliver(self, subscription_id, url, secret, batch):
+        """
+        POST a batch to an endpoint (runs in the worker pool)
+        and report the outcome to the dispatcher thread.
+        """
+        body = json.dumps({'notifications': batch}).encode()
+        headers = {'Content-Type': 'application/json'}
+        if secret:
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            headers['X-FTL-Signature'] = 'sha256={}'.format(signature)
+        success = False
+        try:
+            check_url(url)
+            response = self._session.post(url, data=body, headers=headers, timeout=self.timeout,
+                                          allow_redirects=False)
+            success = 200 <= response.status_code < 300
+            if not success:
+                logger.info("Webhook %s answered %s", url, response.status_code)
+        except ValueError as e:
+            logger.warning("Webhook %s refused: %s", url, e)
+        except requests.RequestException as e:
+            logger.info("Webhook %s unreachable: %s", url, e)
+        self._queue.put(('done', subscription_id, batch, success))
+
+
+# Dispatcher shared by all threads in this process
+dispatcher = Dispatcher()
+
+
+def notify(notification, participants):
+    """
+    Queue @notification for all active webhook subscriptions
+    of the users owning one of the @participants' public keys.
+    """
+    users = SlpId.objects.filter(public_key__in=participants).values('user')
+    endpoints = list(WebhookSubscription.objects.filter(active=True, user__in=users)
+                     .values_list('pk', 'url', 'secret', 'max_concurrency'))
+    dispatcher.enqueue(notification, endpoints)
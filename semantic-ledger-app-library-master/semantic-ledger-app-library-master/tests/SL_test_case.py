@@ -9,6 +9,7 @@ from django.contrib.auth.models import User
 from django.core.management import call_command
 
 from api.models import SlpId
+import api.fake_ledger as fake_ledger
 
 import api.tests.testdata as testdata
 import os
@@ -81,9 +82,14 @@ class SLTestCase(APITestCase):
         Before running any tests, this method sets up
         the admin account.
         It also posts SHACL shapes and sets the Settings for them.
+
+        With SLP_URL=fake://, the ledger is served from this process
+        (see api/fake_ledger.py) and available as cls.ledger.
         """
         # Call super for Django TestCase initialization
         super().setUpClass()
+        # Start the fake ledger, if configured (None for a real ledger)
+        cls.ledger = fake_ledger.get(os.getenv('SLP_URL'))
         # Create admin account, set admin token
         admin = User.objects.create_superuser('admin', '', 'hallo123')
         cls.adminToken = Token.objects.get(user=admin)